@@ -5,6 +5,9 @@ from flask import Flask
 # from flask_api import FlaskAPI
 
 from app.api import configure_api
+from app.encoding import configure_compression
+from app.instrumentation import configure_instrumentation
+from app.limits import configure_limits
 from app.models import db
 from config import Env, configure_app, configure_db
 
@@ -17,4 +20,8 @@ def create_app(config_name):
     configure_app(app, config_name)
     configure_db(app, db)
     configure_api(app)
+    configure_instrumentation(app, db)
+    configure_limits(app)
+    # Registered last so it runs first, and instrumentation sees the compressed responses
+    configure_compression(app)
     return app
@@ -1,44 +1,184 @@
 # coding=utf-8
 
 
+import hashlib
+import json
 import os
+import time
+from functools import partial
+from types import SimpleNamespace
 
-from flask import current_app
-from flask_restful import fields, reqparse, Api, Resource, abort, marshal_with
+from flask import Response, current_app, make_response, request, stream_with_context
+from flask_restful import fields, reqparse, Api, Resource, abort, marshal, marshal_with
 from flask_restful import inputs
+from sqlalchemy.exc import IntegrityError
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag, unquote_etag
 
-from app.models import TODOItem, TODOList
+from app.cache import get_response_cache
+from app.encoding import encode_json, etag_matches
+from app.events import SubscriberLimitError, get_event_broker, publish_todoitem_events
+from app.instrumentation import timed
+from app.internal import configure_internal_api
+from app.models import ArchivedTODOItem, IdempotencyKey, MissingTODOListError, TODOItem, TODOList, db
+from app.queries import (
+    EVENT_STREAM_MIMETYPE, NDJSON_MIMETYPE, RANGE_ARGS, SORTS, TODOITEM_FIELDS, TODOITEM_SERIALIZER, decode_cursor,
+    decode_sync_cursor, encode_cursor, encode_sync_cursor, format_server_sent_event, get_list_filters,
+    get_search_errors, parse_datetime, parse_search_terms)
 from config import Env
 
 
-class TODOItemsEndpoint(Resource):
+class BaseTODOItemsEndpoint(Resource):
     """
-    API endpoint to manage TODO items.
+    Base class for all API endpoints that manage TODO items.
+
+    Items are routed by the `todolist_id` URL param. URLs without it (e.g. `/api/todoitems`) manage the items of the
+    default TODO list, just like they did before TODO lists were exposed.
     """
-    default_todolist = None
+    todolist = None
+    include_archived = False
     request_parser = None
 
-    _RESPONSE_FIELDS = {
-        'id': fields.Integer,
-        'name': fields.String,
-        'completed': fields.Boolean,
-        'created': fields.DateTime('iso8601'),
-        'modified': fields.DateTime('iso8601'),
-    }
+    _RESPONSE_FIELDS = TODOITEM_FIELDS
+    _serializer = TODOITEM_SERIALIZER
 
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        self.default_todolist = TODOList.get_default_todolist()
+    def dispatch_request(self, *args, **kwargs):
+        todolist_id = kwargs.pop('todolist_id', None)
+        if todolist_id is None:
+            self.todolist = TODOList.get_default_todolist()
+        else:
+            self.todolist = TODOList.get_by_id(todolist_id)
+            if self.todolist is None:
+                abort(404, message='The requested TODO list does not exist')
+        try:
+            return super().dispatch_request(*args, **kwargs)
+        except MissingTODOListError as e:  # Deleted by another worker, while this one still had it cached
+            TODOList.get_cache().invalidate(e.args[0])
+            abort(404, message='The requested TODO list does not exist')
+
+    def _get_version(self):
+        """
+        Returns the current version of the TODO list. Raises MissingTODOListError if it no longer exists.
+        """
+        version = TODOList.get_version(self.todolist.id)
+        if version is None:
+            raise MissingTODOListError(self.todolist.id)
+        return version
+
+    def _set_request_parser(self, name_required=True):
+        """
+        Establishes the params expected by this endpoint on HTTP POST and PUT methods.
+        """
+        self.request_parser = reqparse.RequestParser(bundle_errors=True)
+        self.request_parser.add_argument('name', type=str, required=name_required, help='What do you have to do?')
+        self.request_parser.add_argument('completed', type=inputs.boolean, help='Did you do it?')
+
+    def _verify_data(self, data):
+        """
+        Verifies if the request data is OK. If not, aborts with HTTP 400.
+        """
+        errors = self._get_data_errors(data)
+        if errors:
+            abort(400, message=errors)
+
+    def _write_idempotently(self, write):
+        """
+        Runs `write()`, which returns the body and status of the response. With an `Idempotency-Key` header, retries of
+        the same request get the first response back (see `IdempotencyKey`), and nothing is written again.
+        """
+        key = request.headers.get('Idempotency-Key')
+        if key is None:
+            return write()
+        if not 0 < len(key) <= 255:
+            abort(400, message={'Idempotency-Key': 'Must have between 1 and 255 chars'})
+        request_hash = hashlib.sha256(request.get_data()).hexdigest()
+        stored_key = IdempotencyKey.get(key, request.path)
+        if stored_key is None:
+            response = IdempotencyKey.run(key, request.path, request_hash, write)
+            if response is not None:
+                return response
+            stored_key = IdempotencyKey.get(key, request.path)  # Another request with the same key got there first
+        if stored_key.request_hash != request_hash:
+            abort(422, message={'Idempotency-Key': 'It was already used for a different request'})
+        if stored_key.status is None:
+            abort(409, message={'Idempotency-Key': 'A request with this key is still running'})
+        return json.loads(stored_key.response), stored_key.status, {'Idempotent-Replayed': 'true'}
+
+    def _wants_archived(self):
+        """
+        Checks if the client wants archived TODO items too (`?include_archived=1`, see `TODOItem.archive_completed`).
+        """
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument(
+            'include_archived', type=inputs.boolean, default=False, location='args', help='Archived ones too?')
+        return parser.parse_args()['include_archived']
+
+    def _get_etag(self, version):
+        """
+        Returns the entity tag of the TODO items of the TODO list, which changes whenever any of them does.
+        """
+        return '{}.{}'.format(self.todolist.id, version)
+
+    def _get_read_columns(self):
+        """
+        Returns the columns to fetch for read-only responses, or None to fetch full ORM instances instead.
+        """
+        return self._serializer.columns if current_app.config['FAST_SERIALIZER'] else None
+
+    def _serialize(self, todoitems):
+        """
+        Serializes the given TODO items (a list of them or a single one), fetched with `_get_read_columns()`.
+        """
+        with timed('serialize'):
+            if not current_app.config['FAST_SERIALIZER']:
+                return marshal(todoitems, self._RESPONSE_FIELDS)
+            if isinstance(todoitems, list):
+                return self._serializer.serialize_many(todoitems)
+            return self._serializer.serialize(todoitems)
+
+    def _get_changes(self, since_version, version):
+        """
+        Returns all changes made to the TODO items after the given version, plus the cursor to use in the next sync.
+
+        Changes are capped at the version read when the request started, so the results are consistent even if other
+        requests keep changing the TODO list meanwhile.
+        """
+        todoitems, deleted_ids = TODOItem.get_changes(
+            self.todolist.id, since_version, version, columns=self._get_read_columns())
+        return {
+            'items': self._serialize(todoitems),
+            'deleted': deleted_ids,
+            'cursor': encode_sync_cursor(version),
+        }
+
+    def _get_data_errors(self, data):
+        """
+        Returns all problems found in the given request data, by param name (empty if the data is OK).
+        """
+        errors = {}
+        # This is just a sample data check
+        if isinstance(data.get('name'), str) and len(data['name']) < 3:
+            errors['name'] = 'You must add a name of at least 3 chars'
+        return errors
+
+
+class TODOItemsEndpoint(BaseTODOItemsEndpoint):
+    """
+    API endpoint to manage TODO items.
+    """
 
-    @marshal_with(_RESPONSE_FIELDS)
     def get(self, todoitem_id=None):
-        # Getting a particular TODO item
-        if todoitem_id:
-            return TODOItem.query.filter_by(id=todoitem_id).first()
-        # Getting them all
-        return TODOItem.get_all(todolist_id=self.default_todolist.id)
+        list_args = None if todoitem_id else self._get_list_args()
+        self.include_archived = self._wants_archived()
+        # Exporting them all without holding the whole list in memory
+        wants_ndjson = not todoitem_id and self._wants_ndjson()
+        if list_args and list_args['stream'] or wants_ndjson:
+            return self._stream_todoitems(ndjson=wants_ndjson)
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            return self._get_cached(response_cache, todoitem_id, list_args)
+        return self._get(todoitem_id, list_args)
 
-    @marshal_with(_RESPONSE_FIELDS)
     def post(self, **kwargs):
         if kwargs:  # POST doesn't expect URL params
             abort(405)
@@ -46,44 +186,187 @@ class TODOItemsEndpoint(Resource):
         request_data = self.request_parser.parse_args()
         self._verify_data(request_data)
 
-        new_todoitem = TODOItem(**request_data)
-        new_todoitem.save()
-        return new_todoitem, 201
+        def write():
+            new_todoitem = TODOItem(todolist_id=self.todolist.id, **request_data)
+            new_todoitem.save(before_commit=lambda: self._publish_item_event('created', new_todoitem))
+            return marshal(new_todoitem, self._RESPONSE_FIELDS), 201
+
+        return self._write_idempotently(write)
 
-    @marshal_with(_RESPONSE_FIELDS)
     def put(self, todoitem_id=None):
         existing_todoitem = self._get_todoitem_or_abort(todoitem_id)
         self._set_request_parser(name_required=False)
         request_data = self.request_parser.parse_args()
         self._verify_data(request_data)
 
-        existing_todoitem.update(**request_data)
-        existing_todoitem.save()
-        return existing_todoitem, 200
+        # Saved only if anything changed, in a single transaction
+        existing_todoitem.update(
+            before_commit=lambda: self._publish_item_event('updated', existing_todoitem), **request_data)
+        return marshal(existing_todoitem, self._RESPONSE_FIELDS), 200
 
-    @marshal_with(_RESPONSE_FIELDS)
+    @marshal_with(BaseTODOItemsEndpoint._RESPONSE_FIELDS)
     def delete(self, todoitem_id=None):
         existing_todoitem = self._get_todoitem_or_abort(todoitem_id)
-        existing_todoitem.delete()
+        existing_todoitem.delete(before_commit=lambda version: publish_todoitem_events(
+            self.todolist.id, version, [{'type': 'deleted', 'id': todoitem_id}]))
         return {}, 204
 
-    def _set_request_parser(self, name_required=True):
+    def _publish_item_event(self, event_type, todoitem):
         """
-        Establishes the params expected by this endpoint on HTTP POST and PUT methods.
+        Publishes the event of a created or updated item, within the transaction that saves it.
         """
-        self.request_parser = reqparse.RequestParser(bundle_errors=True)
-        self.request_parser.add_argument('name', type=str, required=name_required, help='What do you have to do?')
-        self.request_parser.add_argument('completed', type=inputs.boolean, help='Did you do it?')
+        publish_todoitem_events(self.todolist.id, todoitem.version, [
+            {'type': event_type, 'item': marshal(todoitem, self._RESPONSE_FIELDS)}])
 
-    def _verify_data(self, data):
+    def _get(self, todoitem_id, list_args):
         """
-        Verifies if the request data is OK. If not, aborts with HTTP 400.
+        Returns a particular TODO item or a list of them, based on the given query string params.
         """
-        # This is just a sample data check
-        if isinstance(data.get('name'), str) and len(data['name']) < 3:
-            abort(400, message={'name': 'You must add a name of at least 3 chars'})
-        # Adding default data
-        data['todolist_id'] = self.default_todolist.id
+        # Answering conditional requests without loading any TODO items
+        version = self._get_version()
+        etag = self._get_etag(version)
+        headers = {'ETag': quote_etag(etag)}
+        if etag_matches(etag):
+            return Response(status=304, headers=headers)
+        # Getting a particular TODO item
+        if todoitem_id:
+            todoitem = TODOItem.get_by_id(todoitem_id, todolist_id=self.todolist.id, columns=self._get_read_columns(),
+                                          include_archived=self.include_archived)
+            return self._serialize(todoitem), 200, headers
+        # Getting only what changed since the client's last sync (archived items show up as deleted)
+        if list_args['since'] is not None:
+            return self._get_changes(list_args['since'], version), 200, headers
+        # Searching by name, best matches first
+        if list_args['q'] is not None:
+            errors = get_search_errors(request.args)
+            if errors:
+                abort(400, message=errors)
+            limit = list_args['limit'] or current_app.config['TODOITEMS_PAGE_SIZE']
+            list_filters = get_list_filters(list_args)
+            todoitems = TODOItem.search(
+                self.todolist.id, list_args['q'], limit, columns=self._get_read_columns(),
+                include_archived=self.include_archived, completed=list_filters['completed'],
+                ranges=list_filters['ranges'])
+            return self._serialize(todoitems), 200, headers
+        list_filters = self._get_list_filters(list_args)
+        # Getting them all, unless the client asked for a single page
+        if list_args['limit'] is None and list_args['after'] is None:
+            todoitems = TODOItem.get_all(self.todolist.id, columns=self._get_read_columns(),
+                                         include_archived=self.include_archived, **list_filters)
+            return self._serialize(todoitems), 200, headers
+        limit = list_args['limit'] or current_app.config['TODOITEMS_PAGE_SIZE']
+        after = None
+        if list_args['after'] is not None:
+            after_value, after_id, after_sort = list_args['after']
+            if after_sort != list_args['sort']:
+                abort(400, message={'after': 'This cursor belongs to a list sorted by {}'.format(after_sort)})
+            after = after_value, after_id
+        # Fetching one extra item tells us whether there is a next page without running a COUNT
+        todoitems = TODOItem.get_page(self.todolist.id, limit + 1, after=after, columns=self._get_read_columns(),
+                                      include_archived=self.include_archived, **list_filters)
+        if len(todoitems) > limit:
+            todoitems = todoitems[:limit]
+            headers['X-Next-Cursor'] = encode_cursor(todoitems[-1], sort=list_args['sort'])
+        return self._serialize(todoitems), 200, headers
+
+    def _get_cached(self, response_cache, todoitem_id, list_args):
+        """
+        Same as `_get`, but serving responses from the given response cache (and storing them on misses). Hits don't
+        touch the DB at all.
+        """
+        # The key is built before reading the DB, so writes committed meanwhile make the new entry unreachable
+        if todoitem_id:
+            cache_key = response_cache.get_todoitem_key(self.todolist.id, todoitem_id, self.include_archived)
+        else:
+            args = ['{}={}'.format(k, v) for k, v in request.args.items(multi=True)]
+            cache_key = response_cache.get_todoitems_key(self.todolist.id, args)
+        cached_response = response_cache.get(cache_key)
+        if cached_response is not None:
+            body, headers = cached_response
+            if etag_matches(unquote_etag(headers['ETag'])[0]):
+                return Response(status=304, headers={'ETag': headers['ETag']})
+            return Response(body, mimetype='application/json', headers=headers)
+
+        # Misses are read from the primary DB: a lagging replica would fill the cache with stale responses until they
+        # expire, since the writes that invalidated it have already happened
+        db.session().use_primary()
+        response = self._get(todoitem_id, list_args)
+        if isinstance(response, Response):
+            return response
+        data, code, headers = response
+        response = _output_json(data, code, headers)
+        response.mimetype = 'application/json'
+        response_cache.set(cache_key, response.get_data(), headers)
+        return response
+
+    def _get_list_args(self):
+        """
+        Parses the optional query string params accepted when listing TODO items.
+        """
+        list_parser = reqparse.RequestParser(bundle_errors=True)
+        list_parser.add_argument(
+            'limit', type=inputs.int_range(1, current_app.config['TODOITEMS_MAX_PAGE_SIZE'], argument='limit'),
+            location='args', help='How many items do you want per page?')
+        list_parser.add_argument('after', type=decode_cursor, location='args', help='Where does the page start?')
+        list_parser.add_argument('since', type=decode_sync_cursor, location='args', help='When did you last sync?')
+        list_parser.add_argument('stream', type=inputs.boolean, location='args', help='Do you want them all at once?')
+        list_parser.add_argument('q', type=parse_search_terms, location='args', help='What are you looking for?')
+        list_parser.add_argument('completed', type=inputs.boolean, location='args', help='Open or completed ones?')
+        list_parser.add_argument(
+            'sort', choices=SORTS, default=SORTS[0], location='args', help='How do you want them sorted?')
+        for range_arg in RANGE_ARGS:
+            list_parser.add_argument(range_arg, type=parse_datetime, location='args', help='Since or until when?')
+        return list_parser.parse_args()
+
+    def _get_list_filters(self, list_args):
+        """
+        Returns the sort and filters of a list query out of the given query string params. If no index supports them,
+        aborts with HTTP 400.
+        """
+        list_filters = get_list_filters(list_args)
+        try:
+            TODOItem.get_list_criteria(self.todolist.id, **list_filters)
+        except ValueError as e:
+            abort(400, message={'sort': str(e)})
+        return list_filters
+
+    def _wants_ndjson(self):
+        """
+        Checks if the client prefers newline-delimited JSON over plain JSON.
+        """
+        best_mimetype = request.accept_mimetypes.best_match(['application/json', NDJSON_MIMETYPE])
+        return best_mimetype == NDJSON_MIMETYPE
+
+    def _stream_todoitems(self, ndjson=False):
+        """
+        Returns a response that writes all TODO items while they are read from a server-side cursor, either as a single
+        JSON array or as newline-delimited JSON (one item per line).
+        """
+        batch_size = current_app.config['TODOITEMS_STREAM_BATCH_SIZE']
+        todoitems = TODOItem.iter_all(self.todolist.id, batch_size=batch_size, columns=self._get_read_columns(),
+                                      include_archived=self.include_archived)
+        # Items are serialized one by one, so they skip `_serialize()` and its timer
+        if current_app.config['FAST_SERIALIZER']:
+            serialize = self._serializer.serialize
+        else:
+            serialize = partial(marshal, fields=self._RESPONSE_FIELDS)
+
+        def generate():
+            chunk = [] if ndjson else [b'[']
+            for idx, todoitem in enumerate(todoitems):
+                if idx and not ndjson:
+                    chunk.append(b',')
+                chunk.append(encode_json(serialize(todoitem)))
+                if ndjson:
+                    chunk.append(b'\n')
+                if len(chunk) >= batch_size:
+                    yield b''.join(chunk)
+                    chunk = []
+            if not ndjson:
+                chunk.append(b']\n')
+            yield b''.join(chunk)
+
+        return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE if ndjson else 'application/json')
 
     def _get_todoitem_or_abort(self, todoitem_id):
         """
@@ -91,15 +374,367 @@ class TODOItemsEndpoint(Resource):
         """
         if not todoitem_id:
             abort(404, message='You must provide a valid ID')
-        existing_todoitem = TODOItem.query.filter_by(id=todoitem_id).first()
+        existing_todoitem = TODOItem.query.filter_by(id=todoitem_id, todolist_id=self.todolist.id).first()
         if not existing_todoitem:
             abort(404, message='The requested TODO item does not exist')
         return existing_todoitem
 
 
+class TODOItemsBatchEndpoint(BaseTODOItemsEndpoint):
+    """
+    API endpoint to create, update and delete many TODO items at once.
+
+    Every item is validated just like in `TODOItemsEndpoint`, and all valid changes are applied in a single transaction.
+    The response holds one result per item, in the same order as the request.
+    """
+
+    def post(self):
+        batch_data = request.get_json(silent=True)
+        if not isinstance(batch_data, dict):
+            abort(400, message='You must send a JSON object with "create", "update" and/or "delete" lists')
+        operations = {x: batch_data.get(x) or [] for x in ('create', 'update', 'delete')}
+        errors = {k: 'Must be a list' for k, v in operations.items() if not isinstance(v, list)}
+        if errors:
+            abort(400, message=errors)
+        if sum(len(x) for x in operations.values()) > current_app.config['TODOITEMS_MAX_BATCH_SIZE']:
+            abort(400, message='You can change up to {} items at once'.format(
+                current_app.config['TODOITEMS_MAX_BATCH_SIZE']))
+
+        results = {x: [] for x in operations}
+        creates, updates, deletes = [], {}, []
+        for item_data in operations['create']:
+            data, errors = self._parse_item(item_data)
+            if errors:
+                results['create'].append({'status': 400, 'message': errors})
+                continue
+            creates.append({'name': data['name'], 'completed': bool(data['completed'])})
+            results['create'].append(None)  # Filled in once the item exists
+        for item_data in operations['update']:
+            todoitem_id = item_data.get('id') if isinstance(item_data, dict) else None
+            data, errors = self._parse_item(item_data, name_required=False)
+            errors.update(self._get_id_errors(todoitem_id, updates, deletes))
+            if errors:
+                results['update'].append({'id': todoitem_id, 'status': 400, 'message': errors})
+                continue
+            updates[todoitem_id] = {k: v for k, v in data.items() if v is not None}
+            results['update'].append({'id': todoitem_id})
+        for todoitem_id in operations['delete']:
+            errors = self._get_id_errors(todoitem_id, updates, deletes)
+            if errors:
+                results['delete'].append({'id': todoitem_id, 'status': 400, 'message': errors})
+                continue
+            deletes.append(todoitem_id)
+            results['delete'].append({'id': todoitem_id})
+
+        def publish(created, updated, deleted_ids, version):
+            self._fill_results(results, created, updated, deleted_ids)
+            publish_todoitem_events(self.todolist.id, version, self._get_events(results, updated, version))
+
+        def write():
+            created, updated, deleted_ids, _ = TODOItem.apply_batch(
+                self.todolist.id, creates, updates, deletes, before_commit=publish)
+            self._fill_results(results, created, updated, deleted_ids)  # Already done if anything changed
+            return results, 200
+
+        return self._write_idempotently(write)
+
+    def _fill_results(self, results, created, updated, deleted_ids):
+        """
+        Fills in the results of the valid items of the batch, once `TODOItem.apply_batch` is done with them. Results
+        already filled in are left as they are.
+        """
+        created = iter(created)
+        for idx, result in enumerate(results['create']):
+            if result is None:
+                results['create'][idx] = {'status': 201, 'item': marshal(next(created), self._RESPONSE_FIELDS)}
+        for result in results['update']:
+            if 'status' in result:
+                continue
+            if result['id'] in updated:
+                result.update(status=200, item=marshal(updated[result['id']], self._RESPONSE_FIELDS))
+            else:
+                result.update(status=404, message='The requested TODO item does not exist')
+        for result in results['delete']:
+            if 'status' in result:
+                continue
+            if result['id'] in deleted_ids:
+                result['status'] = 204
+            else:
+                result.update(status=404, message='The requested TODO item does not exist')
+
+    def _get_events(self, results, updated, version):
+        """
+        Returns the events of the items changed by the batch, in the same order as the request.
+        """
+        events = [{'type': 'created', 'item': x['item']} for x in results['create'] if x['status'] == 201]
+        # Updated items that didn't change keep their previous version
+        events.extend({'type': 'updated', 'item': x['item']} for x in results['update']
+                      if x['status'] == 200 and updated[x['id']]['version'] == version)
+        events.extend({'type': 'deleted', 'id': x['id']} for x in results['delete'] if x['status'] == 204)
+        return events
+
+    def _parse_item(self, item_data, name_required=True):
+        """
+        Parses a single item of the batch with the same params used by `TODOItemsEndpoint`. Returns the parsed data and
+        all problems found in it, by param name (empty if the item is OK).
+        """
+        if not isinstance(item_data, dict):
+            return None, {'item': 'Each item must be a JSON object'}
+        self._set_request_parser(name_required=name_required)
+        try:
+            data = self.request_parser.parse_args(req=SimpleNamespace(json=item_data))
+        except HTTPException as e:
+            return None, dict(e.data['message'])
+        return data, self._get_data_errors(data)
+
+    def _get_id_errors(self, todoitem_id, *used_ids):
+        """
+        Returns all problems found in an ID to update or delete, if any.
+        """
+        if isinstance(todoitem_id, bool) or not isinstance(todoitem_id, int) or todoitem_id < 1:
+            return {'id': 'You must provide a valid ID'}
+        if any(todoitem_id in x for x in used_ids):
+            return {'id': 'Each item can only be changed once per batch'}
+        return {}
+
+
+class TODOItemsStatsEndpoint(BaseTODOItemsEndpoint):
+    """
+    API endpoint with the item counts of a TODO list.
+
+    Counts are kept up to date on every write (see `TODOList.bump_version`), so reading them takes a single query no
+    matter how many items the list has.
+    """
+
+    def get(self):
+        counts = TODOList.get_counts(self.todolist.id)
+        if counts is None:
+            raise MissingTODOListError(self.todolist.id)
+        version, total, completed = counts
+        etag = self._get_etag(version)
+        headers = {'ETag': quote_etag(etag)}
+        if etag_matches(etag):
+            return Response(status=304, headers=headers)
+        # Archived items aren't part of the counts, so they're counted on demand (they're all completed)
+        if self._wants_archived():
+            archived = ArchivedTODOItem.count(self.todolist.id)
+            total, completed = total + archived, completed + archived
+        return {'total': total, 'completed': completed, 'open': total - completed}, 200, headers
+
+
+class TODOItemsEventsEndpoint(BaseTODOItemsEndpoint):
+    """
+    API endpoint with the changes made to the TODO items of a TODO list, as they happen.
+
+    Clients that accept `text/event-stream` get server-sent events: "created", "updated" and "deleted" ones as writes
+    commit, and "sync" ones (shaped like a delta sync) whenever they have to catch up from the DB, e.g. when resuming
+    from the `Last-Event-ID` or a `since` cursor, or after falling behind. Every other client long-polls: the request
+    waits until there are changes after the `since` cursor (or `EVENTS_POLL_TIMEOUT` seconds pass), and returns them
+    as a delta sync. Either way, no DB connection is held while waiting.
+    """
+    # Waiting for events doesn't count against `MAX_IN_FLIGHT`
+    admission_controlled = False
+    # Catching up from a lagging replica would send events out of order
+    replica_reads = False
+
+    def get(self):
+        event_broker = get_event_broker()
+        if event_broker is None:
+            abort(404, message='Events are disabled')
+        since = self._get_since()
+        # Subscribing before reading the version of the TODO list, so nothing committed in between is missed
+        try:
+            subscription = event_broker.subscribe(self.todolist.id)
+        except SubscriberLimitError:
+            return ({'message': 'Too many clients are waiting for events, try again later'}, 503,
+                    {'Retry-After': str(current_app.config['SHED_RETRY_AFTER'])})
+        best_mimetype = request.accept_mimetypes.best_match(['application/json', EVENT_STREAM_MIMETYPE])
+        if best_mimetype == EVENT_STREAM_MIMETYPE:
+            return self._stream_events(subscription, since)
+        try:
+            return self._poll_events(subscription, since), 200, {'Cache-Control': 'no-cache'}
+        finally:
+            subscription.close()
+
+    def _get_since(self):
+        """
+        Returns the TODO list version the client already has, if any. If its cursor isn't valid, aborts with HTTP 400.
+        """
+        # Event IDs are sync cursors too, so resuming event streams send the last one they got
+        cursor = request.args.get('since', request.headers.get('Last-Event-ID'))
+        if cursor is None:
+            return None
+        try:
+            return decode_sync_cursor(cursor)
+        except ValueError as e:
+            abort(400, message={'since': str(e)})
+
+    def _stream_events(self, subscription, since):
+        """
+        Returns a stream of server-sent events, which ends after `EVENTS_STREAM_DURATION` seconds so clients reconnect
+        (and resume) from time to time.
+        """
+        heartbeat, duration = current_app.config['EVENTS_HEARTBEAT'], current_app.config['EVENTS_STREAM_DURATION']
+        try:
+            version = self._get_version()
+            first_chunk = self._format_sync_event(since, version) if since is not None and since < version else ':\n\n'
+        except Exception:
+            subscription.close()
+            raise
+        db.session.close()  # Idle streams don't hold a DB connection
+
+        def generate(last_version):
+            try:
+                yield first_chunk
+                deadline = time.monotonic() + duration
+                while time.monotonic() < deadline:
+                    message = subscription.get(min(heartbeat, deadline - time.monotonic()))
+                    if message is None:
+                        yield ': keep-alive\n\n'
+                    elif message['version'] is not None and message['version'] <= last_version:
+                        continue  # Already sent
+                    elif message['events'] is None or message['version'] != last_version + 1:
+                        # Missed (or not yet arrived) messages, since versions are consecutive: catching up from the DB
+                        version = TODOList.get_version(self.todolist.id)
+                        if version is None:  # The TODO list was deleted
+                            return
+                        if version > last_version:
+                            yield self._format_sync_event(last_version, version)
+                            last_version = version
+                        db.session.close()
+                    else:
+                        yield ''.join(format_server_sent_event(
+                            x['type'], x.get('item', {'id': x.get('id')}),
+                            encode_sync_cursor(message['version']) if idx == len(message['events']) - 1 else None,
+                        ) for idx, x in enumerate(message['events']))
+                        last_version = message['version']
+            finally:
+                subscription.close()
+
+        return Response(stream_with_context(generate(max(version, since or 0))), mimetype=EVENT_STREAM_MIMETYPE,
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    def _poll_events(self, subscription, since):
+        """
+        Waits until the TODO list changes after the given version (or the current one), and returns the changes.
+        """
+        version = self._get_version()
+        since = version if since is None else since
+        deadline = time.monotonic() + current_app.config['EVENTS_POLL_TIMEOUT']
+        while version <= since:
+            db.session.close()  # Waiting doesn't hold a DB connection
+            message = subscription.get(max(0, deadline - time.monotonic()))
+            if message is None:
+                break
+            if message['version'] is None or message['version'] > since:
+                version = self._get_version()
+        return self._get_changes(since, version)
+
+    def _format_sync_event(self, since_version, version):
+        return format_server_sent_event('sync', self._get_changes(since_version, version), encode_sync_cursor(version))
+
+
+class TODOListsEndpoint(Resource):
+    """
+    API endpoint to manage TODO lists. Their items are managed through `TODOItemsEndpoint`.
+    """
+    request_parser = None
+
+    _RESPONSE_FIELDS = {
+        'id': fields.Integer,
+        'name': fields.String,
+        'created': fields.DateTime('iso8601'),
+        'modified': fields.DateTime('iso8601'),
+    }
+
+    @marshal_with(_RESPONSE_FIELDS)
+    def get(self, todolist_id=None):
+        if todolist_id:
+            return self._get_todolist_or_abort(todolist_id), 200
+        return TODOList.get_all(), 200
+
+    @marshal_with(_RESPONSE_FIELDS)
+    def post(self, **kwargs):
+        if kwargs:  # POST doesn't expect URL params
+            abort(405)
+        request_data = self._parse_request_data()
+        new_todolist = TODOList(**request_data)
+        self._save_or_abort(new_todolist)
+        return new_todolist, 201
+
+    @marshal_with(_RESPONSE_FIELDS)
+    def put(self, todolist_id=None):
+        existing_todolist = self._get_todolist_or_abort(todolist_id, for_update=True)
+        request_data = self._parse_request_data()
+        if request_data['name'] != existing_todolist.name:
+            existing_todolist.name = request_data['name']
+            self._save_or_abort(existing_todolist)
+        return existing_todolist, 200
+
+    @marshal_with(_RESPONSE_FIELDS)
+    def delete(self, todolist_id=None):
+        existing_todolist = self._get_todolist_or_abort(todolist_id, for_update=True)
+        existing_todolist.delete()
+        return {}, 204
+
+    def _parse_request_data(self):
+        """
+        Parses the params expected on HTTP POST and PUT methods. If they aren't OK, aborts with HTTP 400.
+        """
+        self.request_parser = reqparse.RequestParser(bundle_errors=True)
+        self.request_parser.add_argument('name', type=str, required=True, help='How do you want to call it?')
+        request_data = self.request_parser.parse_args()
+        if len(request_data['name']) < 3:
+            abort(400, message={'name': 'You must add a name of at least 3 chars'})
+        return request_data
+
+    def _save_or_abort(self, todolist):
+        """
+        Saves the given TODO list. If its name is already taken, aborts with HTTP 400.
+        """
+        # The unique index is the only check that holds up against concurrent requests
+        try:
+            todolist.save()
+        except IntegrityError:
+            db.session.rollback()
+            abort(400, message={'name': 'There is already a TODO list with that name'})
+
+    def _get_todolist_or_abort(self, todolist_id, for_update=False):
+        """
+        Verifies if the given TODO list exists (and, when it's about to change, that it isn't the default one). If not,
+        aborts with HTTP 404 (or 400).
+        """
+        if not todolist_id:
+            abort(404, message='You must provide a valid ID')
+        # Read from the DB, since another worker may have changed it while this one had it cached
+        existing_todolist = TODOList.get_by_id(todolist_id, cached=False)
+        if not existing_todolist:
+            abort(404, message='The requested TODO list does not exist')
+        if for_update and existing_todolist.name == current_app.config['DEFAULT_TODO_LIST_NAME']:
+            abort(400, message='The default TODO list cannot be changed')
+        return existing_todolist
+
+
+def _output_json(data, code, headers=None):
+    # Unlike flask_restful's, bodies are never indented (not even in debug mode), and the JSON encoder is swappable
+    with timed('serialize'):
+        response = make_response(encode_json(data) + b'\n', code)
+    response.headers.extend(headers or {})
+    return response
+
+
 def configure_api(app):
     """
     Attaches an API to the given Flask app.
     """
     api = Api(app)
-    api.add_resource(TODOItemsEndpoint, '/api/todoitems', '/api/todoitems/<int:todoitem_id>')
+    api.representations['application/json'] = _output_json
+    api.add_resource(TODOListsEndpoint, '/api/todolists', '/api/todolists/<int:todolist_id>')
+    api.add_resource(
+        TODOItemsEndpoint, '/api/todoitems', '/api/todoitems/<int:todoitem_id>',
+        '/api/todolists/<int:todolist_id>/items', '/api/todolists/<int:todolist_id>/items/<int:todoitem_id>')
+    api.add_resource(TODOItemsBatchEndpoint, '/api/todoitems/batch', '/api/todolists/<int:todolist_id>/items/batch')
+    api.add_resource(TODOItemsStatsEndpoint, '/api/todoitems/stats', '/api/todolists/<int:todolist_id>/items/stats')
+    api.add_resource(
+        TODOItemsEventsEndpoint, '/api/todoitems/events', '/api/todolists/<int:todolist_id>/items/events')
+    configure_internal_api(app, api)
@@ -0,0 +1,642 @@
+# coding=utf-8
+
+
+import asyncio
+import contextlib
+import json
+import time
+from types import SimpleNamespace
+
+import asyncpg
+from databases import Database
+from flask_restful import inputs
+from sqlalchemy import and_, func, select
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header, parse_etags, quote_etag
+from werkzeug.utils import import_string
+
+from app.encoding import dumps_compact, encode_json, load_json_encoder
+from app.events import EventBroker, PostgresTransport, Subscription, SubscriberLimitError
+from app.models import ArchivedTODOItem, TODOItem, TODOItemTombstone, TODOList
+from app.queries import (
+    EVENT_STREAM_MIMETYPE, NDJSON_MIMETYPE, RANGE_ARGS, SORTS, TODOITEM_SERIALIZER, decode_cursor, decode_sync_cursor,
+    encode_cursor, encode_sync_cursor, format_server_sent_event, get_list_filters, get_search_errors, parse_datetime,
+    parse_search_terms)
+from config import get_config
+
+_archived_todoitems = ArchivedTODOItem.__table__
+_todoitems = TODOItem.__table__
+_todolists = TODOList.__table__
+_tombstones = TODOItemTombstone.__table__
+
+
+class AsyncTODOItemsAPI(object):
+    """
+    Async version of the TODO items API (see `app.api.TODOItemsEndpoint`), meant to be served from an event loop by an
+    ASGI server (see `asgi.py`).
+
+    It answers the same TODO item URLs (of the default TODO list and of each list by ID) with the same params,
+    responses, errors and ETags, but the DB is reached through asyncpg and its own connection pool, so a single process
+    serves many concurrent requests while others wait on the DB (archived TODO items included, see
+    `TODOItem.archive_completed`). TODO lists themselves are only managed by the sync API.
+    Queries are built out of the tables in `app.models`, which stays the only definition of the schema.
+
+    It also serves the change feed (see `app.api.TODOItemsEventsEndpoint`), whose clients just wait on the event loop
+    instead of holding a thread of a sync worker each. Its events go through Postgres (see `AsyncPostgresTransport`),
+    so they're shared with the sync app as long as it uses `app.events.PostgresTransport` too.
+    """
+    _serializer = TODOITEM_SERIALIZER
+
+    def __init__(self, config):
+        self.config = config
+        self.database = Database(
+            config.SQLALCHEMY_DATABASE_URI, min_size=1, max_size=config.DB_POOL_SIZE + config.DB_MAX_OVERFLOW)
+        self.event_broker = _get_event_broker(config, self.database)
+        self.json_encoder = load_json_encoder(config.JSON_ENCODER)
+        self.default_todolist_id = None
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self, app):
+        await self.database.connect()
+        self.default_todolist_id = await self._get_default_todolist_id()
+        yield
+        if self.event_broker is not None:
+            await self.event_broker.transport.close()
+        await self.database.disconnect()
+
+    async def todoitems(self, request):
+        todolist_id = await self._get_todolist_id(request)
+        if todolist_id is None:
+            return _error(404, 'The requested TODO list does not exist')
+        if request.method == 'GET':
+            return await self._get_todoitems(request, todolist_id)
+        if request.method == 'POST':
+            return await self._post(request, todolist_id)
+        return _error(404, 'You must provide a valid ID')
+
+    async def todoitem(self, request):
+        todolist_id = await self._get_todolist_id(request)
+        if todolist_id is None:
+            return _error(404, 'The requested TODO list does not exist')
+        todoitem_id = request.path_params['todoitem_id']
+        if request.method == 'GET':
+            return await self._get_todoitem(request, todolist_id, todoitem_id)
+        if request.method == 'PUT':
+            return await self._put(request, todolist_id, todoitem_id)
+        if request.method == 'DELETE':
+            return await self._delete(todolist_id, todoitem_id)
+        return _error(405, 'The method is not allowed for the requested URL.')
+
+    async def stats(self, request):
+        todolist_id = await self._get_todolist_id(request)
+        if todolist_id is None:
+            return _error(404, 'The requested TODO list does not exist')
+        query = select([_todolists.c.version, _todolists.c.item_count, _todolists.c.completed_count]).where(
+            _todolists.c.id == todolist_id)
+        # Records are mappings, so they're read by key
+        counts = await self.database.fetch_one(query)
+        if counts is None:  # Deleted since it was looked up
+            return _error(404, 'The requested TODO list does not exist')
+        version, total, completed = counts['version'], counts['item_count'], counts['completed_count']
+        etag = self._get_etag(todolist_id, version)
+        headers = {'ETag': quote_etag(etag)}
+        if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+            return Response(status_code=304, headers=headers)
+        include_archived, error_response = self._wants_archived(request)
+        if error_response:
+            return error_response
+        # Archived items aren't part of the counts, so they're counted on demand (they're all completed)
+        if include_archived:
+            archived = await self.database.fetch_val(select([func.count()]).select_from(_archived_todoitems).where(
+                _archived_todoitems.c.todolist_id == todolist_id))
+            total, completed = total + archived, completed + archived
+        return self._json_response({'total': total, 'completed': completed, 'open': total - completed}, headers=headers)
+
+    async def events(self, request):
+        todolist_id = await self._get_todolist_id(request)
+        if todolist_id is None:
+            return _error(404, 'The requested TODO list does not exist')
+        if self.event_broker is None:
+            return _error(404, 'Events are disabled')
+        # Event IDs are sync cursors too, so resuming event streams send the last one they got
+        cursor = request.query_params.get('since', request.headers.get('Last-Event-ID'))
+        try:
+            since = decode_sync_cursor(cursor) if cursor is not None else None
+        except ValueError as e:
+            return _error(400, {'since': str(e)})
+        # Subscribing before reading the version of the TODO list, so nothing committed in between is missed
+        try:
+            subscription = self.event_broker.subscribe(todolist_id)
+        except SubscriberLimitError:
+            return self._json_response({'message': 'Too many clients are waiting for events, try again later'},
+                                       status_code=503, headers={'Retry-After': str(self.config.SHED_RETRY_AFTER)})
+        accept = parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+        if accept.best_match(['application/json', EVENT_STREAM_MIMETYPE]) == EVENT_STREAM_MIMETYPE:
+            return await self._stream_events(todolist_id, subscription, since)
+        try:
+            changes = await self._poll_events(todolist_id, subscription, since)
+        finally:
+            subscription.close()
+        if changes is None:
+            return _error(404, 'The requested TODO list does not exist')
+        return self._json_response(changes, headers={'Cache-Control': 'no-cache'})
+
+    async def _get_todoitems(self, request, todolist_id):
+        list_args, errors = self._get_list_args(request.query_params)
+        if errors:
+            return _error(400, errors)
+        include_archived, error_response = self._wants_archived(request)
+        if error_response:
+            return error_response
+        wants_ndjson = self._wants_ndjson(request)
+        if list_args['stream'] or wants_ndjson:
+            return self._stream_todoitems(todolist_id, ndjson=wants_ndjson, include_archived=include_archived)
+
+        version = await self._get_version(todolist_id)
+        etag = self._get_etag(todolist_id, version)
+        headers = {'ETag': quote_etag(etag)}
+        if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+            return Response(status_code=304, headers=headers)
+        # Getting only what changed since the client's last sync (archived items show up as deleted)
+        if list_args['since'] is not None:
+            changes = await self._get_changes(todolist_id, list_args['since'], version)
+            return self._json_response(changes, headers=headers)
+        # Searching by name, best matches first
+        if list_args['q'] is not None:
+            errors = get_search_errors(request.query_params)
+            if errors:
+                return _error(400, errors)
+            list_filters = get_list_filters(list_args)
+            entity = TODOItem._get_entity(include_archived, list_filters['completed'])
+            criterion, order_by = TODOItem.get_search_criteria(
+                list_args['q'], 'postgresql', entity, list_filters['completed'], list_filters['ranges'])
+            query = select(self._get_columns(entity)).where(and_(
+                entity.todolist_id == todolist_id, criterion,
+            )).order_by(*order_by).limit(list_args['limit'] or self.config.TODOITEMS_PAGE_SIZE)
+            return self._json_response(self._serialize(await self.database.fetch_all(query)), headers=headers)
+        after = None
+        if list_args['after'] is not None:
+            after_value, after_id, after_sort = list_args['after']
+            if after_sort != list_args['sort']:
+                return _error(400, {'after': 'This cursor belongs to a list sorted by {}'.format(after_sort)})
+            after = after_value, after_id
+        try:
+            query = self._get_sorted_query(
+                todolist_id, include_archived=include_archived, after=after, **get_list_filters(list_args))
+        except ValueError as e:
+            return _error(400, {'sort': str(e)})
+        # Getting them all, unless the client asked for a single page
+        if list_args['limit'] is None and list_args['after'] is None:
+            return self._json_response(self._serialize(await self.database.fetch_all(query)), headers=headers)
+        limit = list_args['limit'] or self.config.TODOITEMS_PAGE_SIZE
+        # Fetching one extra item tells us whether there is a next page without running a COUNT
+        todoitems = await self.database.fetch_all(query.limit(limit + 1))
+        if len(todoitems) > limit:
+            todoitems = todoitems[:limit]
+            last_todoitem = SimpleNamespace(**{x: todoitems[-1][x] for x in self._serializer.keys})
+            headers['X-Next-Cursor'] = encode_cursor(last_todoitem, sort=list_args['sort'])
+        return self._json_response(self._serialize(todoitems), headers=headers)
+
+    async def _get_todoitem(self, request, todolist_id, todoitem_id):
+        include_archived, error_response = self._wants_archived(request)
+        if error_response:
+            return error_response
+        version = await self._get_version(todolist_id)
+        etag = self._get_etag(todolist_id, version)
+        headers = {'ETag': quote_etag(etag)}
+        if parse_etags(request.headers.get('If-None-Match')).contains_weak(etag):
+            return Response(status_code=304, headers=headers)
+        entity = TODOItem._get_entity(include_archived)
+        query = select(self._get_columns(entity)).where(and_(
+            entity.todolist_id == todolist_id, entity.id == todoitem_id))
+        return self._json_response(self._serialize_one(await self.database.fetch_one(query)), headers=headers)
+
+    async def _post(self, request, todolist_id):
+        request_data, error_response = await self._get_request_data(request)
+        if error_response:
+            return error_response
+        data, errors = self._parse_item(request_data)
+        if errors:
+            return _error(400, errors)
+
+        async with self.database.transaction():
+            version = await self._bump_version(todolist_id, items=1, completed=int(bool(data.get('completed'))))
+            insert = _todoitems.insert().values(
+                name=data['name'], completed=bool(data.get('completed')), todolist_id=todolist_id, version=version)
+            item = self._serialize_one(await self.database.fetch_one(insert.returning(*self._serializer.columns)))
+            await self._publish_events(todolist_id, version, [{'type': 'created', 'item': item}])
+        return self._json_response(item, status_code=201)
+
+    async def _put(self, request, todolist_id, todoitem_id):
+        existing_todoitem = await self._get_todoitem_row(todolist_id, todoitem_id)
+        if existing_todoitem is None:
+            return _error(404, 'The requested TODO item does not exist')
+        request_data, error_response = await self._get_request_data(request)
+        if error_response:
+            return error_response
+        data, errors = self._parse_item(request_data, name_required=False)
+        if errors:
+            return _error(400, errors)
+
+        # Only values that actually change are written
+        changes = {k: v for k, v in data.items() if v != existing_todoitem[k]}
+        if not changes:
+            return self._json_response(self._serialize_one(existing_todoitem))
+        async with self.database.transaction():
+            version = await self._bump_version(todolist_id)
+            if 'completed' in changes:
+                await self.database.execute(TODOList.get_count_update(todolist_id, **{
+                    'completed_ids' if changes['completed'] else 'open_ids': [todoitem_id]}))
+            update = _todoitems.update().where(and_(
+                _todoitems.c.todolist_id == todolist_id, _todoitems.c.id == todoitem_id,
+            )).values(changes, version=version)
+            todoitem = await self.database.fetch_one(update.returning(*self._serializer.columns))
+            if todoitem is None:  # Deleted since it was read: raising rolls the version bump back
+                raise HTTPException(404, 'The requested TODO item does not exist')
+            item = self._serialize_one(todoitem)
+            await self._publish_events(todolist_id, version, [{'type': 'updated', 'item': item}])
+        return self._json_response(item)
+
+    async def _delete(self, todolist_id, todoitem_id):
+        existing_todoitem = await self._get_todoitem_row(todolist_id, todoitem_id)
+        if existing_todoitem is None:
+            return _error(404, 'The requested TODO item does not exist')
+        async with self.database.transaction():
+            version = await self._bump_version(todolist_id)
+            await self.database.execute(TODOList.get_count_update(todolist_id, deleted_ids=[todoitem_id]))
+            await self.database.execute(
+                _tombstones.insert().values(todoitem_id=todoitem_id, todolist_id=todolist_id, version=version))
+            await self.database.execute(_todoitems.delete().where(and_(
+                _todoitems.c.todolist_id == todolist_id, _todoitems.c.id == todoitem_id)))
+            await self._publish_events(todolist_id, version, [{'type': 'deleted', 'id': todoitem_id}])
+        return Response(status_code=204)
+
+    async def _publish_events(self, todolist_id, version, events):
+        # Within the transaction of the write, just like `app.events.publish_todoitem_events`
+        if self.event_broker is not None:
+            await self.event_broker.publish(todolist_id, version, events)
+
+    async def _stream_events(self, todolist_id, subscription, since):
+        """
+        Returns a stream of server-sent events, just like `app.api.TODOItemsEventsEndpoint._stream_events`.
+        """
+        heartbeat, duration = self.config.EVENTS_HEARTBEAT, self.config.EVENTS_STREAM_DURATION
+        try:
+            version = await self._get_version(todolist_id)
+            if version is None:
+                subscription.close()
+                return _error(404, 'The requested TODO list does not exist')
+            first_chunk = ':\n\n'
+            if since is not None and since < version:
+                first_chunk = await self._format_sync_event(todolist_id, since, version)
+        except BaseException:
+            subscription.close()
+            raise
+
+        async def generate(last_version):
+            try:
+                yield first_chunk
+                deadline = time.monotonic() + duration
+                while time.monotonic() < deadline:
+                    message = await subscription.get(min(heartbeat, deadline - time.monotonic()))
+                    if message is None:
+                        yield ': keep-alive\n\n'
+                    elif message['version'] is not None and message['version'] <= last_version:
+                        continue  # Already sent
+                    elif message['events'] is None or message['version'] != last_version + 1:
+                        # Missed (or not yet arrived) messages, since versions are consecutive: catching up from the DB
+                        version = await self._get_version(todolist_id)
+                        if version is None:  # The TODO list was deleted
+                            return
+                        if version > last_version:
+                            yield await self._format_sync_event(todolist_id, last_version, version)
+                            last_version = version
+                    else:
+                        yield ''.join(format_server_sent_event(
+                            x['type'], x.get('item', {'id': x.get('id')}),
+                            encode_sync_cursor(message['version']) if idx == len(message['events']) - 1 else None,
+                        ) for idx, x in enumerate(message['events']))
+                        last_version = message['version']
+            finally:
+                subscription.close()
+
+        return StreamingResponse(generate(max(version, since or 0)), media_type=EVENT_STREAM_MIMETYPE,
+                                 headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    async def _poll_events(self, todolist_id, subscription, since):
+        """
+        Waits until the TODO list changes after the given version (or the current one), and returns the changes. Returns
+        None if the TODO list doesn't exist (anymore).
+        """
+        version = await self._get_version(todolist_id)
+        since = version if since is None else since
+        deadline = time.monotonic() + self.config.EVENTS_POLL_TIMEOUT
+        while version is not None and version <= since:
+            message = await subscription.get(max(0, deadline - time.monotonic()))
+            if message is None:
+                break
+            if message['version'] is None or message['version'] > since:
+                version = await self._get_version(todolist_id)
+        if version is None:
+            return None
+        return await self._get_changes(todolist_id, since, version)
+
+    async def _format_sync_event(self, todolist_id, since_version, version):
+        changes = await self._get_changes(todolist_id, since_version, version)
+        return format_server_sent_event('sync', changes, encode_sync_cursor(version))
+
+    async def _get_changes(self, todolist_id, since_version, version):
+        todoitems = await self.database.fetch_all(
+            select(list(self._serializer.columns)).where(and_(
+                _todoitems.c.todolist_id == todolist_id, _todoitems.c.version > since_version,
+                _todoitems.c.version <= version,
+            )).order_by(_todoitems.c.version, _todoitems.c.id))
+        deleted_ids = await self.database.fetch_all(
+            select([_tombstones.c.todoitem_id]).where(and_(
+                _tombstones.c.todolist_id == todolist_id, _tombstones.c.version > since_version,
+                _tombstones.c.version <= version,
+            )).order_by(_tombstones.c.version, _tombstones.c.todoitem_id))
+        return {
+            'items': self._serialize(todoitems),
+            'deleted': [x['todoitem_id'] for x in deleted_ids],
+            'cursor': encode_sync_cursor(version),
+        }
+
+    def _stream_todoitems(self, todolist_id, ndjson=False, include_archived=False):
+        batch_size = self.config.TODOITEMS_STREAM_BATCH_SIZE
+        serialize, json_encoder = self._serialize_one, self.json_encoder
+
+        async def generate():
+            chunk = [] if ndjson else [b'[']
+            idx = 0
+            async for todoitem in self.database.iterate(self._get_sorted_query(todolist_id, include_archived)):
+                if idx and not ndjson:
+                    chunk.append(b',')
+                chunk.append(encode_json(serialize(todoitem), json_encoder))
+                if ndjson:
+                    chunk.append(b'\n')
+                if len(chunk) >= batch_size:
+                    yield b''.join(chunk)
+                    chunk = []
+                idx += 1
+            if not ndjson:
+                chunk.append(b']\n')
+            yield b''.join(chunk)
+
+        return StreamingResponse(generate(), media_type=NDJSON_MIMETYPE if ndjson else 'application/json')
+
+    async def _get_default_todolist_id(self):
+        name = self.config.DEFAULT_TODO_LIST_NAME
+        todolist_id = await self.database.fetch_val(select([_todolists.c.id]).where(_todolists.c.name == name))
+        if todolist_id is None:
+            todolist_id = await self.database.fetch_val(
+                _todolists.insert().values(name=name, version=0).returning(_todolists.c.id))
+        return todolist_id
+
+    async def _get_todolist_id(self, request):
+        # Returns the TODO list of the URL (or the default one if there's none), or None if it doesn't exist
+        todolist_id = request.path_params.get('todolist_id')
+        if todolist_id is None:
+            return self.default_todolist_id
+        return await self.database.fetch_val(select([_todolists.c.id]).where(_todolists.c.id == todolist_id))
+
+    async def _get_version(self, todolist_id):
+        query = select([_todolists.c.version]).where(_todolists.c.id == todolist_id)
+        return await self.database.fetch_val(query)
+
+    async def _bump_version(self, todolist_id, items=0, completed=0):
+        # Just like `TODOList.bump_version`, this locks the TODO list until the transaction ends, and rolls it back
+        # (with HTTP 404) if the TODO list was deleted since it was looked up
+        update = TODOList.get_version_update(todolist_id, items, completed)
+        version = await self.database.fetch_val(update.returning(_todolists.c.version))
+        if version is None:
+            raise HTTPException(404, 'The requested TODO list does not exist')
+        return version
+
+    async def _get_todoitem_row(self, todolist_id, todoitem_id):
+        query = select([_todoitems]).where(and_(
+            _todoitems.c.todolist_id == todolist_id, _todoitems.c.id == todoitem_id))
+        return await self.database.fetch_one(query)
+
+    def _get_sorted_query(self, todolist_id, include_archived=False, **list_filters):
+        # Same query as `TODOItem._get_sorted_query`
+        entity = TODOItem._get_entity(include_archived, list_filters.get('completed'))
+        criteria, order_by = TODOItem.get_list_criteria(todolist_id, entity=entity, **list_filters)
+        return select(self._get_columns(entity)).where(and_(*criteria)).order_by(*order_by)
+
+    def _get_columns(self, entity):
+        # The serialized columns of what reads query (see `TODOItem._get_entity`)
+        return [getattr(entity, x.key) for x in self._serializer.columns]
+
+    def _get_etag(self, todolist_id, version):
+        return '{}.{}'.format(todolist_id, version)
+
+    def _get_list_args(self, query_params):
+        """
+        Parses the same optional query string params as `TODOItemsEndpoint._get_list_args`, and returns them along with
+        the errors found (by param name).
+        """
+        max_page_size = self.config.TODOITEMS_MAX_PAGE_SIZE
+        parsers = {
+            'limit': (inputs.int_range(1, max_page_size, argument='limit'), 'How many items do you want per page?'),
+            'after': (decode_cursor, 'Where does the page start?'),
+            'since': (decode_sync_cursor, 'When did you last sync?'),
+            'stream': (inputs.boolean, 'Do you want them all at once?'),
+            'q': (parse_search_terms, 'What are you looking for?'),
+            'completed': (inputs.boolean, 'Open or completed ones?'),
+            'sort': (_parse_sort, 'How do you want them sorted?'),
+        }
+        parsers.update({x: (parse_datetime, 'Since or until when?') for x in RANGE_ARGS})
+        list_args, errors = {}, {}
+        for name, (parse, help_message) in parsers.items():
+            value = query_params.get(name)
+            try:
+                list_args[name] = parse(value) if value is not None else None
+            except ValueError:
+                errors[name] = help_message
+        list_args['sort'] = list_args.get('sort') or SORTS[0]
+        return list_args, errors
+
+    def _wants_archived(self, request):
+        """
+        Checks if the client wants archived TODO items too, just like `BaseTODOItemsEndpoint._wants_archived`, and
+        returns it along with a response with the error to send back (if any).
+        """
+        value = request.query_params.get('include_archived')
+        try:
+            return inputs.boolean(value) if value is not None else False, None
+        except ValueError:
+            return None, _error(400, {'include_archived': 'Archived ones too?'})
+
+    def _parse_item(self, data, name_required=True):
+        """
+        Validates the data of a TODO item just like `BaseTODOItemsEndpoint` does, and returns the valid values along
+        with the errors found (by param name).
+        """
+        item, errors = {}, {}
+        if data.get('name') is not None:
+            item['name'] = str(data['name'])
+        elif name_required:
+            errors['name'] = 'What do you have to do?'
+        if data.get('completed') is not None:
+            try:
+                item['completed'] = inputs.boolean(data['completed'])
+            except ValueError:
+                errors['completed'] = 'Did you do it?'
+        if not errors and 'name' in item and len(item['name']) < 3:
+            errors['name'] = 'You must add a name of at least 3 chars'
+        return item, errors
+
+    async def _get_request_data(self, request):
+        # Returns the JSON body of the request, or a response with the error to send back
+        body = await request.body()
+        if not body:
+            return {}, None
+        try:
+            request_data = json.loads(body)
+        except ValueError as e:
+            return None, _error(400, 'Failed to decode JSON object: {}'.format(e))
+        return request_data if isinstance(request_data, dict) else {}, None
+
+    def _json_response(self, data, status_code=200, headers=None):
+        # Same bodies as the sync app's (see `app.api._output_json`), so both send the same bytes
+        body = encode_json(data, self.json_encoder) + b'\n'
+        return Response(body, status_code=status_code, headers=headers, media_type='application/json')
+
+    def _wants_ndjson(self, request):
+        accept = parse_accept_header(request.headers.get('Accept'), MIMEAccept)
+        return accept.best_match(['application/json', NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+    def _serialize(self, todoitems):
+        serialize = self._serialize_one
+        return [serialize(x) for x in todoitems]
+
+    def _serialize_one(self, todoitem):
+        if todoitem is None:
+            return self._serializer.serialize(None)
+        return self._serializer.serialize([todoitem[x] for x in self._serializer.keys])
+
+
+class AsyncSubscription(Subscription):
+    """
+    Async version of `app.events.Subscription`, whose subscriber waits on the event loop instead of holding a thread.
+    Messages are put from the event loop too.
+    """
+
+    def __init__(self, broker, todolist_id, max_queued):
+        super().__init__(broker, todolist_id, max_queued)
+        self._event = asyncio.Event()
+
+    def put(self, message):
+        self._queue(message)
+        self._event.set()
+
+    async def get(self, timeout):
+        """
+        Returns the next message, or None if there was none within `timeout` seconds.
+        """
+        if not self._has_messages():
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._pop()
+
+
+class AsyncPostgresTransport(PostgresTransport):
+    """
+    Async version of `app.events.PostgresTransport`, on the same channel: `publish` returns a coroutine that NOTIFYs the
+    message within the current transaction of `database`, and each worker LISTENs on a single connection of its own,
+    from a task of its event loop.
+    """
+
+    def __init__(self, database, dsn, **options):
+        super().__init__(dsn, **options)
+        self.database = database
+        self._task = None
+
+    def publish(self, message):
+        return self.database.execute(select([func.pg_notify(self.channel, self._get_payload(message))]))
+
+    def listen(self, callback):
+        self._task = asyncio.ensure_future(self._listen(callback))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+
+    async def _listen(self, callback):
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                try:
+                    await connection.add_listener(self.channel, lambda *args: callback(json.loads(args[-1])))
+                    # Anything published while (re)connecting was missed
+                    callback({'todolist_id': None, 'version': None, 'events': None})
+                    while not connection.is_closed():
+                        await asyncio.sleep(self.poll_interval)
+                finally:
+                    await connection.close()
+            except (OSError, asyncpg.PostgresError):
+                await asyncio.sleep(self.reconnect_delay)
+
+
+def _get_event_broker(config, database):
+    """
+    Returns the event broker of the async app, or None if events are disabled (see `EVENTS_TRANSPORT`). Events always go
+    through Postgres, with the options of `EVENTS_TRANSPORT` if it's a `PostgresTransport` too.
+    """
+    transport_class = config.EVENTS_TRANSPORT
+    if transport_class is None:
+        return None
+    if isinstance(transport_class, str):
+        transport_class = import_string(transport_class)
+    options = dict(config.EVENTS_TRANSPORT_OPTIONS) if issubclass(transport_class, PostgresTransport) else {}
+    options.setdefault('dsn', config.SQLALCHEMY_DATABASE_URI)
+    return EventBroker(AsyncPostgresTransport(database, **options), config.EVENTS_MAX_QUEUED,
+                       config.ASYNC_EVENTS_MAX_SUBSCRIBERS, AsyncSubscription)
+
+
+def _parse_sort(value):
+    if value not in SORTS:
+        raise ValueError('Invalid sort')
+    return value
+
+
+def _error(status_code, message):
+    # Messages are plain ASCII, which every JSON encoder writes just like this one
+    body = encode_json({'message': message}, dumps_compact) + b'\n'
+    return Response(body, status_code=status_code, media_type='application/json')
+
+
+async def _http_error(request, exc):
+    return _error(exc.status_code, exc.detail)
+
+
+def create_async_app(target_env):
+    """
+    Returns a new ASGI app that serves the TODO items API with the configurations of the given environment.
+    """
+    todoitems_api = AsyncTODOItemsAPI(get_config(target_env))
+    routes = [
+        Route('/api/todoitems', todoitems_api.todoitems, methods=['GET', 'POST', 'PUT', 'DELETE']),
+        Route('/api/todoitems/{todoitem_id:int}', todoitems_api.todoitem, methods=['GET', 'POST', 'PUT', 'DELETE']),
+        Route('/api/todoitems/stats', todoitems_api.stats),
+        Route('/api/todoitems/events', todoitems_api.events),
+        Route('/api/todolists/{todolist_id:int}/items', todoitems_api.todoitems,
+              methods=['GET', 'POST', 'PUT', 'DELETE']),
+        Route('/api/todolists/{todolist_id:int}/items/{todoitem_id:int}', todoitems_api.todoitem,
+              methods=['GET', 'POST', 'PUT', 'DELETE']),
+        Route('/api/todolists/{todolist_id:int}/items/stats', todoitems_api.stats),
+        Route('/api/todolists/{todolist_id:int}/items/events', todoitems_api.events),
+    ]
+    app = Starlette(routes=routes, lifespan=todoitems_api.lifespan, exception_handlers={HTTPException: _http_error})
+    app.state.todoitems_api = todoitems_api
+    return app
@@ -0,0 +1,209 @@
+# coding=utf-8
+
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from flask import current_app
+from werkzeug.utils import import_string
+
+_GENERATION_TTL = 24 * 60 * 60
+
+
+class CacheBackend(object):
+    """
+    Interface that every response cache backend implements.
+
+    Values are `(body, headers)` tuples made of bytes and str only, so shared backends (e.g. Redis or memcached) can
+    store them as they are or pickle them.
+    """
+
+    def get(self, key):
+        """
+        Returns the value stored for the given key, or None if there's none (or it expired).
+        """
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value for the given key, for `ttl` seconds (or the default TTL of the backend).
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def get_stats(self):
+        """
+        Returns a dict with stats about the contents of the backend (e.g. evictions or size).
+        """
+        return {}
+
+
+class LRUCache(CacheBackend):
+    """
+    In-process cache backend that evicts the least recently used entries once it holds more than `max_entries`
+    entries or `max_bytes` bytes.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024, ttl=30):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # Key -> (value, expiration time, size)
+        self._size = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                self._remove(key)
+                self._expirations += 1
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        size = _get_size(value)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = value, expires, size
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def get_stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+        }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+class ResponseCache(object):
+    """
+    Class that caches serialized responses of the TODO items endpoint on top of any cache backend.
+
+    Keys include a generation token: collection responses (every page and query string) share one per TODO list, and
+    each item has its own. Writes invalidate them by replacing the token, so a response read from the DB before a write
+    can only ever be stored under the old token, where nobody will look for it.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_todoitems_key(self, todolist_id, args):
+        """
+        Returns the key of a collection response of the given TODO list, for the given query string params.
+        """
+        generation = self._get_generation('todoitems:{}'.format(todolist_id))
+        return 'todoitems:{}:{}:{}'.format(todolist_id, generation, '&'.join(sorted(args)))
+
+    def get_todoitem_key(self, todolist_id, todoitem_id, include_archived=False):
+        # The TODO list is part of the key, so an item is never served under another list's URL. Archived items are
+        # only found with `include_archived`, so those responses get keys of their own
+        generation = self._get_generation('todoitem:{}'.format(todoitem_id))
+        key = 'todoitem:{}:{}:{}'.format(todolist_id, todoitem_id, generation)
+        return key + ':archived' if include_archived else key
+
+    def get(self, key):
+        """
+        Returns the cached `(body, headers)` of a response, or None.
+        """
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, body, headers):
+        self.backend.set(key, (body, headers))
+
+    def invalidate(self, todolist_id, todoitem_ids=()):
+        """
+        Drops all cached collection responses of the given TODO list and the cached responses of the given items.
+        """
+        self._set_generation('todoitems:{}'.format(todolist_id))
+        for todoitem_id in todoitem_ids:
+            self._set_generation('todoitem:{}'.format(todoitem_id))
+        self.invalidations += 1
+
+    def get_stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'invalidations': self.invalidations,
+        }
+        stats.update(self.backend.get_stats())
+        return stats
+
+    def _get_generation(self, prefix):
+        generation = self.backend.get(prefix + ':generation')
+        # A missing (e.g. evicted) generation gets a brand new token, so older entries can never be served again
+        return generation if generation is not None else self._set_generation(prefix)
+
+    def _set_generation(self, prefix):
+        generation = uuid.uuid4().hex
+        self.backend.set(prefix + ':generation', generation, ttl=_GENERATION_TTL)
+        return generation
+
+
+def get_response_cache():
+    """
+    Returns the response cache of the current app, or None if it's disabled (see `RESPONSE_CACHE_BACKEND`).
+    """
+    if 'response_cache' not in current_app.extensions:
+        backend_class = current_app.config['RESPONSE_CACHE_BACKEND']
+        if isinstance(backend_class, str):
+            backend_class = import_string(backend_class)
+        backend = backend_class(**current_app.config['RESPONSE_CACHE_OPTIONS']) if backend_class else None
+        current_app.extensions['response_cache'] = ResponseCache(backend) if backend else None
+    return current_app.extensions['response_cache']
+
+
+def invalidate_todoitems(todolist_id, todoitem_ids=()):
+    """
+    Drops all cached responses affected by changes to the given TODO items, if the response cache is enabled.
+    """
+    response_cache = get_response_cache()
+    if response_cache is not None:
+        response_cache.invalidate(todolist_id, todoitem_ids)
+
+
+def _get_size(value):
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, tuple):
+        return sum(_get_size(x) for x in value)
+    if isinstance(value, dict):
+        return sum(_get_size(k) + _get_size(v) for k, v in value.items())
+    return 0
@@ -0,0 +1,165 @@
+# coding=utf-8
+
+
+import json
+import zlib
+
+from flask import current_app, request
+from werkzeug.utils import import_string
+
+try:
+    import brotli
+except ImportError:  # Optional: responses are only gzipped without it
+    brotli = None
+
+# Bodies worth compressing: the rest are either tiny or kept uncompressed on purpose (e.g. event streams, which must
+# reach clients as soon as each event is written)
+_COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson')
+
+
+def dumps_compact(data):
+    """
+    Default JSON encoder of response bodies (see `JSON_ENCODER`): stdlib JSON without any whitespace.
+    """
+    return json.dumps(data, separators=(',', ':'))
+
+
+def dumps_orjson(data):
+    """
+    Faster JSON encoder of response bodies, which needs orjson (`pip install orjson`). Its output is as compact as
+    `dumps_compact`'s.
+    """
+    import orjson
+    return orjson.dumps(data)
+
+
+def load_json_encoder(json_encoder):
+    """
+    Returns the JSON encoder of the given `JSON_ENCODER` configuration (the function itself, or its import path).
+    """
+    return import_string(json_encoder) if isinstance(json_encoder, str) else json_encoder
+
+
+def get_json_encoder():
+    """
+    Returns the JSON encoder of the current app (see `JSON_ENCODER`).
+    """
+    if 'json_encoder' not in current_app.extensions:
+        current_app.extensions['json_encoder'] = load_json_encoder(current_app.config['JSON_ENCODER'])
+    return current_app.extensions['json_encoder']
+
+
+def encode_json(data, json_encoder=None):
+    """
+    Returns the given data encoded as JSON bytes, with the given JSON encoder (the one of the current app by default).
+    """
+    encoded = (json_encoder or get_json_encoder())(data)
+    return encoded.encode() if isinstance(encoded, str) else encoded
+
+
+def get_content_encodings():
+    """
+    Returns the content encodings the current app can compress responses with, preferred ones first.
+    """
+    return [x for x in current_app.config['COMPRESSION_ENCODINGS'] if x != 'br' or brotli is not None]
+
+
+def etag_matches(etag):
+    """
+    Checks if the `If-None-Match` header of the current request matches the given (unquoted) entity tag, either as it
+    is or as any of its compressed variants (see `compress_response`).
+    """
+    if_none_match = request.if_none_match
+    return if_none_match.contains_weak(etag) or any(
+        if_none_match.contains_weak(_get_encoded_etag(etag, x)) for x in get_content_encodings())
+
+
+def compress_response(response):
+    """
+    Compresses the given response with the content encoding that both the client and the app prefer, if its body is
+    JSON of at least `COMPRESSION_MIN_BYTES` (streamed bodies are always compressed, chunk by chunk).
+
+    Compressed responses get their content encoding appended to their entity tag (e.g. "1.42-gzip"), so caches never
+    mix them up with the uncompressed ones. Conditional requests match any of them (see `etag_matches`).
+    """
+    encodings = get_content_encodings()
+    if not encodings:
+        return response
+    if response.status_code == 304:
+        return _set_not_modified_etag(response, encodings)
+    if response.mimetype not in _COMPRESSIBLE_MIMETYPES or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(encodings)
+    if encoding is None or response.status_code < 200 or response.status_code == 204:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_chunks(response.response, _get_compressor(encoding))
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < current_app.config['COMPRESSION_MIN_BYTES']:
+            return response
+        response.set_data(_compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(_get_encoded_etag(etag, encoding), weak=weak)
+    return response
+
+
+def configure_compression(app):
+    """
+    Compresses the responses of the given app (see `compress_response`), unless `COMPRESSION_ENCODINGS` is empty.
+    """
+    if app.config['COMPRESSION_ENCODINGS']:
+        app.after_request(compress_response)
+
+
+def _get_encoded_etag(etag, encoding):
+    return '{}-{}'.format(etag, encoding)
+
+
+def _set_not_modified_etag(response, encodings):
+    """
+    Sends back the variant of the entity tag that the client has, if it's the one of the encoding it would get now.
+    """
+    etag, weak = response.get_etag()
+    encoding = request.accept_encodings.best_match(encodings)
+    if etag and encoding and request.if_none_match.contains_weak(_get_encoded_etag(etag, encoding)):
+        response.set_etag(_get_encoded_etag(etag, encoding), weak=weak)
+    return response
+
+
+def _compress(body, encoding):
+    compress, _, finish = _get_compressor(encoding)
+    return compress(body) + finish()
+
+
+def _get_compressor(encoding):
+    """
+    Returns a `(compress, flush, finish)` triplet of functions that compress a stream of chunks with the given encoding.
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=current_app.config['COMPRESSION_BROTLI_QUALITY'])
+        return compressor.process, compressor.flush, compressor.finish
+    # A gzip header and trailer around a raw deflate stream
+    compressor = zlib.compressobj(current_app.config['COMPRESSION_GZIP_LEVEL'], zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compress_chunks(chunks, compressor):
+    """
+    Yields the given chunks compressed. Each one is flushed right away, so clients start decoding items as they arrive.
+    """
+    compress, flush, finish = compressor
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            yield compress(chunk) + flush()
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
@@ -0,0 +1,273 @@
+# coding=utf-8
+
+
+import json
+import select
+import threading
+import time
+from collections import deque
+
+from flask import current_app
+from sqlalchemy import event
+from werkzeug.utils import import_string
+
+from app.models import db
+
+_broker_lock = threading.Lock()
+
+
+class EventTransport(object):
+    """
+    Interface that every transport of TODO item events implements.
+
+    Transports carry messages between workers: `publish` sends a message to every worker (this one included), and
+    `listen` delivers the messages published by any worker to the given callback. Messages are published within the
+    transaction of their write, and only delivered once (and if) it commits. Messages are dicts with the
+    `todolist_id`, the `version` of the TODO list after the write and its `events`. Transports that can lose messages
+    deliver `events=None` instead, so subscribers fetch what they missed from the DB (`todolist_id=None` stands for
+    every TODO list).
+    """
+
+    def publish(self, message):
+        raise NotImplementedError
+
+    def listen(self, callback):
+        raise NotImplementedError
+
+
+class LocalTransport(EventTransport):
+    """
+    In-process transport: messages only reach the subscribers of the worker that published them. Good enough for a
+    single worker (or tests).
+    """
+    _SESSION_KEY = 'todoitems_events'
+
+    def __init__(self):
+        self._callbacks = []
+
+    def publish(self, message):
+        session = db.session()
+        if not event.contains(session, 'after_commit', self._deliver):
+            event.listen(session, 'after_commit', self._deliver)
+            event.listen(session, 'after_rollback', self._discard)
+        session.info.setdefault(self._SESSION_KEY, []).append(message)
+
+    def _deliver(self, session):
+        for message in session.info.pop(self._SESSION_KEY, []):
+            for callback in self._callbacks:
+                callback(message)
+
+    def _discard(self, session):
+        session.info.pop(self._SESSION_KEY, None)
+
+    def listen(self, callback):
+        self._callbacks.append(callback)
+
+
+class PostgresTransport(EventTransport):
+    """
+    Transport on top of Postgres' LISTEN/NOTIFY, so messages reach the subscribers of every worker.
+
+    Each worker LISTENs on a single connection of its own (outside the pool), from a background thread, no matter how
+    many clients are subscribed. Messages are NOTIFYed on the connection of their write, within its transaction, so
+    publishing takes no other connection and Postgres only delivers them if the write commits.
+    """
+    # Notification payloads are limited to 8000 bytes
+    MAX_PAYLOAD_BYTES = 7900
+
+    def __init__(self, dsn=None, channel='todoitems_events', poll_interval=5, reconnect_delay=1):
+        self.dsn = dsn or current_app.config['SQLALCHEMY_DATABASE_URI']
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.reconnect_delay = reconnect_delay
+
+    def publish(self, message):
+        db.session.execute(db.select([db.func.pg_notify(self.channel, self._get_payload(message))]))
+
+    def listen(self, callback):
+        threading.Thread(target=self._listen, args=(callback,), name='todoitems-events', daemon=True).start()
+
+    def _listen(self, callback):
+        import psycopg2
+        from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+        while True:
+            try:
+                connection = psycopg2.connect(self.dsn)
+                try:
+                    connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                    connection.cursor().execute('LISTEN {}'.format(self.channel))
+                    # Anything published while (re)connecting was missed
+                    callback({'todolist_id': None, 'version': None, 'events': None})
+                    while True:
+                        if select.select([connection], [], [], self.poll_interval)[0]:
+                            connection.poll()
+                            while connection.notifies:
+                                callback(json.loads(connection.notifies.pop(0).payload))
+                finally:
+                    connection.close()
+            except psycopg2.Error:
+                time.sleep(self.reconnect_delay)
+
+    def _get_payload(self, message):
+        payload = json.dumps(message)
+        if len(payload.encode()) > self.MAX_PAYLOAD_BYTES:
+            payload = json.dumps(dict(message, events=None))  # Subscribers fetch them from the DB instead
+        return payload
+
+
+class SubscriberLimitError(RuntimeError):
+    """
+    Raised when subscribing to a broker that already has as many subscribers as it takes (see `EVENTS_MAX_SUBSCRIBERS`).
+    """
+
+
+class Subscription(object):
+    """
+    Class that queues the messages of a TODO list for a single subscriber, up to `max_queued` of them.
+
+    When the subscriber falls behind, its queue is dropped and `get()` returns a message without events, so the
+    subscriber fetches what it missed from the DB. That way publishing never blocks nor piles up messages in memory.
+    """
+
+    def __init__(self, broker, todolist_id, max_queued):
+        self.broker = broker
+        self.todolist_id = todolist_id
+        self.max_queued = max_queued
+        self._messages = deque()
+        self._condition = threading.Condition()
+        self._overflowed = False
+
+    def put(self, message):
+        with self._condition:
+            self._queue(message)
+            self._condition.notify()
+
+    def get(self, timeout):
+        """
+        Returns the next message, or None if there was none within `timeout` seconds.
+        """
+        with self._condition:
+            if not self._condition.wait_for(self._has_messages, timeout):
+                return None
+            return self._pop()
+
+    def _queue(self, message):
+        if message['events'] is None or len(self._messages) >= self.max_queued:
+            self._messages.clear()
+            self._overflowed = True
+        else:
+            self._messages.append(message)
+
+    def _has_messages(self):
+        return bool(self._messages or self._overflowed)
+
+    def _pop(self):
+        if self._overflowed:
+            self._overflowed = False
+            self.broker.overflows += 1
+            return {'todolist_id': self.todolist_id, 'version': None, 'events': None}
+        return self._messages.popleft()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker(object):
+    """
+    Class that fans the messages of a transport out to the subscribers of this worker, by TODO list.
+
+    The transport is only listened to once there's a subscriber, and idle subscribers just wait on their queue: they
+    hold no DB connection and take no CPU. Past `max_subscribers` (if given), subscribing raises
+    `SubscriberLimitError`, since every waiting subscriber of a threaded worker holds one of its threads.
+    """
+
+    def __init__(self, transport, max_queued=100, max_subscribers=None, subscription_class=Subscription):
+        self.transport = transport
+        self.max_queued = max_queued
+        self.max_subscribers = max_subscribers
+        self.subscription_class = subscription_class
+        self.published = 0
+        self.overflows = 0
+        self.rejected = 0
+        self._subscriptions = {}  # TODO list ID -> subscriptions
+        self._subscribers = 0
+        self._listening = False
+        self._lock = threading.Lock()
+
+    def publish(self, todolist_id, version, events):
+        """
+        Publishes a message through the transport, and returns whatever it does (e.g. a coroutine for async ones).
+        """
+        self.published += 1
+        return self.transport.publish({'todolist_id': todolist_id, 'version': version, 'events': events})
+
+    def subscribe(self, todolist_id):
+        subscription = self.subscription_class(self, todolist_id, self.max_queued)
+        with self._lock:
+            if self.max_subscribers is not None and self._subscribers >= self.max_subscribers:
+                self.rejected += 1
+                raise SubscriberLimitError(self.max_subscribers)
+            self._subscriptions.setdefault(todolist_id, set()).add(subscription)
+            self._subscribers += 1
+            start_listening, self._listening = not self._listening, True
+        if start_listening:
+            self.transport.listen(self._dispatch)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.todolist_id, set())
+            if subscription in subscriptions:
+                subscriptions.remove(subscription)
+                self._subscribers -= 1
+            if not subscriptions:
+                self._subscriptions.pop(subscription.todolist_id, None)
+
+    def get_stats(self):
+        return {
+            'subscribers': self._subscribers,
+            'max_subscribers': self.max_subscribers,
+            'rejected': self.rejected,
+            'published': self.published,
+            'overflows': self.overflows,
+        }
+
+    def _dispatch(self, message):
+        with self._lock:
+            if message['todolist_id'] is None:
+                subscriptions = [x for todolist_subscriptions in self._subscriptions.values()
+                                 for x in todolist_subscriptions]
+            else:
+                subscriptions = list(self._subscriptions.get(message['todolist_id'], ()))
+        for subscription in subscriptions:
+            subscription.put(message)
+
+
+def get_event_broker():
+    """
+    Returns the event broker of the current app, or None if events are disabled (see `EVENTS_TRANSPORT`).
+    """
+    # Unlike caches, there must be a single broker per app, or some subscribers would never get anything
+    with _broker_lock:
+        if 'event_broker' not in current_app.extensions:
+            transport_class = current_app.config['EVENTS_TRANSPORT']
+            if isinstance(transport_class, str):
+                transport_class = import_string(transport_class)
+            transport = transport_class(**current_app.config['EVENTS_TRANSPORT_OPTIONS']) if transport_class else None
+            current_app.extensions['event_broker'] = EventBroker(
+                transport, current_app.config['EVENTS_MAX_QUEUED'], current_app.config['EVENTS_MAX_SUBSCRIBERS'],
+            ) if transport else None
+    return current_app.extensions['event_broker']
+
+
+def publish_todoitem_events(todolist_id, version, events):
+    """
+    Publishes the events of a write to the given TODO list, if events are enabled. It must be called within the
+    transaction of the write, right before it commits (see the `before_commit` argument of the `TODOItem` writes), so
+    they're only delivered if it does. Events are dicts with their `type` ("created", "updated" or "deleted") and
+    either the serialized `item` or its `id`.
+    """
+    event_broker = get_event_broker()
+    if event_broker is not None and events:
+        event_broker.publish(todolist_id, version, events)
@@ -0,0 +1,274 @@
+# coding=utf-8
+
+
+import cProfile
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+from app.replicas import get_replica_set
+
+
+class QueryCounter(object):
+    """
+    Context manager that records every SQL statement run by the given engine while it's active.
+
+    e.g.
+        with QueryCounter(db.engine) as query_counter:
+            client.get('/api/todoitems')
+        assert query_counter.count == 1
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._on_before_cursor_execute)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._on_before_cursor_execute)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _on_before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+class RequestMetrics(object):
+    """
+    Class that collects where the time of a single request goes. Times are in seconds.
+    """
+    __slots__ = ('start', 'db_time', 'statements', 'timings', 'profiler')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db_time = 0.0
+        self.statements = 0
+        self.timings = {}  # Name -> time spent in `timed()` blocks
+        self.profiler = None
+
+
+class MetricsRegistry(object):
+    """
+    Class that aggregates the metrics of all requests of a worker, by route and method.
+
+    Latencies go into fixed histogram buckets (see `LATENCY_BUCKETS_MS`), so memory usage doesn't grow with traffic and
+    percentiles can be estimated from bucket bounds.
+    """
+    LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+    def __init__(self):
+        self._routes = {}  # "<method> <route>" -> totals
+        self._lock = threading.Lock()
+
+    def record(self, route, wall_time, db_time, statements, serialize_time, response_size):
+        wall_ms = wall_time * 1000
+        bucket_idx = next((idx for idx, x in enumerate(self.LATENCY_BUCKETS_MS) if wall_ms <= x),
+                          len(self.LATENCY_BUCKETS_MS))
+        with self._lock:
+            totals = self._routes.get(route)
+            if totals is None:
+                totals = self._routes[route] = {
+                    'count': 0, 'wall_ms': 0.0, 'max_wall_ms': 0.0, 'db_ms': 0.0, 'statements': 0,
+                    'serialize_ms': 0.0, 'response_bytes': 0, 'buckets': [0] * (len(self.LATENCY_BUCKETS_MS) + 1),
+                }
+            totals['count'] += 1
+            totals['wall_ms'] += wall_ms
+            totals['max_wall_ms'] = max(totals['max_wall_ms'], wall_ms)
+            totals['db_ms'] += db_time * 1000
+            totals['statements'] += statements
+            totals['serialize_ms'] += serialize_time * 1000
+            totals['response_bytes'] += response_size
+            totals['buckets'][bucket_idx] += 1
+
+    def get_stats(self):
+        with self._lock:
+            routes = {k: dict(v, buckets=list(v['buckets'])) for k, v in self._routes.items()}
+        return {route: self._get_route_stats(totals) for route, totals in sorted(routes.items())}
+
+    def _get_route_stats(self, totals):
+        count = totals['count']
+        bounds = [str(x) for x in self.LATENCY_BUCKETS_MS] + ['+Inf']
+        return {
+            'count': count,
+            'latency_ms': {
+                'mean': totals['wall_ms'] / count,
+                'p50': self._get_percentile(totals['buckets'], count, 0.5, totals['max_wall_ms']),
+                'p99': self._get_percentile(totals['buckets'], count, 0.99, totals['max_wall_ms']),
+                'max': totals['max_wall_ms'],
+                'buckets': dict(zip(bounds, totals['buckets'])),
+            },
+            'db_ms_mean': totals['db_ms'] / count,
+            'statements_mean': totals['statements'] / count,
+            'serialize_ms_mean': totals['serialize_ms'] / count,
+            'response_bytes_mean': totals['response_bytes'] / count,
+        }
+
+    def _get_percentile(self, buckets, count, percentile, max_wall_ms):
+        # Upper bound of the bucket holding the percentile (capped at the slowest request seen)
+        seen = 0
+        for bound, bucket_count in zip(self.LATENCY_BUCKETS_MS, buckets):
+            seen += bucket_count
+            if seen >= count * percentile:
+                return min(bound, max_wall_ms)
+        return max_wall_ms
+
+
+@contextmanager
+def timed(name):
+    """
+    Context manager that adds the time spent in its block to the given timing of the current request (e.g.
+    "serialize"). It does nothing unless instrumentation is enabled.
+    """
+    metrics = g.get('request_metrics') if has_request_context() else None
+    if metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.timings[name] = metrics.timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def get_metrics_registry():
+    """
+    Returns the metrics registry of the current app, or None if instrumentation is disabled.
+    """
+    return current_app.extensions.get('metrics')
+
+
+def configure_instrumentation(app, db):
+    """
+    Sets up per-request instrumentation in the given app if `INSTRUMENTATION_ENABLED` is on: every response gets a
+    `Server-Timing` header, and metrics are aggregated in `GET /internal/metrics`. Nothing is hooked in otherwise.
+    """
+    if not app.config['INSTRUMENTATION_ENABLED']:
+        return
+    app.extensions['metrics'] = MetricsRegistry()
+    replica_set = get_replica_set(app)
+    engines = [db.get_engine(app)] + ([x.engine for x in replica_set.replicas] if replica_set is not None else [])
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', _on_before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _on_after_cursor_execute)
+    app.before_request(_start_request_metrics)
+    app.after_request(_finish_request_metrics)
+
+
+def _start_request_metrics():
+    metrics = g.request_metrics = RequestMetrics()
+    sample_rate = current_app.config['PROFILE_SAMPLE_RATE']
+    if sample_rate and random.random() < sample_rate:
+        metrics.profiler = cProfile.Profile()
+        metrics.profiler.enable()
+
+
+def _finish_request_metrics(response):
+    metrics = g.pop('request_metrics', None)
+    if metrics is None:
+        return response
+    wall_time = time.perf_counter() - metrics.start
+    if metrics.profiler is not None:
+        metrics.profiler.disable()
+        if wall_time * 1000 >= current_app.config['PROFILE_SLOW_REQUEST_MS']:
+            _dump_profile(metrics.profiler, wall_time)
+    serialize_time = metrics.timings.get('serialize', 0.0)
+    # Streamed responses are still being generated at this point, so their size is unknown
+    response_size = 0 if response.is_streamed else response.calculate_content_length() or 0
+    route = '{} {}'.format(request.method, request.url_rule.rule if request.url_rule else '<unknown>')
+    current_app.extensions['metrics'].record(
+        route, wall_time, metrics.db_time, metrics.statements, serialize_time, response_size)
+    response.headers.add('Server-Timing', ', '.join([
+        'app;dur={:.2f}'.format(wall_time * 1000),
+        'db;dur={:.2f};desc="{} statements"'.format(metrics.db_time * 1000, metrics.statements),
+        'serialize;dur={:.2f}'.format(serialize_time * 1000),
+    ]))
+    return response
+
+
+def _dump_profile(profiler, wall_time):
+    profile_dir = current_app.config['PROFILE_DIR']
+    os.makedirs(profile_dir, exist_ok=True)
+    filename = '{}-{}-{}-{:.0f}ms.prof'.format(
+        datetime.utcnow().strftime('%Y%m%dT%H%M%S%f'), request.method,
+        request.path.strip('/').replace('/', '_') or 'root', wall_time * 1000)
+    profiler.dump_stats(os.path.join(profile_dir, filename))
+    current_app.logger.info('Slow request profile saved to %s', filename)
+
+
+def _on_before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._instrumentation_start = time.perf_counter()
+
+
+def _on_after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = g.get('request_metrics') if has_request_context() else None
+    if metrics is not None:
+        metrics.db_time += time.perf_counter() - context._instrumentation_start
+        metrics.statements += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    `QueuePool` that also keeps track of how long checkouts wait for a connection, and how many of them time out.
+
+    Wait times include opening a new connection when the pool is allowed to overflow. They start over whenever the pool
+    is recreated (e.g. on `engine.dispose()`).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._stats_lock = threading.Lock()
+        self._checkout_state = threading.local()
+
+    def _do_get(self):
+        if getattr(self._checkout_state, 'active', False):
+            return super()._do_get()  # `QueuePool` retries by calling itself, which is still the same checkout
+        self._checkout_state.active = True
+        timed_out = False
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            self._checkout_state.active = False
+            self._record_checkout(time.perf_counter() - start, timed_out)
+
+    def get_stats(self):
+        with self._stats_lock:
+            checkouts, timeouts, total_wait, max_wait = self.checkouts, self.timeouts, self.total_wait, self.max_wait
+        return {
+            'pool_size': self.size(),
+            'max_overflow': self._max_overflow,
+            'timeout': self._timeout,
+            'checked_in': self.checkedin(),
+            'checked_out': self.checkedout(),
+            'overflow': max(self.overflow(), 0),  # `QueuePool` counts it from -pool_size
+            'checkouts': checkouts,
+            'timeouts': timeouts,
+            'wait_ms_mean': total_wait / checkouts * 1000 if checkouts else None,
+            'wait_ms_max': max_wait * 1000,
+        }
+
+    def _record_checkout(self, wait, timed_out):
+        with self._stats_lock:
+            self.checkouts += 1
+            self.timeouts += timed_out
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
@@ -0,0 +1,117 @@
+# coding=utf-8
+
+
+import hmac
+
+from flask import current_app, request
+from flask_restful import Resource, abort
+
+from app.cache import get_response_cache
+from app.events import get_event_broker
+from app.instrumentation import InstrumentedQueuePool, get_metrics_registry
+from app.limits import get_concurrency_limiters, get_rate_limiter
+from app.models import db
+from app.replicas import get_replica_set
+
+
+class BaseInternalEndpoint(Resource):
+    """
+    Base class for all internal API endpoints, which require an `Authorization: Bearer <token>` header when
+    `INTERNAL_API_TOKEN` is set.
+    """
+
+    def dispatch_request(self, *args, **kwargs):
+        token = current_app.config['INTERNAL_API_TOKEN']
+        if token and not hmac.compare_digest(request.headers.get('Authorization', ''), 'Bearer ' + token):
+            abort(401, message='A valid internal API token is required')
+        return super().dispatch_request(*args, **kwargs)
+
+
+class ResponseCacheStatsEndpoint(BaseInternalEndpoint):
+    """
+    Internal API endpoint that shows how well the response cache is doing (hits, misses, evictions and size).
+    """
+
+    def get(self):
+        response_cache = get_response_cache()
+        if response_cache is None:
+            abort(404, message='The response cache is disabled')
+        return response_cache.get_stats()
+
+
+class EventsStatsEndpoint(BaseInternalEndpoint):
+    """
+    Internal API endpoint that shows the event subscribers of this worker (and the ones turned away), the messages it
+    published and how many times subscribers fell behind.
+    """
+
+    def get(self):
+        event_broker = get_event_broker()
+        if event_broker is None:
+            abort(404, message='Events are disabled')
+        return event_broker.get_stats()
+
+
+class LimitsStatsEndpoint(BaseInternalEndpoint):
+    """
+    Internal API endpoint that shows the requests of this worker in flight and shed, and the ones rate limited.
+    """
+
+    def get(self):
+        rate_limiter = get_rate_limiter()
+        return {
+            'rate_limits': rate_limiter.get_stats() if rate_limiter is not None else None,
+            'in_flight': {budget: x.get_stats() for budget, x in get_concurrency_limiters().items()},
+        }
+
+
+class PoolStatsEndpoint(BaseInternalEndpoint):
+    """
+    Internal API endpoint that shows the live state of this worker's DB connection pool (checked out connections,
+    overflow and how long checkouts wait), to size pools against the connection limit of the DB.
+    """
+
+    def get(self):
+        pool = db.engine.pool
+        if not isinstance(pool, InstrumentedQueuePool):
+            abort(404, message='Pool statistics are not available for this DB')
+        return pool.get_stats()
+
+
+class ReplicasStatsEndpoint(BaseInternalEndpoint):
+    """
+    Internal API endpoint that shows the health of the read replicas of the DB, and the reads each one got.
+    """
+
+    def get(self):
+        replica_set = get_replica_set()
+        if replica_set is None:
+            abort(404, message='There are no read replicas')
+        return replica_set.get_stats()
+
+
+class MetricsEndpoint(BaseInternalEndpoint):
+    """
+    Internal API endpoint that shows latency histograms, DB time, statement counts, serialization time and response
+    sizes of this worker, by route and method.
+    """
+
+    def get(self):
+        metrics_registry = get_metrics_registry()
+        if metrics_registry is None:
+            abort(404, message='Instrumentation is disabled')
+        return metrics_registry.get_stats()
+
+
+def configure_internal_api(app, api):
+    """
+    Attaches all internal endpoints to the given API, unless `INTERNAL_API_ENABLED` is off for the given app.
+    """
+    if not app.config['INTERNAL_API_ENABLED']:
+        return
+    api.add_resource(ResponseCacheStatsEndpoint, '/internal/cache')
+    api.add_resource(EventsStatsEndpoint, '/internal/events')
+    api.add_resource(LimitsStatsEndpoint, '/internal/limits')
+    api.add_resource(PoolStatsEndpoint, '/internal/pool')
+    api.add_resource(ReplicasStatsEndpoint, '/internal/replicas')
+    api.add_resource(MetricsEndpoint, '/internal/metrics')
@@ -0,0 +1,222 @@
+# coding=utf-8
+
+
+import heapq
+import math
+import time
+from operator import itemgetter
+
+from flask import Response, current_app, g, request
+from werkzeug.utils import import_string
+
+from app.encoding import encode_json
+
+# Requests that only read, and so spend the "read" budget. Anything else spends the "write" one
+_READ_METHODS = ('GET', 'HEAD')
+
+
+class RateLimitBackend(object):
+    """
+    Interface that every rate limit backend implements.
+
+    Backends keep a token bucket per key, so shared ones (e.g. Redis) can enforce budgets across all workers.
+    """
+
+    def consume(self, key, rate, burst):
+        """
+        Takes a token from the bucket of the given key, which holds up to `burst` tokens and gets `rate` new ones per
+        second. Returns 0 if there was one, or the seconds until there will be.
+        """
+        raise NotImplementedError
+
+    def get_stats(self):
+        return {}
+
+
+class LocalRateLimitBackend(RateLimitBackend):
+    """
+    In-process rate limit backend, so each worker enforces budgets on its own.
+
+    Buckets are stored as the time at which they will be full again (GCRA), a single float per key. Reading and
+    replacing dict items is atomic, so there's no lock: at worst, concurrent requests of a client take the same token.
+    Once there are more than `max_keys` buckets, the ones that are full again are forgotten, and so are the ones
+    closest to full while there are still too many (see `_prune`).
+    """
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}  # Key -> time at which its bucket is full again
+        self._prunes = 0
+
+    def consume(self, key, rate, burst):
+        now = time.monotonic()
+        interval = 1 / rate
+        # Compared before adding this request's interval, so a new client's first request is never rounded into a wait
+        full_at = max(self._buckets.get(key, now), now)
+        wait = full_at - now - (burst - 1) * interval
+        if wait > 0:
+            return wait
+        self._buckets[key] = full_at + interval
+        if len(self._buckets) > self.max_keys:
+            self._prune(now)
+        return 0
+
+    def get_stats(self):
+        return {'keys': len(self._buckets), 'max_keys': self.max_keys, 'prunes': self._prunes}
+
+    def _prune(self, now):
+        buckets = list(self._buckets.items())
+        for key, full_at in buckets:
+            if full_at <= now:
+                self._buckets.pop(key, None)
+        # Under a flood of distinct clients, forgetting a bucket refills it, so the ones closest to full go first (down
+        # to 90% of `max_keys`, so the next new clients don't prune again right away)
+        excess = len(self._buckets) - self.max_keys * 9 // 10
+        if excess > 0:
+            for key, _ in heapq.nsmallest(excess, (x for x in buckets if x[1] > now), key=itemgetter(1)):
+                self._buckets.pop(key, None)
+        self._prunes += 1
+
+
+class RateLimiter(object):
+    """
+    Class that enforces the per-client budgets of requests (see `RATE_LIMITS`) on top of any rate limit backend.
+    """
+
+    def __init__(self, backend, budgets):
+        self.backend = backend
+        self.budgets = budgets  # Budget name -> (requests per second, burst)
+        self.limited = dict.fromkeys(budgets, 0)
+
+    def consume(self, budget, client_id):
+        """
+        Spends a request of the given budget of a client. Returns 0 if it had any left, or the seconds until it will.
+        """
+        rate, burst = self.budgets[budget]
+        wait = self.backend.consume('{}:{}'.format(budget, client_id), rate, burst)
+        if wait:
+            self.limited[budget] += 1
+        return wait
+
+    def get_stats(self):
+        stats = {'budgets': self.budgets, 'limited': self.limited}
+        stats.update(self.backend.get_stats())
+        return stats
+
+
+class ConcurrencyLimiter(object):
+    """
+    Class that caps the requests of a worker running at once, so a burst of them can't take every DB connection of
+    the pool. Requests past `max_in_flight` are shed instead of queued.
+
+    Requests in flight are kept in a list, since appending and popping are atomic: there's no lock either.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.shed = 0
+        self._in_flight = []
+
+    def acquire(self):
+        """
+        Counts a new request in, and returns True. Returns False if there are too many already.
+        """
+        self._in_flight.append(None)
+        if len(self._in_flight) > self.max_in_flight:
+            self._in_flight.pop()
+            self.shed += 1
+            return False
+        return True
+
+    def release(self):
+        self._in_flight.pop()
+
+    def get_stats(self):
+        return {'in_flight': len(self._in_flight), 'max_in_flight': self.max_in_flight, 'shed': self.shed}
+
+
+def get_rate_limiter(app=None):
+    """
+    Returns the rate limiter of the given app (or the current one), or None if rate limits are disabled (see
+    `RATE_LIMITS`).
+    """
+    app = app or current_app
+    if 'rate_limiter' not in app.extensions:
+        budgets = app.config['RATE_LIMITS']
+        backend_class = app.config['RATE_LIMIT_BACKEND']
+        if isinstance(backend_class, str):
+            backend_class = import_string(backend_class)
+        app.extensions['rate_limiter'] = (
+            RateLimiter(backend_class(**app.config['RATE_LIMIT_BACKEND_OPTIONS']), budgets)
+            if budgets and backend_class else None)
+    return app.extensions['rate_limiter']
+
+
+def get_concurrency_limiters(app=None):
+    """
+    Returns the concurrency limiters of the given app (or the current one) by budget (see `MAX_IN_FLIGHT`). Budgets
+    without one aren't limited.
+    """
+    app = app or current_app
+    if 'concurrency_limiters' not in app.extensions:
+        app.extensions['concurrency_limiters'] = {
+            budget: ConcurrencyLimiter(max_in_flight)
+            for budget, max_in_flight in (app.config['MAX_IN_FLIGHT'] or {}).items() if max_in_flight
+        }
+    return app.extensions['concurrency_limiters']
+
+
+def get_client_id(app, req):
+    """
+    Returns who sent the given request: the `RATE_LIMIT_CLIENT_HEADER` header if set, or else its IP address (taken
+    from `X-Forwarded-For` only behind trusted proxies, see `PROXY_FIX_X_FOR`).
+    """
+    header = app.config['RATE_LIMIT_CLIENT_HEADER']
+    client_id = req.headers.get(header) if header else None
+    if client_id:
+        return client_id
+    return req.remote_addr
+
+
+def configure_limits(app):
+    """
+    Limits the API requests of the given app: clients past their budget get HTTP 429, and requests past the ones a
+    worker runs at once get HTTP 503, both with a `Retry-After` header. Internal endpoints are never limited.
+    """
+    app.before_request(_limit_request)
+    app.teardown_request(_release_request)
+
+
+def _limit_request():
+    # Runs on every request: context locals are looked up once, since each lookup costs as much as the rest
+    app = current_app._get_current_object()
+    req = request._get_current_object()
+    if not req.path.startswith('/api/') or req.method == 'OPTIONS':
+        return None
+    budget = 'read' if req.method in _READ_METHODS else 'write'
+    rate_limiter = get_rate_limiter(app)
+    if rate_limiter is not None and budget in rate_limiter.budgets:
+        wait = rate_limiter.consume(budget, get_client_id(app, req))
+        if wait:
+            return _get_limited_response(429, 'Too many requests, slow down', wait)
+    # Endpoints that hold no DB connection while they run (e.g. event streams) opt out
+    concurrency_limiter = get_concurrency_limiters(app).get(budget)
+    view_class = getattr(app.view_functions.get(req.endpoint), 'view_class', None)
+    if concurrency_limiter is None or not getattr(view_class, 'admission_controlled', True):
+        return None
+    if not concurrency_limiter.acquire():
+        return _get_limited_response(503, 'The server is busy, try again later', app.config['SHED_RETRY_AFTER'])
+    g.concurrency_limiter = concurrency_limiter
+    return None
+
+
+def _release_request(exception=None):
+    # Streamed responses are released once they're done, since their request context lives until then
+    concurrency_limiter = g.pop('concurrency_limiter', None)
+    if concurrency_limiter is not None:
+        concurrency_limiter.release()
+
+
+def _get_limited_response(status, message, retry_after):
+    return Response(encode_json({'message': message}) + b'\n', status, mimetype='application/json',
+                    headers={'Retry-After': str(math.ceil(retry_after))})
@@ -1,25 +1,101 @@
 # coding=utf-8
 
 
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
 from flask import current_app
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import aliased, make_transient_to_detached
+from sqlalchemy.sql.functions import current_timestamp
+
+from app.cache import invalidate_todoitems
+from app.replicas import RoutingSQLAlchemy
+
+# Objects keep their values after a commit, so responses are serialized from what was just written instead of reading
+# it back (sessions only live as long as a request anyway). Read-only requests may read from replicas
+db = RoutingSQLAlchemy(session_options={'expire_on_commit': False})
+
+_row_classes = {}  # Column names -> named tuple class
+_SEARCH_CONFIG = db.literal_column("'simple'")  # Text search config without stemming, so prefixes match as typed
+
+
+@compiles(current_timestamp, 'sqlite')
+def _compile_sqlite_current_timestamp(element, compiler, **kwargs):
+    # SQLite's CURRENT_TIMESTAMP has no fractional seconds. Using the format SQLAlchemy stores datetimes in keeps them
+    # sorted (and comparable to bound datetimes) as plain strings, which keyset pagination relies on
+    return "strftime('%Y-%m-%d %H:%M:%f000', 'now')"
 
-db = SQLAlchemy()
+
+class MissingTODOListError(LookupError):
+    """
+    Raised when writing to a TODO list that no longer exists, e.g. because another worker deleted it while this one
+    still had it cached.
+    """
+
+
+class TODOListCache(object):
+    """
+    Class that caches TODO lists by ID and by name, so looking them up doesn't hit the DB on every request.
+
+    There's one cache per app (i.e. per worker), shared by all requests. Cached lists are kept detached from any session
+    and merged into the current one on every hit. Entries expire after `TODOLIST_CACHE_TTL` seconds, so changes made
+    by other workers are eventually picked up too. Until then, writes still find out about deleted lists from the DB
+    (see `TODOList.bump_version`), and so do reads of their version.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._todolists = {}  # ID -> (detached TODO list, expiration time)
+        self._ids_by_name = {}
+
+    def get(self, todolist_id=None, name=None):
+        if todolist_id is None:
+            todolist_id = self._ids_by_name.get(name)
+        cached_todolist, expires = self._todolists.get(todolist_id, (None, 0))
+        if cached_todolist is None or expires < time.monotonic():
+            return None
+        return db.session.merge(cached_todolist, load=False)
+
+    def set(self, todolist):
+        # Caching a detached copy, so the given instance can keep being used (and modified) by its session
+        cached_todolist = TODOList.__mapper__.class_manager.new_instance()
+        for column_attr in TODOList.__mapper__.column_attrs:
+            if column_attr.key in todolist.__dict__:
+                setattr(cached_todolist, column_attr.key, todolist.__dict__[column_attr.key])
+        make_transient_to_detached(cached_todolist)
+        self._todolists[todolist.id] = cached_todolist, time.monotonic() + self.ttl
+        self._ids_by_name[todolist.name] = todolist.id
+
+    def invalidate(self, todolist_id):
+        self._todolists.pop(todolist_id, None)
+        for name, cached_id in list(self._ids_by_name.items()):
+            if cached_id == todolist_id:
+                self._ids_by_name.pop(name, None)
 
 
 class TODOList(db.Model):
     """
     Class that represents a TODO list.
-    
-    This is in case we want to potentially manage multiple lists instead of a master list.
+
+    Items created without a TODO list (e.g. through `/api/todoitems`) belong to the default one.
     """
     __tablename__ = 'todolists'
 
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(255))
+    name = db.Column(db.String(255), index=True, unique=True)
     created = db.Column(db.DateTime, default=db.func.current_timestamp())
     modified = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
-    todoitems = db.relationship('TODOItem', lazy=True, backref=db.backref('todolists', lazy='joined'))
+    # Increased on every change to the TODO items of the list. Deferred, so cached TODO lists never hold a stale value
+    version = db.deferred(db.Column(db.BigInteger, nullable=False, default=0, server_default='0'))
+    # Kept up to date along with the version (see `bump_version`), and deferred for the same reason
+    item_count = db.deferred(db.Column(db.Integer, nullable=False, default=0, server_default='0'))
+    completed_count = db.deferred(db.Column(db.Integer, nullable=False, default=0, server_default='0'))
+    todoitems = db.relationship('TODOItem', lazy=True, backref='todolists')
 
     def __init__(self, name):
         self.name = name
@@ -30,19 +106,180 @@ class TODOList(db.Model):
     def save(self):
         db.session.add(self)
         db.session.commit()
+        # Using the identity key, since reading `self.id` after the commit would reload the whole TODO list
+        self.get_cache().invalidate(db.inspect(self).identity[0])
 
     def delete(self):
+        todolist_id = self.id
+        # Deleting its items with plain statements, instead of loading every one of them through the relationship
+        for table in (TODOItem.__table__, ArchivedTODOItem.__table__, TODOItemTombstone.__table__):
+            db.session.execute(table.delete().where(table.c.todolist_id == todolist_id))
         db.session.delete(self)
         db.session.commit()
+        self.get_cache().invalidate(todolist_id)
+        invalidate_todoitems(todolist_id)
 
     @classmethod
     def get_all(cls):
-        return cls.query.all()
+        return cls.query.order_by(cls.id).all()
+
+    @classmethod
+    def get_by_id(cls, todolist_id, cached=True):
+        """
+        Returns the TODO list with the given ID, or None. Unless `cached` is set, it's read from the DB (and cached).
+        """
+        return cached and cls._get_cached(todolist_id=todolist_id) or cls._cache(cls.query.get(todolist_id))
+
+    @classmethod
+    def get_by_name(cls, name):
+        return cls._get_cached(name=name) or cls._cache(cls.query.filter_by(name=name).first())
 
     @classmethod
     def get_default_todolist(cls):
-        # For simplicity, we're using a default TODO list for all TODO items
-        return cls.query.filter_by(name=current_app.config['DEFAULT_TODO_LIST_NAME']).first()
+        # For simplicity, we're using a default TODO list for all TODO items. It's created on first use if the DB
+        # wasn't seeded (see `python manage.py seed_db`)
+        name = current_app.config['DEFAULT_TODO_LIST_NAME']
+        default_todolist = cls.get_by_name(name)
+        if default_todolist is None:
+            default_todolist = cls(name=name)
+            try:
+                default_todolist.save()
+            except IntegrityError:
+                # Another request created it first (or it was just missing from a lagging replica)
+                db.session.rollback()
+                default_todolist = cls._cache(cls.query.filter_by(name=name).one())
+        return default_todolist
+
+    @classmethod
+    def get_version(cls, todolist_id):
+        return db.session.query(cls.version).filter_by(id=todolist_id).scalar()
+
+    @classmethod
+    def get_counts(cls, todolist_id):
+        """
+        Returns the `(version, items, completed items)` of the given TODO list, or None if it doesn't exist.
+        """
+        return db.session.query(cls.version, cls.item_count, cls.completed_count).filter_by(id=todolist_id).first()
+
+    @classmethod
+    def bump_version(cls, todolist_id, items=0, completed=0):
+        """
+        Increases the version of the given TODO list within the current transaction (i.e. it doesn't commit), and
+        returns the new version. `items` and `completed` are added to its item counts.
+
+        The UPDATE locks the TODO list row until the transaction ends, so concurrent writers get consecutive versions
+        and commit in version order. That's also what keeps item counts from drifting: only changes known upfront (i.e.
+        new items) are counted here, and changes to existing items are counted by `count_item_changes` once the TODO
+        list is locked.
+
+        Raises MissingTODOListError (rolling the transaction back) if the TODO list doesn't exist.
+        """
+        update = cls.get_version_update(todolist_id, items, completed)
+        if db.engine.dialect.implicit_returning:
+            version = db.session.execute(update.returning(cls.__table__.c.version)).scalar()
+        else:
+            db.session.execute(update)
+            version = cls.get_version(todolist_id)
+        if version is None:
+            db.session.rollback()
+            cls.get_cache().invalidate(todolist_id)
+            raise MissingTODOListError(todolist_id)
+        return version
+
+    @classmethod
+    def get_version_update(cls, todolist_id, items=0, completed=0):
+        """
+        Returns the statement run by `bump_version`, which only sets the item counts that change.
+        """
+        table = cls.__table__
+        values = {'version': table.c.version + 1}
+        if items:
+            values['item_count'] = table.c.item_count + items
+        if completed:
+            values['completed_count'] = table.c.completed_count + completed
+        return table.update().where(table.c.id == todolist_id).values(values)
+
+    @classmethod
+    def count_item_changes(cls, todolist_id, completed_ids=(), open_ids=(), deleted_ids=()):
+        """
+        Updates the item counts of the given TODO list for items about to be completed, reopened or deleted (by ID),
+        within the current transaction.
+
+        Must run after `bump_version` and before the items are written: with the TODO list locked, the items it reads
+        can't change meanwhile, so counting only the ones that actually change keeps the counts exact.
+        """
+        update = cls.get_count_update(todolist_id, completed_ids, open_ids, deleted_ids)
+        if update is not None:
+            db.session.execute(update)
+
+    @classmethod
+    def get_count_update(cls, todolist_id, completed_ids=(), open_ids=(), deleted_ids=()):
+        """
+        Returns the statement run by `count_item_changes`, or None if there's nothing to count.
+        """
+        completed_ids, open_ids, deleted_ids = set(completed_ids), set(open_ids), set(deleted_ids)
+        if not (completed_ids or open_ids or deleted_ids):
+            return None
+        table, todoitems = cls.__table__, TODOItem.__table__
+        is_completed = todoitems.c.completed.is_(db.true())
+
+        def count(todoitem_ids, *criteria):
+            if not todoitem_ids:
+                return db.literal_column('0')
+            return db.func.count().filter(db.and_(todoitems.c.id.in_(todoitem_ids), *criteria))
+
+        changed_items = db.and_(
+            todoitems.c.todolist_id == todolist_id, todoitems.c.id.in_(completed_ids | open_ids | deleted_ids))
+        completed_changes = db.select([
+            count(completed_ids, db.not_(is_completed)) - count(open_ids | deleted_ids, is_completed),
+        ]).where(changed_items)
+        values = {'completed_count': table.c.completed_count + completed_changes.as_scalar()}
+        if deleted_ids:
+            values['item_count'] = table.c.item_count - db.select([count(deleted_ids)]).where(changed_items).as_scalar()
+        return table.update().where(table.c.id == todolist_id).values(values)
+
+    @classmethod
+    def repair_counts(cls, todolist_id):
+        """
+        Recounts the items of the given TODO list, and returns the `(items, completed items)` that were wrong (None if
+        they were right).
+
+        The TODO list row is locked first, so writers that got there before are already committed (and counted), and
+        the ones that come after wait until the counts are fixed.
+        """
+        table, todoitems = cls.__table__, TODOItem.__table__
+        current_counts = db.session.execute(db.select([table.c.item_count, table.c.completed_count]).where(
+            table.c.id == todolist_id).with_for_update()).first()
+        real_counts = db.session.execute(db.select([
+            db.func.count(), db.func.count().filter(todoitems.c.completed.is_(db.true())),
+        ]).where(todoitems.c.todolist_id == todolist_id)).first()
+        if current_counts is None or tuple(current_counts) == tuple(real_counts):
+            db.session.rollback()
+            return None
+        db.session.execute(table.update().where(table.c.id == todolist_id).values(
+            item_count=real_counts[0], completed_count=real_counts[1]))
+        db.session.commit()
+        return tuple(current_counts)
+
+    @classmethod
+    def get_cache(cls):
+        """
+        Returns the TODO list cache of the current app.
+        """
+        if 'todolist_cache' not in current_app.extensions:
+            current_app.extensions['todolist_cache'] = TODOListCache(ttl=current_app.config['TODOLIST_CACHE_TTL'])
+        return current_app.extensions['todolist_cache']
+
+    @classmethod
+    def _get_cached(cls, todolist_id=None, name=None):
+        return cls.get_cache().get(todolist_id=todolist_id, name=name)
+
+    @classmethod
+    def _cache(cls, todolist):
+        # Misses aren't cached, so a TODO list is found as soon as it gets created
+        if todolist is not None:
+            cls.get_cache().set(todolist)
+        return todolist
 
 
 class TODOItem(db.Model):
@@ -59,6 +296,23 @@ class TODOItem(db.Model):
     completed = db.Column(db.Boolean, default=False)
     created = db.Column(db.DateTime, default=db.func.current_timestamp())
     modified = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+    # Version of the TODO list when this item was last written
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
+    # Timestamps set by the DB come back in the same INSERT or UPDATE (with RETURNING, where supported)
+    __mapper_args__ = {'eager_defaults': True}
+    # SQLite would reuse the ID of the last item once it's deleted, which clashes with its tombstone or archived copy
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    # Supported list queries, by (completed filter, sort column) -> index that answers them (see the end of this module)
+    LIST_INDEXES = {
+        (None, 'created'): 'ix_todoitems_todolist_id_created_id',
+        (None, 'modified'): 'ix_todoitems_todolist_id_modified_id',
+        (False, 'created'): 'ix_todoitems_open_todolist_id_created_id',
+        (False, 'modified'): 'ix_todoitems_open_todolist_id_modified_id',
+        (True, 'created'): 'ix_todoitems_completed_todolist_id_created_id',
+        (True, 'modified'): 'ix_todoitems_completed_todolist_id_modified_id',
+    }
 
     def __init__(self, name, todolist_id, completed=False):
         self.name = name
@@ -68,25 +322,694 @@ class TODOItem(db.Model):
     def __repr__(self):
         return '<TODOItem: {}>'.format(self.name)
 
-    def save(self):
+    def save(self, before_commit=None):
+        """
+        Saves the item. `before_commit()`, if given, is called once the item is flushed, right before the commit (e.g.
+        to publish its events in the same transaction).
+        """
+        todolist_id = self.todolist_id
+        state = db.inspect(self)
         db.session.add(self)
+        # The item must still hold its previous values in the DB while it's being counted
+        with db.session.no_autoflush:
+            if state.key is None:  # Not in the DB yet
+                self.version = TODOList.bump_version(todolist_id, items=1, completed=int(bool(self.completed)))
+            else:
+                self.version = TODOList.bump_version(todolist_id)
+                if state.attrs.completed.history.has_changes():
+                    TODOList.count_item_changes(todolist_id, **{
+                        'completed_ids' if self.completed else 'open_ids': [state.identity[0]]})
+        if before_commit is not None:
+            db.session.flush()  # So the item has its ID and timestamps
+            before_commit()
         db.session.commit()
+        invalidate_todoitems(todolist_id, [db.inspect(self).identity[0]])
 
-    def delete(self):
+    def delete(self, before_commit=None):
+        """
+        Deletes the item, and returns the version of its TODO list the deletion belongs to. `before_commit(version)`, if
+        given, is called with it right before the commit.
+        """
+        todoitem_id, todolist_id = self.id, self.todolist_id
+        version = TODOList.bump_version(todolist_id)
+        TODOList.count_item_changes(todolist_id, deleted_ids=[todoitem_id])
+        db.session.add(TODOItemTombstone(todoitem_id=todoitem_id, todolist_id=todolist_id, version=version))
         db.session.delete(self)
+        if before_commit is not None:
+            before_commit(version)
         db.session.commit()
+        invalidate_todoitems(todolist_id, [todoitem_id])
+        return version
 
-    def update(self, **data):
+    def update(self, before_commit=None, **data):
+        """
+        Sets the given values (skipping missing ones) and saves the item, only if any of them changed. Returns whether
+        it did, since nothing is written otherwise (and `before_commit` isn't called, see `save`).
+        """
         changed = False
         data.pop('id', None)  # Avoiding PK changes
+        data.pop('todolist_id', None)  # Items don't move between TODO lists
         for attr_name, new_value in data.items():
             current_value = getattr(self, attr_name, None)
             if new_value is not None and new_value != current_value:
                 setattr(self, attr_name, new_value)
                 changed = True
         if changed:
-            self.save()
+            self.save(before_commit)
+        return changed
+
+    @classmethod
+    def get_all(cls, todolist_id, columns=None, include_archived=False, **list_filters):
+        """
+        Returns all items of the given TODO list, newest first unless sorted otherwise (see `get_list_criteria` for the
+        sort and filters accepted). Archived items are left out, unless `include_archived` is set (the same goes for
+        every other read).
+        """
+        return cls._fetch_all(cls._get_sorted_query(todolist_id, columns, include_archived, **list_filters), columns)
+
+    @classmethod
+    def get_by_id(cls, todoitem_id, todolist_id=None, columns=None, include_archived=False):
+        """
+        Returns the item with the given ID, or None. With a TODO list, only items of that list are found (and on a
+        partitioned table, only its partition is read).
+        """
+        entity = cls._get_entity(include_archived)
+        query = cls._get_query(columns, entity).filter(entity.id == todoitem_id)
+        if todolist_id is not None:
+            query = query.filter(entity.todolist_id == todolist_id)
+        rows = cls._fetch_all(query.limit(1), columns)
+        return rows[0] if rows else None
+
+    @classmethod
+    def get_page(cls, todolist_id, limit, after=None, columns=None, include_archived=False, **list_filters):
+        """
+        Returns up to `limit` items of the given TODO list, newest first unless sorted otherwise.
+
+        `after` is the `(sort value, id)` key of the last item of the previous page. Seeking past it (instead of using
+        an OFFSET) lets the DB jump straight into the composite index, so every page costs the same no matter how deep
+        it is.
+        """
+        query = cls._get_sorted_query(todolist_id, columns, include_archived, after=after, **list_filters)
+        return cls._fetch_all(query.limit(limit), columns)
+
+    @classmethod
+    def get_list_criteria(cls, todolist_id, sort='-created', completed=None, ranges=None, after=None, entity=None):
+        """
+        Returns the filters and the sort order of a list query. Raises ValueError if no index supports it.
+
+        `sort` is the column to sort by, prefixed with "-" for descending order. `completed` keeps only open (False) or
+        completed (True) items. `ranges` maps column names to `(after, before)` datetimes (either one may be None), and
+        `after` is the `(sort value, id)` key to seek past. Every combination allowed by `LIST_INDEXES` is answered by
+        an index range scan: range filters are only supported on the sort column, which comes right after the TODO list
+        in each index. `entity` is what the criteria apply to (see `_get_entity`).
+        """
+        entity = entity or cls
+        sort_column_name = sort.lstrip('-')
+        descending = sort.startswith('-')
+        if (completed, sort_column_name) not in cls.LIST_INDEXES:
+            raise ValueError('Sorting by {} is not supported'.format(sort_column_name))
+        for column_name in ranges or {}:
+            if column_name != sort_column_name:
+                raise ValueError('Filtering by {} is only supported when sorting by it'.format(column_name))
+
+        sort_column = getattr(entity, sort_column_name)
+        criteria = [entity.todolist_id == todolist_id]
+        if completed is not None:
+            # Same predicates as the partial indexes
+            criteria.append(entity.completed.is_(db.true() if completed else db.false()))
+        range_start, range_end = (ranges or {}).get(sort_column_name, (None, None))
+        if range_start is not None:
+            criteria.append(sort_column > range_start)
+        if range_end is not None:
+            criteria.append(sort_column < range_end)
+        if after is not None:
+            sort_key = db.tuple_(sort_column, entity.id)
+            criteria.append(sort_key < after if descending else sort_key > after)
+        # The `id` tie-breaker makes the order total, which keyset pagination relies on
+        if descending:
+            return criteria, [sort_column.desc(), entity.id.desc()]
+        return criteria, [sort_column.asc(), entity.id.asc()]
+
+    @classmethod
+    def search(cls, todolist_id, terms, limit, columns=None, include_archived=False, completed=None, ranges=None):
+        """
+        Returns up to `limit` items of the given TODO list with words starting with every one of the given search terms,
+        best matches first. `completed` and `ranges` filter them just like list queries (see `get_list_criteria`).
+        """
+        entity = cls._get_entity(include_archived, completed)
+        criterion, order_by = cls.get_search_criteria(terms, db.engine.dialect.name, entity, completed, ranges)
+        query = cls._get_query(columns, entity).filter(entity.todolist_id == todolist_id, criterion)
+        return cls._fetch_all(query.order_by(*order_by).limit(limit), columns)
+
+    @classmethod
+    def get_search_criteria(cls, terms, dialect_name, entity=None, completed=None, ranges=None):
+        """
+        Returns the filter and the sort order that find items by the given search terms (lowercase words), optionally
+        filtered by `completed` and `ranges` (see `get_list_criteria`, although any range goes here, since the search
+        terms already narrow the items down).
+
+        On Postgres, terms become a prefix full-text query (e.g. "buy:* & tom:*") ranked by `ts_rank`, which the
+        `ix_todoitems_name_search` GIN index answers without scanning the table. Other DBs (e.g. the SQLite stand-in)
+        fall back to matching the start of words with LIKE, newest first.
+        """
+        entity = entity or cls
+        criteria = []
+        if completed is not None:
+            criteria.append(entity.completed.is_(db.true() if completed else db.false()))
+        for column_name, (range_start, range_end) in (ranges or {}).items():
+            column = getattr(entity, column_name)
+            if range_start is not None:
+                criteria.append(column > range_start)
+            if range_end is not None:
+                criteria.append(column < range_end)
+        if dialect_name == 'postgresql':
+            document = db.func.to_tsvector(_SEARCH_CONFIG, db.func.coalesce(entity.name, ''))
+            query = db.func.to_tsquery(_SEARCH_CONFIG, ' & '.join('{}:*'.format(x) for x in terms))
+            order_by = [db.func.ts_rank(document, query).desc(), entity.created.desc(), entity.id.desc()]
+            return db.and_(document.op('@@')(query), *criteria), order_by
+        name = db.func.lower(db.func.coalesce(entity.name, ''))
+        for term in terms:
+            term = term.replace('_', '\\_')
+            criteria.append(db.or_(name.like(term + '%', escape='\\'), name.like('% ' + term + '%', escape='\\')))
+        return db.and_(*criteria), [entity.created.desc(), entity.id.desc()]
+
+    @classmethod
+    def iter_all(cls, todolist_id, batch_size=1000, columns=None, include_archived=False):
+        """
+        Lazily yields all items of the given TODO list, newest first, fetching `batch_size` rows at a time from a
+        server-side cursor so memory usage doesn't depend on the size of the list.
+        """
+        query = cls._get_sorted_query(todolist_id, columns, include_archived)
+        if not columns:
+            return query.yield_per(batch_size)
+        return cls._iter_rows(query.statement.execution_options(stream_results=True), columns, batch_size)
+
+    @classmethod
+    def apply_batch(cls, todolist_id, creates=(), updates=None, deletes=(), before_commit=None):
+        """
+        Applies many changes to the given TODO list in a single transaction, using multi-row statements.
+
+        `creates` is a list of dicts with the columns of each new item, `updates` maps item IDs to the columns to change
+        and `deletes` is a list of item IDs. Returns the created items (in order), the updated items (by ID), the set of
+        deleted IDs and the new version of the TODO list (None if nothing changed). Items are returned as dicts of
+        columns, and IDs not found in the TODO list are left out. `before_commit`, if given, is called with the same
+        values right before the commit (not at all if nothing changed).
+        """
+        updates = updates or {}
+        table = cls.__table__
+        existing_rows = cls._get_rows(todolist_id, list(updates) + list(deletes))
+
+        # Just like `update()`, only values that actually change are written
+        changes = {}
+        for todoitem_id, data in updates.items():
+            if todoitem_id not in existing_rows:
+                continue
+            row_changes = {k: v for k, v in data.items() if v is not None and v != existing_rows[todoitem_id][k]}
+            if row_changes:
+                changes[todoitem_id] = row_changes
+        deleted_ids = set(existing_rows).intersection(deletes)
+        if not (creates or changes or deleted_ids):
+            return [], {x: existing_rows[x] for x in updates if x in existing_rows}, set(), None
+
+        version = TODOList.bump_version(
+            todolist_id, items=len(creates), completed=sum(bool(x.get('completed')) for x in creates))
+        TODOList.count_item_changes(
+            todolist_id, completed_ids=[k for k, v in changes.items() if v.get('completed') is True],
+            open_ids=[k for k, v in changes.items() if v.get('completed') is False], deleted_ids=deleted_ids)
+        created = cls._bulk_insert([dict(x, todolist_id=todolist_id, version=version) for x in creates])
+        cls._bulk_update(todolist_id, {k: dict(v, version=version) for k, v in changes.items()})
+        if deleted_ids:
+            TODOItemTombstone.bulk_create(todolist_id, deleted_ids, version)
+            db.session.execute(table.delete().where(db.and_(
+                table.c.todolist_id == todolist_id, table.c.id.in_(deleted_ids))))
+
+        updated = {x: existing_rows[x] for x in updates if x in existing_rows}
+        updated.update(cls._get_rows(todolist_id, list(changes)))
+        if before_commit is not None:
+            before_commit(created, updated, deleted_ids, version)
+        db.session.commit()
+        invalidate_todoitems(todolist_id, list(changes) + list(deleted_ids))
+        return created, updated, deleted_ids, version
+
+    @classmethod
+    def archive_completed(cls, older_than, batch_size=1000, max_batches=None, on_batch=None):
+        """
+        Moves the items completed more than `older_than` (a timedelta) ago, by their last change, to the archive, TODO
+        list by TODO list, in batches of up to `batch_size` items (see `archive_batch`). Stops after `max_batches` (if
+        given) and returns the amount of items moved. `on_batch(todolist_id, version, todoitem_ids)` is called within
+        each batch, right before it commits.
+
+        Progress is checkpointed after each TODO list, so an interrupted run resumes where it left off, with its
+        original cutoff.
+        """
+        # The DB sets the timestamps, so its clock sets the cutoff too
+        cutoff = db.session.query(db.func.current_timestamp()).scalar() - older_than
+        checkpoint = ArchiveCheckpoint.get_or_create(cls.__tablename__, cutoff)
+        archived = batches = 0
+        while True:
+            todolist_ids = [x for x, in db.session.query(TODOList.id).filter(
+                TODOList.id > checkpoint.todolist_id).order_by(TODOList.id).limit(batch_size)]
+            if not todolist_ids:
+                checkpoint.delete()
+                return archived
+            for todolist_id in todolist_ids:
+                while max_batches is None or batches < max_batches:
+                    version, todoitem_ids = cls.archive_batch(
+                        todolist_id, checkpoint.cutoff, batch_size,
+                        None if on_batch is None else lambda *args: on_batch(todolist_id, *args))
+                    if not todoitem_ids:
+                        break
+                    batches += 1
+                    archived += len(todoitem_ids)
+                    if len(todoitem_ids) < batch_size:
+                        break
+                else:
+                    return archived
+                checkpoint.save(todolist_id)
+
+    @classmethod
+    def archive_batch(cls, todolist_id, cutoff, batch_size=1000, before_commit=None):
+        """
+        Moves up to `batch_size` items of the given TODO list completed before `cutoff` (oldest first) to the archive,
+        in a single transaction. Returns the version of the TODO list the move belongs to and the IDs moved, or
+        `(None, [])` if there was nothing to move. `before_commit`, if given, is called with the same values right
+        before the commit.
+
+        Clients that sync the TODO list see archived items as deleted ones: they get tombstones, and they're no longer
+        part of the item counts.
+        """
+        table = cls.__table__
+        select_ids = db.select([table.c.id]).where(db.and_(
+            table.c.todolist_id == todolist_id, table.c.completed.is_(db.true()), table.c.modified < cutoff,
+        )).order_by(table.c.modified, table.c.id).limit(batch_size)
+        # Checked before locking the TODO list, so lists with nothing to archive don't get a new version
+        todoitem_ids = [x for x, in db.session.execute(select_ids)]
+        if todoitem_ids:
+            version = TODOList.bump_version(todolist_id)
+            # Read again with the TODO list locked, since they may have changed meanwhile
+            todoitem_ids = [x for x, in db.session.execute(select_ids)]
+        if not todoitem_ids:
+            db.session.rollback()
+            return None, []
+
+        TODOList.count_item_changes(todolist_id, deleted_ids=todoitem_ids)
+        moved_items = db.and_(table.c.todolist_id == todolist_id, table.c.id.in_(todoitem_ids))
+        db.session.execute(ArchivedTODOItem.__table__.insert().from_select(
+            [x.name for x in table.c], db.select(list(table.c)).where(moved_items)))
+        TODOItemTombstone.bulk_create(todolist_id, todoitem_ids, version)
+        db.session.execute(table.delete().where(moved_items))
+        if before_commit is not None:
+            before_commit(version, todoitem_ids)
+        db.session.commit()
+        invalidate_todoitems(todolist_id, todoitem_ids)
+        return version, todoitem_ids
+
+    @classmethod
+    def _bulk_insert(cls, rows, chunk_size=5000):
+        table = cls.__table__
+        if not rows:
+            return []
+        if not db.engine.dialect.implicit_returning:
+            # No RETURNING support, so we insert them one by one (still within the same transaction)
+            new_ids = [db.session.execute(table.insert().values(x)).inserted_primary_key[0] for x in rows]
+            new_rows = cls._get_rows(rows[0]['todolist_id'], new_ids)
+            return [new_rows[x] for x in new_ids]
+        created = []
+        for chunk_start in range(0, len(rows), chunk_size):
+            insert = table.insert().values(rows[chunk_start:chunk_start + chunk_size]).returning(*table.c)
+            created.extend(dict(x.items()) for x in db.session.execute(insert))
+        return created
+
+    @classmethod
+    def _bulk_update(cls, todolist_id, changes, chunk_size=5000):
+        # One statement per set of changed columns. The TODO list lets partitioned tables skip other partitions
+        table = cls.__table__
+        changes_by_columns = {}
+        for todoitem_id, row_changes in changes.items():
+            changes_by_columns.setdefault(tuple(sorted(row_changes)), []).append(dict(row_changes, _id=todoitem_id))
+        for column_names, params in changes_by_columns.items():
+            if db.engine.dialect.name != 'postgresql':
+                # No UPDATE ... FROM, so it's an executemany (SQLite runs in-process, without round trips anyway)
+                update = table.update().where(db.and_(
+                    table.c.todolist_id == todolist_id, table.c.id == db.bindparam('_id')))
+                db.session.execute(update.values({x: db.bindparam(x) for x in column_names}), params)
+                continue
+            # psycopg2 runs an executemany as one UPDATE per row, so rows are joined to their changes instead
+            for chunk_start in range(0, len(params), chunk_size):
+                rows = cls._get_values(params[chunk_start:chunk_start + chunk_size], ('_id',) + column_names)
+                update = table.update().where(db.and_(table.c.todolist_id == todolist_id, table.c.id == rows.c._id))
+                db.session.execute(update.values({x: rows.c[x] for x in column_names}))
+
+    @classmethod
+    def _get_values(cls, params, column_names):
+        # Returns a subquery with the given rows (dicts of column name -> value) out of a VALUES list
+        table = cls.__table__
+        values = ', '.join('({})'.format(', '.join(':{}_{}'.format(x, idx) for x in column_names))
+                           for idx in range(len(params)))
+        text = db.text('SELECT * FROM (VALUES {}) AS v ({})'.format(values, ', '.join(column_names))).bindparams(**{
+            '{}_{}'.format(x, idx): row[x] for idx, row in enumerate(params) for x in column_names})
+        columns = (db.column(x, table.c['id' if x == '_id' else x].type) for x in column_names)
+        return text.columns(*columns).alias('changes')
+
+    @classmethod
+    def _get_rows(cls, todolist_id, todoitem_ids):
+        # Returns a dict of item ID -> item columns
+        if not todoitem_ids:
+            return {}
+        table = cls.__table__
+        select = table.select().where(db.and_(table.c.todolist_id == todolist_id, table.c.id.in_(todoitem_ids)))
+        return {x['id']: dict(x.items()) for x in db.session.execute(select)}
+
+    @classmethod
+    def get_partitioning(cls):
+        """
+        Returns how the table is partitioned by TODO list ("hash" or "list"), or None if it isn't (see the 6c1f9e3b7a52
+        migration).
+        """
+        if db.engine.dialect.name != 'postgresql':
+            return None
+        strategy = db.session.execute(
+            "SELECT partstrat FROM pg_partitioned_table WHERE partrelid = to_regclass('todoitems')").scalar()
+        return {'h': 'hash', 'l': 'list'}.get(strategy)
+
+    @classmethod
+    def create_partition(cls, todolist_id):
+        """
+        Moves the items of the given TODO list from the default partition into a partition of their own. Only works on
+        tables partitioned by list.
+
+        Lists created after the table got partitioned share the default partition, until they grow large enough to
+        deserve their own. Writes to the default partition are blocked while its items are moved.
+
+        Raises ValueError if the TODO list doesn't exist, or if the table isn't partitioned by list.
+        """
+        todolist_id = int(todolist_id)
+        if TODOList.get_by_id(todolist_id) is None:
+            raise ValueError('The TODO list {} does not exist'.format(todolist_id))
+        if cls.get_partitioning() != 'list':
+            raise ValueError('The TODO items table is not partitioned by list')
+        partition_name = 'todoitems_l{}'.format(todolist_id)
+        db.session.execute('LOCK TABLE todoitems_default IN EXCLUSIVE MODE')
+        db.session.execute('CREATE TABLE {} (LIKE todoitems INCLUDING DEFAULTS)'.format(partition_name))
+        db.session.execute('INSERT INTO {} SELECT * FROM todoitems_default WHERE todolist_id = :todolist_id'.format(
+            partition_name), {'todolist_id': todolist_id})
+        db.session.execute(
+            'DELETE FROM todoitems_default WHERE todolist_id = :todolist_id', {'todolist_id': todolist_id})
+        # Attaching it creates the indexes of the partitioned table on it
+        db.session.execute('ALTER TABLE todoitems ATTACH PARTITION {} FOR VALUES IN ({})'.format(
+            partition_name, todolist_id))
+        db.session.commit()
+
+    @classmethod
+    def get_changes(cls, todolist_id, since_version, until_version, columns=None):
+        """
+        Returns the items of the given TODO list written after `since_version` (up to `until_version`, included),
+        plus the IDs of the items deleted meanwhile.
+        """
+        query = cls._get_query(columns).filter(
+            cls.todolist_id == todolist_id, cls.version > since_version, cls.version <= until_version,
+        ).order_by(cls.version, cls.id)
+        deleted_ids = TODOItemTombstone.get_deleted_ids(todolist_id, since_version, until_version)
+        return cls._fetch_all(query, columns), deleted_ids
+
+    @classmethod
+    def _get_entity(cls, include_archived=False, completed=None):
+        """
+        Returns what reads should query: this model, or an alias of it that reads both live and archived items (which
+        are all completed, so they're skipped when only open items are wanted).
+        """
+        if include_archived and completed is not False:
+            return _ALL_TODOITEMS
+        return cls
+
+    @classmethod
+    def _get_query(cls, columns=None, entity=None):
+        entity = entity or cls
+        if columns:
+            return db.session.query(*(getattr(entity, x.key) for x in columns))
+        return db.session.query(entity)
+
+    @classmethod
+    def _fetch_all(cls, query, columns=None):
+        """
+        Runs the given query and returns ORM instances, or named tuples of the given columns if there are any.
+
+        Column-only reads skip the ORM altogether: the statement runs straight on the session's connection, so there
+        are no instances to build, no identity map to fill and no per-row `KeyedTuple` overhead.
+        """
+        if not columns:
+            return query.all()
+        return list(map(_get_row_class(columns)._make, db.session.execute(query.statement)))
+
+    @classmethod
+    def _iter_rows(cls, statement, columns, batch_size):
+        make_row = _get_row_class(columns)._make
+        result = db.session.execute(statement)
+        rows = result.fetchmany(batch_size)
+        while rows:
+            yield from map(make_row, rows)
+            rows = result.fetchmany(batch_size)
+
+    @classmethod
+    def _get_sorted_query(cls, todolist_id, columns=None, include_archived=False, **list_filters):
+        entity = cls._get_entity(include_archived, list_filters.get('completed'))
+        criteria, order_by = cls.get_list_criteria(todolist_id, entity=entity, **list_filters)
+        return cls._get_query(columns, entity).filter(*criteria).order_by(*order_by)
+
+
+class TODOItemTombstone(db.Model):
+    """
+    Class that records the deletion of a TODO item.
+
+    Clients that keep their own copy of a TODO list use them to find out which items they should drop.
+    """
+    __tablename__ = 'todoitem_tombstones'
+
+    todoitem_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    todolist_id = db.Column(db.Integer, db.ForeignKey('todolists.id'), nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    deleted = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def __init__(self, todoitem_id, todolist_id, version):
+        self.todoitem_id = todoitem_id
+        self.todolist_id = todolist_id
+        self.version = version
+
+    def __repr__(self):
+        return '<TODOItemTombstone: {}>'.format(self.todoitem_id)
+
+    @classmethod
+    def bulk_create(cls, todolist_id, todoitem_ids, version):
+        rows = [{'todoitem_id': x, 'todolist_id': todolist_id, 'version': version} for x in todoitem_ids]
+        db.session.execute(cls.__table__.insert().values(rows))
+
+    @classmethod
+    def get_deleted_ids(cls, todolist_id, since_version, until_version):
+        query = db.session.query(cls.todoitem_id).filter(
+            cls.todolist_id == todolist_id, cls.version > since_version, cls.version <= until_version)
+        return [x for x, in query.order_by(cls.version, cls.todoitem_id)]
+
+
+class ArchivedTODOItem(db.Model):
+    """
+    Class that represents a completed TODO item moved out of the TODO items table (see `TODOItem.archive_completed`), so
+    that table and its indexes only grow with active work.
+
+    Archived items keep their IDs and columns, and are only read along with live ones (see `TODOItem._get_entity`).
+    """
+    __tablename__ = 'archived_todoitems'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(255))
+    todolist_id = db.Column(db.Integer, db.ForeignKey('todolists.id'), nullable=False)
+    completed = db.Column(db.Boolean)
+    created = db.Column(db.DateTime)
+    modified = db.Column(db.DateTime)
+    version = db.Column(db.BigInteger, nullable=False)
+    archived = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return '<ArchivedTODOItem: {}>'.format(self.name)
+
+    @classmethod
+    def count(cls, todolist_id):
+        return db.session.query(db.func.count(cls.id)).filter(cls.todolist_id == todolist_id).scalar()
+
+
+class ArchiveCheckpoint(db.Model):
+    """
+    Class that records how far an archival run got, so it can resume after being interrupted.
+    """
+    __tablename__ = 'archive_checkpoints'
+
+    name = db.Column(db.String(64), primary_key=True)  # Table being archived
+    cutoff = db.Column(db.DateTime, nullable=False)
+    todolist_id = db.Column(db.Integer, nullable=False, default=0)  # Last TODO list done
+    updated = db.Column(db.DateTime, default=db.func.current_timestamp(), onupdate=db.func.current_timestamp())
+
+    def __repr__(self):
+        return '<ArchiveCheckpoint: {} {}>'.format(self.name, self.todolist_id)
+
+    def save(self, todolist_id):
+        self.todolist_id = todolist_id
+        db.session.add(self)
+        db.session.commit()
+
+    def delete(self):
+        db.session.delete(self)
+        db.session.commit()
+
+    @classmethod
+    def get_or_create(cls, name, cutoff):
+        """
+        Returns the checkpoint of the run archiving the given table, starting a new one with the given cutoff if there's
+        none.
+        """
+        checkpoint = cls.query.get(name)
+        if checkpoint is None:
+            checkpoint = cls(name=name, cutoff=cutoff, todolist_id=0)
+            checkpoint.save(0)
+        return checkpoint
+
+
+class IdempotencyKey(db.Model):
+    """
+    Class that stores the response of a request sent with an `Idempotency-Key` header, so retries of that request get
+    it back instead of writing anything again.
+
+    Keys are scoped by request path, and expire `IDEMPOTENCY_KEY_TTL` seconds after they were used. Expired keys are
+    ignored, and deleted by `purge_expired`.
+    """
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (db.UniqueConstraint('key', 'path', name='uq_idempotency_keys_key_path'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False)
+    path = db.Column(db.String(255), nullable=False)
+    # Hash of the request body, so keys can't be reused for different requests
+    request_hash = db.Column(db.String(64), nullable=False)
+    # Both are empty while the request is still running
+    status = db.Column(db.Integer)
+    response = db.Column(db.Text)  # JSON body
+    expires = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return '<IdempotencyKey: {} {}>'.format(self.path, self.key)
 
     @classmethod
-    def get_all(cls, todolist_id):
-        return cls.query.filter_by(todolist_id=todolist_id).order_by(cls.created.desc()).all()
+    def get(cls, key, path):
+        """
+        Returns the key used for the given path, or None if it wasn't used (or it already expired).
+        """
+        return cls.query.filter(cls.key == key, cls.path == path, cls.expires > datetime.utcnow()).first()
+
+    @classmethod
+    def run(cls, key, path, request_hash, write):
+        """
+        Runs `write()`, which commits its changes and returns the `(body, status)` of the response, and stores that
+        response under the given key. Returns it too, or None if another request with the same key got there first.
+
+        The key is claimed in the same transaction as the changes, so when two requests with the same key run at once,
+        the unique constraint makes the last one to commit roll back. The response is stored right after the commit.
+        If `write()` fails after its commit, the claim is dropped, so retries run it again instead of getting HTTP 409
+        until the key expires.
+        """
+        claimed = []
+
+        def claim(session):
+            if claimed:  # Only the first commit within `write()` holds its changes
+                return
+            table = cls.__table__
+            session.execute(table.delete().where(db.and_(
+                table.c.key == key, table.c.path == path, table.c.expires <= datetime.utcnow())))
+            ttl = timedelta(seconds=current_app.config['IDEMPOTENCY_KEY_TTL'])
+            claimed.append(cls(key=key, path=path, request_hash=request_hash, expires=datetime.utcnow() + ttl))
+            session.add(claimed[0])
+
+        session = db.session()
+        event.listen(session, 'before_commit', claim)
+        try:
+            body, status = write()
+        except IntegrityError:
+            db.session.rollback()
+            if cls.get(key, path) is None:
+                raise
+            return None
+        except Exception:
+            db.session.rollback()
+            if claimed and db.inspect(claimed[0]).persistent:
+                table = cls.__table__
+                db.session.execute(table.delete().where(table.c.id == claimed[0].id))
+                db.session.commit()
+            raise
+        finally:
+            event.remove(session, 'before_commit', claim)
+        # Nothing is stored if nothing was written, since running it again is harmless then
+        if claimed:
+            claimed[0].status, claimed[0].response = status, json.dumps(body)
+            db.session.commit()
+        return body, status
+
+    @classmethod
+    def purge_expired(cls, batch_size=1000, max_batches=None):
+        """
+        Deletes expired keys in batches of up to `batch_size`, each in its own transaction so locks are held briefly.
+        Stops after `max_batches` (if given) and returns the amount of keys deleted.
+        """
+        table = cls.__table__
+        deleted = batches = 0
+        while max_batches is None or batches < max_batches:
+            expired_ids = db.select([table.c.id]).where(table.c.expires <= datetime.utcnow()).limit(batch_size)
+            batch_deleted = db.session.execute(table.delete().where(table.c.id.in_(expired_ids))).rowcount
+            db.session.commit()
+            deleted += batch_deleted
+            batches += 1
+            if batch_deleted < batch_size:
+                break
+        return deleted
+
+
+def _get_row_class(columns):
+    """
+    Returns the named tuple class for rows of the given columns (e.g. `TODOItemRow(id, name, completed, ...)`).
+    """
+    names = tuple(x.key for x in columns)
+    if names not in _row_classes:
+        _row_classes[names] = namedtuple('TODOItemRow', names)
+    return _row_classes[names]
+
+
+db.Index('ix_todoitems_todolist_id_created_id', TODOItem.todolist_id, TODOItem.created.desc(), TODOItem.id.desc())
+db.Index('ix_todoitems_todolist_id_modified_id', TODOItem.todolist_id, TODOItem.modified.desc(), TODOItem.id.desc())
+# Partial indexes for open and completed items, so filtering by status still reads items in order
+_OPEN, _COMPLETED = TODOItem.completed.is_(db.false()), TODOItem.completed.is_(db.true())
+db.Index('ix_todoitems_open_todolist_id_created_id', TODOItem.todolist_id, TODOItem.created.desc(), TODOItem.id.desc(),
+         postgresql_where=_OPEN, sqlite_where=_OPEN)
+db.Index('ix_todoitems_open_todolist_id_modified_id', TODOItem.todolist_id, TODOItem.modified.desc(),
+         TODOItem.id.desc(), postgresql_where=_OPEN, sqlite_where=_OPEN)
+db.Index('ix_todoitems_completed_todolist_id_created_id', TODOItem.todolist_id, TODOItem.created.desc(),
+         TODOItem.id.desc(), postgresql_where=_COMPLETED, sqlite_where=_COMPLETED)
+db.Index('ix_todoitems_completed_todolist_id_modified_id', TODOItem.todolist_id, TODOItem.modified.desc(),
+         TODOItem.id.desc(), postgresql_where=_COMPLETED, sqlite_where=_COMPLETED)
+db.Index('ix_todoitems_todolist_id_version', TODOItem.todolist_id, TODOItem.version)
+db.Index('ix_archived_todoitems_todolist_id_created_id', ArchivedTODOItem.todolist_id, ArchivedTODOItem.created.desc(),
+         ArchivedTODOItem.id.desc())
+db.Index('ix_archived_todoitems_todolist_id_modified_id', ArchivedTODOItem.todolist_id,
+         ArchivedTODOItem.modified.desc(), ArchivedTODOItem.id.desc())
+db.Index('ix_todoitem_tombstones_todolist_id_version', TODOItemTombstone.todolist_id, TODOItemTombstone.version)
+db.Index('ix_idempotency_keys_expires', IdempotencyKey.expires)
+# Full-text index for name search (see `TODOItem.get_search_criteria`), only available on Postgres
+event.listen(TODOItem.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_todoitems_name_search ON todoitems USING gin (to_tsvector('simple', coalesce(name, '')))",
+).execute_if(dialect='postgresql'))
+event.listen(ArchivedTODOItem.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_archived_todoitems_name_search ON archived_todoitems "
+    "USING gin (to_tsvector('simple', coalesce(name, '')))",
+).execute_if(dialect='postgresql'))
+
+# Live and archived items as a single table, queried instead of `TODOItem` by reads with `include_archived`. Each side
+# still uses its own indexes, since the DB pushes filters and sorts down into both
+_ALL_TODOITEMS = aliased(TODOItem, db.union_all(
+    db.select(list(TODOItem.__table__.c)),
+    db.select([ArchivedTODOItem.__table__.c[x.name] for x in TODOItem.__table__.c]),
+).alias('all_todoitems'), adapt_on_names=True)
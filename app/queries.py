@@ -0,0 +1,131 @@
+# coding=utf-8
+"""
+Query string params, cursors, response fields and events of the TODO items API, shared by its sync (`app.api`) and
+async (`app.async_api`) versions.
+"""
+
+
+import base64
+import json
+import re
+from datetime import datetime, timezone
+
+from flask_restful import fields, inputs
+
+from app.models import TODOItem
+from app.serializers import RowSerializer
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+EVENT_STREAM_MIMETYPE = 'text/event-stream'
+SORTS = ('-created', 'created', '-modified', 'modified')
+RANGE_ARGS = ('created_after', 'created_before', 'modified_after', 'modified_before')
+TODOITEM_FIELDS = {
+    'id': fields.Integer,
+    'name': fields.String,
+    'completed': fields.Boolean,
+    'created': fields.DateTime('iso8601'),
+    'modified': fields.DateTime('iso8601'),
+}
+TODOITEM_SERIALIZER = RowSerializer(TODOITEM_FIELDS, TODOItem)
+_CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+_MAX_SEARCH_TERMS = 10
+
+
+def encode_cursor(todoitem, sort=SORTS[0]):
+    """
+    Returns an opaque cursor pointing right after the given TODO item, in a list with the given sort.
+    """
+    sort_value = getattr(todoitem, sort.lstrip('-')).strftime(_CURSOR_DATETIME_FORMAT)
+    # Cursors of the default sort leave it out, so they look just like the ones issued before sorting was supported
+    return _encode_opaque([sort_value, todoitem.id] if sort == SORTS[0] else [sort_value, todoitem.id, sort])
+
+
+def decode_cursor(cursor):
+    """
+    Returns the `(sort value, id, sort)` stored in the given cursor. Raises ValueError if the cursor is malformed.
+    """
+    try:
+        sort_value, todoitem_id, *sort = _decode_opaque(cursor)
+        sort = sort[0] if sort else SORTS[0]
+        if sort not in SORTS:
+            raise ValueError
+        return datetime.strptime(sort_value, _CURSOR_DATETIME_FORMAT), int(todoitem_id), sort
+    except (TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def get_list_filters(list_args):
+    """
+    Returns the keyword args of `TODOItem.get_list_criteria` for the sort and filters in the given list params.
+    """
+    ranges = {}
+    for range_arg in RANGE_ARGS:
+        if list_args[range_arg] is not None:
+            column_name, bound = range_arg.split('_')
+            ranges.setdefault(column_name, [None, None])[bound == 'before'] = list_args[range_arg]
+    return {'sort': list_args['sort'], 'completed': list_args['completed'], 'ranges': ranges}
+
+
+def get_search_errors(args):
+    """
+    Returns the errors (by param name) of the given query string params that don't go along with a search (`q`), whose
+    results are sorted by relevance: they can be filtered like lists, but neither sorted nor paginated.
+    """
+    return {x: 'Search results are sorted by relevance' for x in ('sort', 'after') if args.get(x) is not None}
+
+
+def parse_datetime(value):
+    """
+    Returns the naive UTC datetime of the given ISO 8601 string (UTC unless it says otherwise).
+    """
+    return inputs.datetime_from_iso8601(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def encode_sync_cursor(version):
+    """
+    Returns an opaque cursor pointing to the given version of a TODO list.
+    """
+    return _encode_opaque({'version': version})
+
+
+def decode_sync_cursor(cursor):
+    """
+    Returns the TODO list version stored in the given sync cursor, where "0" stands for a sync from scratch. Raises
+    ValueError if the cursor is malformed.
+    """
+    if cursor == '0':
+        return 0
+    try:
+        return int(_decode_opaque(cursor)['version'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+def parse_search_terms(text):
+    """
+    Returns the lowercase words of the given search text. Raises ValueError if there are none.
+    """
+    terms = re.findall(r'\w+', text.lower())[:_MAX_SEARCH_TERMS]
+    if not terms:
+        raise ValueError('Nothing to search for')
+    return terms
+
+
+def format_server_sent_event(event_type, data, event_id=None):
+    """
+    Returns a server-sent event with the given type and JSON data, plus its ID if given.
+    """
+    lines = ['event: {}'.format(event_type)]
+    if event_id is not None:
+        lines.append('id: {}'.format(event_id))
+    lines.append('data: {}'.format(json.dumps(data)))
+    return '\n'.join(lines) + '\n\n'
+
+
+def _encode_opaque(value):
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip('=')
+
+
+def _decode_opaque(cursor):
+    return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+
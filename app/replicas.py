@@ -0,0 +1,181 @@
+# coding=utf-8
+
+
+import itertools
+import time
+
+from flask import current_app, request
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, exc, orm
+from sqlalchemy.sql import Select
+
+# Cookie that keeps the reads of a client on the primary DB for a while after it writes anything
+_LAST_WRITE_COOKIE = 'last_write'
+_READ_METHODS = ('GET', 'HEAD')
+# Seconds a replica is behind the primary (0 if it's up to date, or if it isn't a replica at all)
+_POSTGRES_LAG_QUERY = '''
+SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+            ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END
+'''
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that runs plain SELECTs on a read replica, once `use_replica()` is called (see `configure_replicas`).
+
+    Anything else (flushes, DML, SELECT ... FOR UPDATE or raw SQL) runs on the primary DB, and so does whatever the
+    session runs after it, so a request always reads its own writes.
+    """
+
+    def use_replica(self, engine):
+        self.info['replica'] = engine
+
+    def use_primary(self):
+        self.info.pop('replica', None)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None:
+            if not self._flushing and isinstance(clause, Select) and clause._for_update_arg is None:
+                return replica
+            self.use_primary()
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy extension whose sessions are `RoutingSession`s.
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+class Replica(object):
+    """
+    Class that keeps track of the health of a read replica: whether it's reachable and, on Postgres, not lagging more
+    than `max_lag` seconds behind the primary. It's checked at most once every `health_check_interval` seconds, and
+    right away whenever it drops a connection.
+    """
+
+    def __init__(self, engine, health_check_interval=5, max_lag=None):
+        self.engine = engine
+        self.health_check_interval = health_check_interval
+        self.max_lag = max_lag
+        self.healthy = True
+        self.reads = 0
+        self._checked = None
+        event.listen(engine, 'handle_error', self._on_error)
+
+    def is_healthy(self):
+        now = time.monotonic()
+        if self._checked is None or now - self._checked >= self.health_check_interval:
+            self._checked = now
+            self.healthy = self._check()
+        return self.healthy
+
+    def get_stats(self):
+        return {'url': repr(self.engine.url), 'healthy': self.healthy, 'reads': self.reads}
+
+    def _check(self):
+        try:
+            with self.engine.connect() as connection:
+                if self.max_lag is None or self.engine.dialect.name != 'postgresql':
+                    connection.execute('SELECT 1')
+                    return True
+                return (connection.execute(_POSTGRES_LAG_QUERY).scalar() or 0) <= self.max_lag
+        except exc.DBAPIError:
+            return False
+
+    def _on_error(self, context):
+        if context.is_disconnect:
+            self._checked = None  # Checked again before its next read
+
+
+class ReplicaSet(object):
+    """
+    Class that picks the read replica for each read-only request, round-robin among the healthy ones.
+    """
+
+    def __init__(self, replicas):
+        self.replicas = replicas
+        self.fallbacks = 0  # Reads sent to the primary since no replica was healthy
+        self._counter = itertools.count()
+
+    def choose(self):
+        """
+        Returns the engine of the next healthy replica, or None if there's none.
+        """
+        start = next(self._counter)
+        for idx in range(len(self.replicas)):
+            replica = self.replicas[(start + idx) % len(self.replicas)]
+            if replica.is_healthy():
+                replica.reads += 1
+                return replica.engine
+        self.fallbacks += 1
+        return None
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def get_stats(self):
+        return {'replicas': [x.get_stats() for x in self.replicas], 'fallbacks': self.fallbacks}
+
+
+def get_replica_set(app=None):
+    """
+    Returns the read replicas of the given app (or the current one), or None if it has none (see `DB_REPLICA_URIS`).
+    """
+    return (app or current_app).extensions.get('db_replicas')
+
+
+def configure_replicas(app, engines):
+    """
+    Sends the reads of read-only API requests (GET and HEAD) of the given app to the given replica engines.
+
+    Clients keep reading from the primary DB for `DB_REPLICA_READ_YOUR_WRITES` seconds after they write anything, so
+    they don't miss their own changes while replicas catch up. So do the endpoints that set `replica_reads = False`.
+    """
+    app.extensions['db_replicas'] = ReplicaSet([
+        Replica(x, app.config['DB_REPLICA_HEALTH_CHECK_INTERVAL'], app.config['DB_REPLICA_MAX_LAG']) for x in engines])
+    app.before_request(_route_reads)
+    app.after_request(_remember_writes)
+    app.teardown_request(_stop_routing_reads)
+
+
+def _route_reads():
+    if request.method not in _READ_METHODS or not request.path.startswith('/api/') or _wrote_recently():
+        return
+    view_class = getattr(current_app.view_functions.get(request.endpoint), 'view_class', None)
+    if not getattr(view_class, 'replica_reads', True):
+        return
+    engine = get_replica_set().choose()
+    if engine is not None:
+        _get_session()().use_replica(engine)
+
+
+def _remember_writes(response):
+    if request.method not in _READ_METHODS and request.path.startswith('/api/') and response.status_code < 400:
+        window = current_app.config['DB_REPLICA_READ_YOUR_WRITES']
+        response.set_cookie(_LAST_WRITE_COOKIE, str(time.time()), max_age=window, path='/api/', httponly=True)
+    return response
+
+
+def _stop_routing_reads(exception=None):
+    # Sessions outlive the requests that run inside an outer app context (e.g. in tests)
+    session = _get_session()
+    if session.registry.has():
+        session().use_primary()
+
+
+def _wrote_recently():
+    try:
+        last_write = float(request.cookies.get(_LAST_WRITE_COOKIE, 0))
+    except ValueError:
+        return False
+    return time.time() - last_write < current_app.config['DB_REPLICA_READ_YOUR_WRITES']
+
+
+def _get_session():
+    return current_app.extensions['sqlalchemy'].db.session
@@ -0,0 +1,55 @@
+# coding=utf-8
+
+
+from datetime import datetime
+
+from flask_restful import fields
+
+
+class RowSerializer(object):
+    """
+    Class that turns DB rows into the same dicts `flask_restful.marshal` would build out of ORM instances, only faster.
+
+    The fields are resolved once, when the serializer is created: each response field is mapped to a model column (so
+    rows can be fetched with column-only queries, in `columns` order) and to a plain function that formats its value.
+    """
+
+    def __init__(self, response_fields, model):
+        self.keys = tuple(response_fields)
+        self.columns = tuple(getattr(model, x) for x in self.keys)
+        self._formatters = tuple(_compile_field(x) for x in response_fields.values())
+        self._empty = dict(zip(self.keys, (default for _, default in self._formatters)))
+
+    def serialize(self, row):
+        """
+        Returns the dict for a single row (a tuple with one value per column, in `columns` order). None is serialized
+        just like `marshal` does, with the default value of each field.
+        """
+        if row is None:
+            return dict(self._empty)
+        return {
+            key: default if value is None else format_value(value)
+            for key, (format_value, default), value in zip(self.keys, self._formatters, row)
+        }
+
+    def serialize_many(self, rows):
+        serialize = self.serialize
+        return [serialize(x) for x in rows]
+
+
+def _compile_field(field):
+    """
+    Returns a `(format function, default value)` tuple with the same behavior as the given flask_restful field.
+    """
+    if isinstance(field, type):
+        field = field()
+    if type(field) is fields.Integer:
+        return int, field.default
+    if type(field) is fields.Boolean:
+        return bool, field.default
+    if type(field) is fields.String:
+        return str, field.default
+    if type(field) is fields.DateTime and field.dt_format == 'iso8601':
+        return datetime.isoformat, field.default
+    # Any other field keeps its own (slower) formatting
+    return field.format, field.default
@@ -0,0 +1,11 @@
+# coding=utf-8
+"""
+ASGI entry point, to serve the TODO items API from an event loop: `uvicorn asgi:app`.
+"""
+
+
+import os
+
+from app.async_api import create_async_app
+
+app = create_async_app(os.getenv('FLASK_ENV'))
@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Helpers shared by all benchmark scripts.
+
+Benchmarks run against the testing DB (see `config.TestingConfig`), which is wiped before seeding.
+"""
+
+
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from app import create_app
+from app.models import db, TODOItem, TODOList
+from config import Env, load_initial_db_data
+
+
+def create_benchmark_app():
+    """
+    Returns a new Flask app bound to an empty testing DB that only contains the default TODO list.
+    """
+    app = create_app(Env.TESTING)
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        load_initial_db_data(app, db)
+    return app
+
+
+def drop_benchmark_db(app):
+    """
+    Drops all tables created by `create_benchmark_app`, so test cases start from an empty DB.
+    """
+    with app.app_context():
+        db.session.remove()
+        db.drop_all()
+
+
+def seed_todoitems(todolist_id, amount, chunk_size=1000):
+    """
+    Inserts `amount` TODO items into the given TODO list using multi-row INSERTs. Must run inside an app context.
+
+    Every item gets a distinct creation date (one second apart, newest last) so sorting is deterministic.
+    """
+    table = TODOItem.__table__
+    oldest = datetime.utcnow() - timedelta(seconds=amount)
+    for chunk_start in range(0, amount, chunk_size):
+        rows = []
+        for idx in range(chunk_start, min(chunk_start + chunk_size, amount)):
+            created = oldest + timedelta(seconds=idx)
+            rows.append({'name': 'Benchmark TODO item #{}'.format(idx), 'todolist_id': todolist_id,
+                         'completed': idx % 3 == 0, 'created': created, 'modified': created})
+        db.session.execute(table.insert().values(rows))
+    db.session.commit()
+    # Items inserted straight into the table aren't counted otherwise
+    TODOList.repair_counts(todolist_id)
+    if db.engine.dialect.name == 'postgresql':
+        # Fresh stats so the planner picks the same plans it would on a long-lived table
+        db.session.execute('ANALYZE todoitems')
+        db.session.commit()
+
+
+def get_default_todolist_id():
+    """
+    Returns the ID of the default TODO list. Must run inside an app context.
+    """
+    return TODOList.get_default_todolist().id
+
+
+def measure(func, repeat):
+    """
+    Calls `func` `repeat` times and returns the wall time of each call, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings):
+    """
+    Returns the mean, p50 and p99 of the given timings, in milliseconds.
+    """
+    ordered = sorted(timings)
+    return {
+        'mean_ms': statistics.mean(ordered) * 1000,
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+    }
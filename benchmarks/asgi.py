@@ -0,0 +1,147 @@
+# coding=utf-8
+"""
+Benchmark of the async serving mode (`uvicorn asgi:app`) against the current sync deployment (`gunicorn run:app`).
+
+Usage: python -m benchmarks.asgi [CONCURRENCY ...]  (defaults to 10, 50 and 200 concurrent clients)
+
+Both servers run in the background against the testing Postgres DB. Each concurrent client keeps sending a mix of GET
+page, GET item and PUT requests for a while, and the benchmark reports throughput, p50/p99 latency, the memory of all
+server processes (also per concurrent client) and how many DB connections the server opened.
+"""
+
+
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+from app.models import TODOItem, db
+from benchmarks import create_benchmark_app, drop_benchmark_db, get_default_todolist_id, seed_todoitems, summarize
+
+DEFAULT_CONCURRENCIES = [10, 50, 200]
+SIZE = 10000
+DURATION = 10  # Seconds per run
+SYNC_WORKERS = 4
+ASYNC_WORKERS = 1
+HOST = '127.0.0.1'
+PORT = 5099
+SERVERS = {
+    'sync (gunicorn, {} workers)'.format(SYNC_WORKERS): [
+        'gunicorn', '--workers', str(SYNC_WORKERS), '--bind', '{}:{}'.format(HOST, PORT), 'run:app'],
+    'async (uvicorn, {} worker)'.format(ASYNC_WORKERS): [
+        'uvicorn', '--workers', str(ASYNC_WORKERS), '--host', HOST, '--port', str(PORT), '--no-access-log', 'asgi:app'],
+}
+
+
+def start_server(command):
+    process = subprocess.Popen(
+        command, env=dict(os.environ, FLASK_ENV='testing'), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get('http://{}:{}/api/todoitems?limit=1'.format(HOST, PORT)).status_code == 200:
+                return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError('{} did not start'.format(command[0]))
+
+
+def get_rss_mb(pid):
+    """
+    Returns the resident memory of the given process and all its children, in MB.
+    """
+    pids = [pid]
+    rss_kb = 0
+    while pids:
+        current_pid = pids.pop()
+        try:
+            with open('/proc/{}/status'.format(current_pid)) as status_file:
+                rss_kb += next(int(x.split()[1]) for x in status_file if x.startswith('VmRSS:'))
+            for task in os.listdir('/proc/{}/task'.format(current_pid)):
+                with open('/proc/{}/task/{}/children'.format(current_pid, task)) as children_file:
+                    pids.extend(int(x) for x in children_file.read().split())
+        except (OSError, StopIteration):
+            continue
+    return rss_kb / 1024
+
+
+def count_db_connections(app):
+    with app.app_context():
+        query = 'SELECT count(*) FROM pg_stat_activity WHERE datname = current_database() AND pid <> pg_backend_pid()'
+        count = db.session.execute(query).scalar()
+        db.session.remove()
+    return count
+
+
+async def run_clients(concurrency, todoitem_ids):
+    """
+    Runs `concurrency` clients for `DURATION` seconds, and returns the latency of every request they sent.
+    """
+    timings = []
+    deadline = time.monotonic() + DURATION
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url='http://{}:{}'.format(HOST, PORT), limits=limits, timeout=60) as client:
+
+        async def run_client(client_idx):
+            rng = random.Random(client_idx)
+            while time.monotonic() < deadline:
+                todoitem_url = '/api/todoitems/{}'.format(rng.choice(todoitem_ids))
+                request_type = rng.random()
+                start = time.perf_counter()
+                if request_type < 0.45:
+                    response = await client.get('/api/todoitems', params={'limit': 20})
+                elif request_type < 0.9:
+                    response = await client.get(todoitem_url)
+                else:
+                    response = await client.put(todoitem_url, json={'completed': rng.random() < 0.5})
+                timings.append(time.perf_counter() - start)
+                assert response.status_code == 200, response.status_code
+
+        await asyncio.gather(*[run_client(x) for x in range(concurrency)])
+    return timings
+
+
+def run(concurrency):
+    app = create_benchmark_app()
+    with app.app_context():
+        seed_todoitems(get_default_todolist_id(), SIZE)
+        todoitem_ids = [x for x, in db.session.query(TODOItem.id)]
+        db.session.remove()
+    results = {}
+    try:
+        for label, command in SERVERS.items():
+            process = start_server(command)
+            try:
+                idle_rss_mb = get_rss_mb(process.pid)
+                start = time.perf_counter()
+                timings = asyncio.run(run_clients(concurrency, todoitem_ids))
+                elapsed = time.perf_counter() - start
+                rss_mb = get_rss_mb(process.pid)
+                results[label] = dict(
+                    summarize(timings), throughput_rps=len(timings) / elapsed, idle_rss_mb=idle_rss_mb, rss_mb=rss_mb,
+                    rss_mb_per_client=rss_mb / concurrency, db_connections=count_db_connections(app))
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        drop_benchmark_db(app)
+    return results
+
+
+def main(concurrencies):
+    header = '{:>7}  {:<30}  {:>8}  {:>9}  {:>9}  {:>9}  {:>13}  {:>8}'
+    row = ('{:>7}  {:<30}  {throughput_rps:>8.1f}  {p50_ms:>9.2f}  {p99_ms:>9.2f}  {rss_mb:>9.1f}  '
+           '{rss_mb_per_client:>13.2f}  {db_connections:>8}')
+    print(header.format('clients', 'server', 'req/s', 'p50 (ms)', 'p99 (ms)', 'RSS (MB)', 'MB per client', 'DB conns'))
+    for concurrency in concurrencies:
+        for label, stats in run(concurrency).items():
+            print(row.format(concurrency, label, **stats))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_CONCURRENCIES)
@@ -0,0 +1,64 @@
+# coding=utf-8
+"""
+Benchmarks POST /api/todoitems/batch against the single-item endpoints for creating and updating many TODO items.
+
+Usage: python -m benchmarks.batch [SIZE ...]  (defaults to 1k and 10k items)
+"""
+
+
+import sys
+import time
+
+from benchmarks import create_benchmark_app, drop_benchmark_db
+
+DEFAULT_SIZES = (1000, 10000)
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def run_single(client, size):
+    todoitem_ids = []
+
+    def create():
+        for idx in range(size):
+            response = client.post('/api/todoitems', json={'name': 'Single TODO item #{}'.format(idx)})
+            todoitem_ids.append(response.get_json()['id'])
+
+    def update():
+        for todoitem_id in todoitem_ids:
+            client.put('/api/todoitems/{}'.format(todoitem_id), json={'completed': True})
+
+    return timed(create), timed(update)
+
+
+def run_batch(client, size):
+    todoitem_ids = []
+
+    def create():
+        creates = [{'name': 'Batch TODO item #{}'.format(idx)} for idx in range(size)]
+        response = client.post('/api/todoitems/batch', json={'create': creates})
+        todoitem_ids.extend(x['item']['id'] for x in response.get_json()['create'])
+
+    def update():
+        updates = [{'id': x, 'completed': True} for x in todoitem_ids]
+        client.post('/api/todoitems/batch', json={'update': updates})
+
+    return timed(create), timed(update)
+
+
+def main(sizes):
+    print('{:>8}  {:<8}  {:>12}  {:>12}'.format('items', 'path', 'create (s)', 'update (s)'))
+    for size in sizes:
+        for label, run in (('single', run_single), ('batch', run_batch)):
+            app = create_benchmark_app()
+            create_time, update_time = run(app.test_client(), size)
+            drop_benchmark_db(app)
+            print('{:>8}  {:<8}  {:>12.2f}  {:>12.2f}'.format(size, label, create_time, update_time))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,70 @@
+# coding=utf-8
+"""
+Benchmark of column-only reads (named tuples fetched without the ORM) against full ORM instances.
+
+Usage: python -m benchmarks.column_reads [SIZE ...]  (defaults to 100k items)
+
+For each list size, measures the time to fetch all items of a list both ways, and the memory each result takes (what's
+still allocated once the list is built) along with the peak allocated while building it.
+"""
+
+
+import gc
+import sys
+import tracemalloc
+
+from app.api import TODOItemsEndpoint
+from app.models import TODOItem, db
+from benchmarks import (
+    create_benchmark_app, drop_benchmark_db, get_default_todolist_id, measure, seed_todoitems, summarize)
+
+DEFAULT_SIZES = [100000]
+REPEAT = 5
+
+
+def measure_memory(func):
+    """
+    Calls `func` and returns the MB still allocated while its result is alive, and the peak MB allocated by the call.
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current / 1024 / 1024, peak / 1024 / 1024
+
+
+def run(size):
+    app = create_benchmark_app()
+    columns = TODOItemsEndpoint._serializer.columns
+    readers = {
+        'ORM instances': lambda: TODOItem.get_all(todolist_id),
+        'column rows': lambda: TODOItem.get_all(todolist_id, columns=columns),
+    }
+    results = {}
+    with app.app_context():
+        todolist_id = get_default_todolist_id()
+        seed_todoitems(todolist_id, size)
+        for label, read in readers.items():
+            # Each read starts from an empty session, just like a request does
+            timings = measure(lambda: (db.session.expunge_all(), read()), REPEAT)
+            db.session.expunge_all()
+            results[label] = dict(summarize(timings), **dict(zip(('retained_mb', 'peak_mb'), measure_memory(read))))
+            db.session.expunge_all()
+    drop_benchmark_db(app)
+    return results
+
+
+def main(sizes):
+    header = '{:<16}  {:>10}  {:>10}  {:>10}  {:>12}  {:>10}'
+    row = '{:<16}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}  {retained_mb:>12.1f}  {peak_mb:>10.1f}'
+    for size in sizes:
+        print(header.format('{} items'.format(size), 'mean (ms)', 'p50 (ms)', 'p99 (ms)', 'retained (MB)', 'peak (MB)'))
+        for label, stats in run(size).items():
+            print(row.format(label, **stats))
+        print()
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+Benchmark of the bytes on the wire and the CPU cost of GET /api/todoitems (the whole list) with each JSON encoder and
+content encoding.
+
+Usage: python -m benchmarks.compression [--sizes 100 1000 10000 100000 1000000] [--repeat 3]
+
+JSON encoders:
+    - pretty: indented JSON, as flask_restful used to send it in debug mode
+    - compact: `app.encoding.dumps_compact`, the default
+    - orjson: `app.encoding.dumps_orjson` (skipped unless orjson is installed)
+Content encodings: identity, gzip and br (skipped unless brotli is installed), with the levels in `TestingConfig`.
+
+CPU time covers the whole request (fetching, serializing, encoding and compressing), so differences between rows of the
+same size come down to encoding and compression.
+"""
+
+
+import argparse
+import json
+import sys
+import time
+
+from app.encoding import brotli
+from app.models import db
+from benchmarks import create_benchmark_app, drop_benchmark_db, get_default_todolist_id, seed_todoitems, summarize
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+DEFAULT_REPEAT = 3
+CONTENT_ENCODINGS = ('identity', 'gzip', 'br')
+
+
+def get_json_encoders():
+    """
+    Returns the JSON encoders to compare, by label (`JSON_ENCODER` values).
+    """
+    json_encoders = {
+        'pretty': lambda data: json.dumps(data, indent=4),
+        'compact': 'app.encoding.dumps_compact',
+    }
+    try:
+        import orjson  # noqa: F401
+        json_encoders['orjson'] = 'app.encoding.dumps_orjson'
+    except ImportError:
+        pass
+    return json_encoders
+
+
+def run(size, repeat):
+    """
+    Returns `(JSON encoder, content encoding, response bytes, CPU timings)` tuples for a list of the given size.
+    """
+    app = create_benchmark_app()
+    client = app.test_client()
+    with app.app_context():
+        seed_todoitems(get_default_todolist_id(), size)
+        db.session.remove()
+
+    results = []
+    try:
+        for label, json_encoder in get_json_encoders().items():
+            app.config['JSON_ENCODER'] = json_encoder
+            app.extensions.pop('json_encoder', None)
+            for content_encoding in CONTENT_ENCODINGS:
+                if content_encoding == 'br' and brotli is None:
+                    continue
+                headers = {'Accept-Encoding': content_encoding}
+                timings = []
+                for _ in range(repeat):
+                    start = time.process_time()
+                    response = client.get('/api/todoitems', headers=headers)
+                    body = response.get_data()
+                    timings.append(time.process_time() - start)
+                assert response.headers.get('Content-Encoding', 'identity') == content_encoding
+                results.append((label, content_encoding, len(body), timings))
+    finally:
+        drop_benchmark_db(app)
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of response encoding and compression')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Items per list')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Requests per combination')
+    args = parser.parse_args(argv)
+
+    print('{:>8}  {:<8}  {:<8}  {:>14}  {:>8}  {:>14}  {:>14}'.format(
+        'items', 'json', 'encoding', 'bytes', 'ratio', 'cpu mean (ms)', 'cpu p50 (ms)'))
+    row = '{:>8}  {:<8}  {:<8}  {:>14}  {:>8.3f}  {mean_ms:>14.2f}  {p50_ms:>14.2f}'
+    for size in args.sizes:
+        results = run(size, args.repeat)
+        baseline_bytes = results[0][2]  # Pretty, uncompressed JSON
+        for label, content_encoding, response_bytes, timings in results:
+            print(row.format(size, label, content_encoding, response_bytes, response_bytes / baseline_bytes,
+                             **summarize(timings)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
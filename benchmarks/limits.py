@@ -0,0 +1,70 @@
+# coding=utf-8
+"""
+Microbenchmark of the overhead the request limits (`app.limits`) add to every API request.
+
+Usage: python -m benchmarks.limits [--calls 100000] [--clients 1 1000 1000000]
+
+Measures, in microseconds per call:
+    - rate limiter: spending a request of a budget, for the given number of distinct clients (with 1M of them, the
+      buckets get pruned along the way)
+    - concurrency limiter: counting a request in and out
+    - whole check: both, plus identifying the client, as run before (and after) each request
+No DB is needed.
+"""
+
+
+import argparse
+import sys
+import time
+
+from app import create_app
+from app.limits import ConcurrencyLimiter, LocalRateLimitBackend, RateLimiter, _limit_request, _release_request
+from config import Env
+
+DEFAULT_CALLS = 100000
+DEFAULT_CLIENTS = [1, 1000, 1000000]
+# Generous enough that no request is ever limited: rejected ones would be cheaper
+BUDGETS = {'read': (1000000, 1000000), 'write': (1000000, 1000000)}
+
+
+def time_calls(func, calls):
+    """
+    Returns the mean microseconds per call of `func(idx)`, for `calls` calls.
+    """
+    start = time.perf_counter()
+    for idx in range(calls):
+        func(idx)
+    return (time.perf_counter() - start) / calls * 1000000
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of the request limits overhead')
+    parser.add_argument('--calls', type=int, default=DEFAULT_CALLS, help='Calls to time')
+    parser.add_argument('--clients', type=int, nargs='+', default=DEFAULT_CLIENTS, help='Distinct clients')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for clients in args.clients:
+        rate_limiter = RateLimiter(LocalRateLimitBackend(), BUDGETS)
+        client_ids = ['10.0.{}.{}'.format(x // 256, x % 256) for x in range(min(clients, args.calls))]
+        results['rate limiter ({} clients)'.format(clients)] = time_calls(
+            lambda idx: rate_limiter.consume('write', client_ids[idx % len(client_ids)]), args.calls)
+
+    concurrency_limiter = ConcurrencyLimiter(10)
+    results['concurrency limiter'] = time_calls(
+        lambda idx: concurrency_limiter.acquire() and concurrency_limiter.release(), args.calls)
+
+    app = create_app(Env.TESTING)
+    app.config['RATE_LIMITS'] = BUDGETS
+    with app.test_request_context('/api/todoitems', method='POST', environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        app.preprocess_request()  # Matches the URL and sets up the limiters
+        _release_request()
+        results['whole check'] = time_calls(lambda idx: _limit_request() or _release_request(), args.calls)
+
+    print('{:<32}  {:>10}'.format('', 'us / call'))
+    for label, micros in results.items():
+        print('{:<32}  {:>10.3f}'.format(label, micros))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
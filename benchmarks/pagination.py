@@ -0,0 +1,56 @@
+# coding=utf-8
+"""
+Benchmarks GET /api/todoitems with keyset pagination on lists of growing size.
+
+Usage: python -m benchmarks.pagination [SIZE ...]  (defaults to 10k, 100k and 1M items)
+
+Page latency should stay flat across sizes, both for the first page and for a page deep inside the list, while the
+legacy full-list response grows linearly (it is only measured up to `FULL_LIST_MAX_SIZE` items).
+"""
+
+
+import sys
+
+from app.models import TODOItem
+from app.queries import encode_cursor
+from benchmarks import (
+    create_benchmark_app, drop_benchmark_db, get_default_todolist_id, measure, seed_todoitems, summarize)
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+FULL_LIST_MAX_SIZE = 100000
+PAGE_SIZE = 100
+REPEAT = 50
+
+
+def run(size):
+    app = create_benchmark_app()
+    client = app.test_client()
+    with app.app_context():
+        todolist_id = get_default_todolist_id()
+        seed_todoitems(todolist_id, size)
+        middle_todoitem = TODOItem._get_sorted_query(todolist_id).offset(size // 2).first()
+        middle_cursor = encode_cursor(middle_todoitem)
+
+    def get(**query_string):
+        response = client.get('/api/todoitems', query_string=query_string)
+        assert response.status_code == 200, response.status_code
+
+    results = {
+        'first page': summarize(measure(lambda: get(limit=PAGE_SIZE), REPEAT)),
+        'middle page': summarize(measure(lambda: get(limit=PAGE_SIZE, after=middle_cursor), REPEAT)),
+    }
+    if size <= FULL_LIST_MAX_SIZE:
+        results['full list'] = summarize(measure(get, 3))
+    drop_benchmark_db(app)
+    return results
+
+
+def main(sizes):
+    print('{:>10}  {:<12}  {:>10}  {:>10}  {:>10}'.format('items', 'request', 'mean (ms)', 'p50 (ms)', 'p99 (ms)'))
+    for size in sizes:
+        for label, stats in run(size).items():
+            print('{:>10}  {:<12}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}'.format(size, label, **stats))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
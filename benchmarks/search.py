@@ -0,0 +1,50 @@
+# coding=utf-8
+"""
+Benchmarks GET /api/todoitems?q= on lists of growing size.
+
+Usage: python -m benchmarks.search [SIZE ...]  (defaults to 100k and 1M items)
+
+Selective searches (a few matches) should stay in the milliseconds at any size. Broad searches (every item matches)
+have to rank all matches, so they grow with the size of the list.
+"""
+
+
+import sys
+
+from benchmarks import (
+    create_benchmark_app, drop_benchmark_db, get_default_todolist_id, measure, seed_todoitems, summarize)
+
+DEFAULT_SIZES = (100000, 1000000)
+REPEAT = 20
+SEARCHES = {
+    'exact word': '4242',
+    'prefix': '424',
+    'two words': 'item 4242',
+    'broad (all items)': 'benchmark',
+}
+
+
+def run(size):
+    app = create_benchmark_app()
+    client = app.test_client()
+    with app.app_context():
+        seed_todoitems(get_default_todolist_id(), size)
+
+    def search(text):
+        response = client.get('/api/todoitems', query_string={'q': text, 'limit': 20})
+        assert response.status_code == 200, response.status_code
+
+    results = {label: summarize(measure(lambda: search(text), REPEAT)) for label, text in SEARCHES.items()}
+    drop_benchmark_db(app)
+    return results
+
+
+def main(sizes):
+    print('{:>10}  {:<18}  {:>10}  {:>10}  {:>10}'.format('items', 'search', 'mean (ms)', 'p50 (ms)', 'p99 (ms)'))
+    for size in sizes:
+        for label, stats in run(size).items():
+            print('{:>10}  {:<18}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}'.format(size, label, **stats))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,62 @@
+# coding=utf-8
+"""
+Microbenchmark of the fast serializer (`app.serializers.RowSerializer`) against flask_restful's marshalling.
+
+Usage: python -m benchmarks.serializer [SIZE]  (defaults to 100k items)
+
+Measures fetching and serializing all items of a list on their own, and then the whole GET /api/todoitems request with
+`FAST_SERIALIZER` on and off (checking that both return the same bytes).
+"""
+
+
+import sys
+
+from flask_restful import marshal
+
+from app.api import TODOItemsEndpoint
+from app.models import TODOItem
+from benchmarks import (
+    create_benchmark_app, drop_benchmark_db, get_default_todolist_id, measure, seed_todoitems, summarize)
+
+DEFAULT_SIZE = 100000
+REPEAT = 5
+
+
+def run(size):
+    app = create_benchmark_app()
+    client = app.test_client()
+    serializer = TODOItemsEndpoint._serializer
+    results = {}
+    with app.app_context():
+        todolist_id = get_default_todolist_id()
+        seed_todoitems(todolist_id, size)
+
+        todoitems = TODOItem.get_all(todolist_id)
+        rows = TODOItem.get_all(todolist_id, columns=serializer.columns)
+        assert marshal(todoitems, TODOItemsEndpoint._RESPONSE_FIELDS) == serializer.serialize_many(rows)
+        results['fetch ORM instances'] = measure(lambda: TODOItem.get_all(todolist_id), REPEAT)
+        results['fetch column tuples'] = measure(lambda: TODOItem.get_all(todolist_id, columns=serializer.columns),
+                                                 REPEAT)
+        results['marshal'] = measure(lambda: marshal(todoitems, TODOItemsEndpoint._RESPONSE_FIELDS), REPEAT)
+        results['RowSerializer'] = measure(lambda: serializer.serialize_many(rows), REPEAT)
+        del todoitems, rows
+
+    bodies = {}
+    for fast_serializer in (False, True):
+        app.config['FAST_SERIALIZER'] = fast_serializer
+        label = 'GET (FAST_SERIALIZER={})'.format(fast_serializer)
+        results[label] = measure(lambda: bodies.setdefault(fast_serializer, client.get('/api/todoitems').get_data()),
+                                 REPEAT)
+    assert bodies[False] == bodies[True], 'Both serializers must return the same bytes'
+    drop_benchmark_db(app)
+    return results
+
+
+def main(size):
+    print('{:<28}  {:>10}  {:>10}  {:>10}'.format('{} items'.format(size), 'mean (ms)', 'p50 (ms)', 'p99 (ms)'))
+    for label, timings in run(size).items():
+        print('{:<28}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}'.format(label, **summarize(timings)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_SIZE)
@@ -0,0 +1,80 @@
+# coding=utf-8
+"""
+Benchmark of how long a worker takes to boot and answer its first request.
+
+Usage: python -m benchmarks.startup [--runs 10]
+
+Each run starts a fresh interpreter, just like a new gunicorn worker without `preload_app`, and measures:
+    - import: importing the app package (Flask, Flask-RESTful, SQLAlchemy and the app modules)
+    - create_app: creating the app, which shouldn't open any DB connection (see `config.configure_db`)
+    - first request: the first GET of the TODO items, which opens the first DB connection
+    - second request: the same GET again, for comparison
+The DB connections opened while creating the app are reported too.
+
+With a preloaded app, forked workers skip the first two steps.
+"""
+
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from benchmarks import create_benchmark_app, drop_benchmark_db, summarize
+
+DEFAULT_RUNS = 10
+STEPS = ('import', 'create_app', 'first request', 'second request')
+
+# Runs in a fresh interpreter, and prints the seconds each step took (and the connections opened at startup) as JSON
+_WORKER_SCRIPT = """
+import json, time
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+connections = []
+event.listen(Pool, 'connect', lambda *args: connections.append(None))
+timings = [time.perf_counter()]
+from app import create_app
+timings.append(time.perf_counter())
+app = create_app('testing')
+timings.append(time.perf_counter())
+startup_connections = len(connections)
+client = app.test_client()
+for _ in range(2):
+    assert client.get('/api/todoitems', query_string={'limit': 1}).status_code == 200
+    timings.append(time.perf_counter())
+steps = [end - start for start, end in zip(timings, timings[1:])]
+print(json.dumps({'steps': steps, 'connections': startup_connections}))
+"""
+
+
+def run_worker():
+    """
+    Boots the app in a new interpreter, and returns the seconds each step took and the DB connections opened at startup.
+    """
+    output = subprocess.run([sys.executable, '-c', _WORKER_SCRIPT], check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True, env=dict(os.environ, PYTHONPATH=os.getcwd())).stdout
+    result = json.loads(output.splitlines()[-1])
+    return dict(zip(STEPS, result['steps'])), result['connections']
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of worker boot time')
+    parser.add_argument('--runs', type=int, default=DEFAULT_RUNS, help='Workers to boot')
+    args = parser.parse_args(argv)
+
+    app = create_benchmark_app()
+    try:
+        runs = [run_worker() for _ in range(args.runs)]
+    finally:
+        drop_benchmark_db(app)
+
+    print('{:<16}  {:>10}  {:>10}  {:>10}'.format('step', 'mean (ms)', 'p50 (ms)', 'p99 (ms)'))
+    row = '{:<16}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}'
+    for step in STEPS:
+        print(row.format(step, **summarize([timings[step] for timings, _ in runs])))
+    print('DB connections opened by create_app: {}'.format(max(x for _, x in runs)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,63 @@
+# coding=utf-8
+"""
+Benchmarks the peak memory used by full-list exports of GET /api/todoitems, with and without streaming.
+
+Usage: python -m benchmarks.streaming [SIZE ...]  (defaults to 10k, 100k and 1M items)
+
+The streamed exports (`?stream=1` and NDJSON) should keep the same peak no matter how many items there are, while the
+regular response grows linearly (it is only measured up to `FULL_LIST_MAX_SIZE` items).
+"""
+
+
+import sys
+import time
+import tracemalloc
+
+from benchmarks import create_benchmark_app, drop_benchmark_db, get_default_todolist_id, seed_todoitems
+
+DEFAULT_SIZES = (10000, 100000, 1000000)
+FULL_LIST_MAX_SIZE = 100000
+
+
+def measure_export(client, **kwargs):
+    """
+    Downloads a full export and returns its size, the peak memory allocated meanwhile and how long it took.
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get('/api/todoitems', buffered=False, **kwargs)
+    assert response.status_code == 200, response.status_code
+    size = sum(len(x) for x in response.iter_encoded())
+    response.close()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size, peak, elapsed
+
+
+def run(size):
+    app = create_benchmark_app()
+    client = app.test_client()
+    with app.app_context():
+        seed_todoitems(get_default_todolist_id(), size)
+
+    results = {
+        'stream=1': measure_export(client, query_string={'stream': 1}),
+        'ndjson': measure_export(client, headers={'Accept': 'application/x-ndjson'}),
+    }
+    if size <= FULL_LIST_MAX_SIZE:
+        results['regular'] = measure_export(client)
+    drop_benchmark_db(app)
+    return results
+
+
+def main(sizes):
+    print('{:>10}  {:<10}  {:>12}  {:>14}  {:>10}'.format('items', 'mode', 'bytes', 'peak mem (MB)', 'time (s)'))
+    for size in sizes:
+        for label, (response_size, peak, elapsed) in run(size).items():
+            print('{:>10}  {:<10}  {:>12}  {:>14.2f}  {:>10.2f}'.format(
+                size, label, response_size, peak / 1024 / 1024, elapsed))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
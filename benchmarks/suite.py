@@ -0,0 +1,225 @@
+# coding=utf-8
+"""
+Load benchmark of the whole TODO items API, with machine-readable results to catch performance regressions.
+
+Usage: python -m benchmarks.suite [--sizes 1000 10000] [--requests 200] [--concurrency 4] [--transports client server]
+                                  [--output results.json] [--baseline baseline.json] [--tolerance 0.25]
+
+Runs GET list (one page), GET item, POST, PUT and DELETE against lists of each size, both through the Flask test client
+and through a real (threaded) WSGI server, and reports throughput and p50/p99 latency of each one.
+
+It runs against the testing DB, so it works offline with a local SQLite stand-in:
+    TEST_DATABASE_URL=sqlite:////tmp/orca_bench.db python -m benchmarks.suite --output results.json
+
+With `--baseline`, results are compared against a previous `--output` file: any scenario whose p50 latency grows (or
+whose throughput drops) by more than `--tolerance` is reported, and the script exits with status 1.
+"""
+
+
+import argparse
+import http.client
+import json
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app.models import TODOItem, db
+from benchmarks import create_benchmark_app, drop_benchmark_db, get_default_todolist_id, seed_todoitems, summarize
+from config import TestingConfig
+
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_REQUESTS = 200
+DEFAULT_CONCURRENCY = 4
+DEFAULT_TOLERANCE = 0.25
+PAGE_SIZE = 100
+TRANSPORTS = ('client', 'server')
+
+
+class TestClientTransport(object):
+    """
+    Sends requests through the Flask test client (no network, no HTTP parsing). Requests run one at a time.
+    """
+    concurrency = 1
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass  # One line per request would skew the results
+
+
+class WSGIServerTransport(object):
+    """
+    Sends requests over HTTP to a threaded WSGI server running the app in the background, `concurrency` at a time.
+    """
+
+    def __init__(self, app, concurrency):
+        self.concurrency = concurrency
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietRequestHandler)
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            headers = {'Content-Type': 'application/json'} if body is not None else {}
+            connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            return response.status
+        finally:
+            connection.close()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def run_scenario(transport, requests):
+    """
+    Sends the given `(method, path, body, expected status)` requests through the given transport, and returns their
+    latency stats (in ms) plus the throughput (in requests per second).
+    """
+    def send(request_args):
+        method, path, body, expected_status = request_args
+        start = time.perf_counter()
+        status = transport.request(method, path, body)
+        elapsed = time.perf_counter() - start
+        assert status == expected_status, '{} {} returned {}'.format(method, path, status)
+        return elapsed
+
+    start = time.perf_counter()
+    if transport.concurrency > 1:
+        with ThreadPoolExecutor(max_workers=transport.concurrency) as executor:
+            timings = list(executor.map(send, requests))
+    else:
+        timings = [send(x) for x in requests]
+    return dict(summarize(timings), requests=len(timings), throughput_rps=len(timings) / (time.perf_counter() - start))
+
+
+def run(size, transport_name, amount, concurrency):
+    app = create_benchmark_app()
+    with app.app_context():
+        todolist_id = get_default_todolist_id()
+        seed_todoitems(todolist_id, size)
+        seeded_ids = [x for x, in db.session.query(TODOItem.id).filter(TODOItem.todolist_id == todolist_id)]
+        db.session.remove()
+    if transport_name == 'server':
+        transport = WSGIServerTransport(app, concurrency)
+    else:
+        transport = TestClientTransport(app)
+
+    # Every scenario works on its own random items, so concurrent requests don't all hit the same rows
+    random.seed(size)
+    read_ids = random.sample(seeded_ids, min(amount, len(seeded_ids)))
+    put_ids = random.sample(seeded_ids, min(amount, len(seeded_ids)))
+    results = {}
+    try:
+        results['GET list'] = run_scenario(
+            transport, [('GET', '/api/todoitems?limit={}'.format(PAGE_SIZE), None, 200)] * amount)
+        results['GET item'] = run_scenario(
+            transport, [('GET', '/api/todoitems/{}'.format(x), None, 200) for x in read_ids])
+        results['POST'] = run_scenario(
+            transport, [('POST', '/api/todoitems', {'name': 'Load test #{}'.format(x)}, 201) for x in range(amount)])
+        results['PUT'] = run_scenario(
+            transport, [('PUT', '/api/todoitems/{}'.format(x), {'completed': idx % 2 == 0}, 200)
+                        for idx, x in enumerate(put_ids)])
+        with app.app_context():
+            # Deleting the items created by the POST scenario, so the size of the list stays the same
+            new_ids = [x for x, in db.session.query(TODOItem.id).filter(TODOItem.id.notin_(seeded_ids))]
+            db.session.remove()
+        results['DELETE'] = run_scenario(
+            transport, [('DELETE', '/api/todoitems/{}'.format(x), None, 204) for x in new_ids])
+    finally:
+        transport.close()
+        drop_benchmark_db(app)
+    return results
+
+
+def get_metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'db': TestingConfig.SQLALCHEMY_DATABASE_URI.split(':', 1)[0],
+    }
+
+
+def find_regressions(results, baseline, tolerance):
+    """
+    Returns a message for each scenario of `results` that is slower than the same one in `baseline`, beyond the given
+    tolerance (e.g. 0.25 means 25% slower).
+    """
+    regressions = []
+    for key, stats in sorted(results.items()):
+        baseline_stats = baseline.get(key)
+        if baseline_stats is None:
+            continue
+        if stats['p50_ms'] > baseline_stats['p50_ms'] * (1 + tolerance):
+            regressions.append('{}: p50 went from {:.2f}ms to {:.2f}ms'.format(
+                key, baseline_stats['p50_ms'], stats['p50_ms']))
+        if stats['throughput_rps'] < baseline_stats['throughput_rps'] / (1 + tolerance):
+            regressions.append('{}: throughput went from {:.1f} to {:.1f} requests/s'.format(
+                key, baseline_stats['throughput_rps'], stats['throughput_rps']))
+    return regressions
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Load benchmark of the TODO items API')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Items seeded in the list')
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='Requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='Concurrent server clients')
+    parser.add_argument('--transports', nargs='+', choices=TRANSPORTS, default=list(TRANSPORTS))
+    parser.add_argument('--output', help='Where to write the JSON results')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='Allowed slowdown (0.25 = 25%%)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    row = '{:<40}  {throughput_rps:>10.1f}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}'
+    print('{:<40}  {:>10}  {:>10}  {:>10}  {:>10}'.format('scenario', 'req/s', 'mean (ms)', 'p50 (ms)', 'p99 (ms)'))
+    for size in args.sizes:
+        for transport_name in args.transports:
+            for scenario, stats in run(size, transport_name, args.requests, args.concurrency).items():
+                key = '{} {} items ({})'.format(scenario, size, transport_name)
+                results[key] = stats
+                print(row.format(key, **stats))
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'metadata': get_metadata(), 'results': results}, output_file, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print('REGRESSION {}'.format(regression))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,128 @@
+# coding=utf-8
+"""
+Benchmark of per-list reads with many TODO lists, against the same amount of items in a single master list.
+
+Usage: python -m benchmarks.todolists [--lists 1000] [--items 10000] [--partitioning hash:16]
+
+Runs the same reads (first page, page in the middle of the list, open items only and a single item) against:
+    - one master list holding `lists * items` items, which is how every item was stored before lists were exposed
+    - `lists` TODO lists of `items` items each, where each request reads a random list
+    - the same lists, with `todoitems` partitioned by TODO list through the 6c1f9e3b7a52 migration (Postgres only)
+
+Defaults match the target deployment (10M items), which takes a while to seed: try `--lists 20 --items 5000` first.
+"""
+
+
+import argparse
+import random
+import sys
+
+from flask_migrate import Migrate, stamp, upgrade
+
+from app.models import TODOItem, TODOList, db
+from app.queries import encode_cursor
+from benchmarks import (
+    create_benchmark_app, drop_benchmark_db, get_default_todolist_id, measure, seed_todoitems, summarize)
+
+DEFAULT_LISTS = 1000
+DEFAULT_ITEMS = 10000
+DEFAULT_PARTITIONING = 'hash:16'
+PAGE_SIZE = 100
+REPEAT = 200
+PRE_PARTITIONING_REVISION = '9d2c4e7a1f08'
+
+
+def create_todolists(amount):
+    """
+    Creates `amount` TODO lists and returns their IDs. Must run inside an app context.
+    """
+    table = TODOList.__table__
+    db.session.execute(table.insert().values([{'name': 'Benchmark TODO list #{}'.format(x)} for x in range(amount)]))
+    db.session.commit()
+    default_todolist_id = get_default_todolist_id()
+    return [x for x, in db.session.query(TODOList.id).filter(TODOList.id != default_todolist_id).order_by(TODOList.id)]
+
+
+def partition_todoitems(app, partitioning):
+    """
+    Partitions the (still empty) TODO items table of the benchmark DB with the same migration deployments run.
+    """
+    Migrate(app, db)
+    with app.app_context():
+        stamp(revision=PRE_PARTITIONING_REVISION)
+        upgrade(x_arg=['partitioning={}'.format(partitioning)])
+        db.session.execute('DROP TABLE alembic_version')
+        db.session.commit()
+
+
+def run(todolists_amount, items_per_list, partitioning=None):
+    """
+    Seeds the benchmark DB with the given amount of TODO lists (or a single master list if there's no amount) and
+    measures the reads of a random list on each request.
+    """
+    app = create_benchmark_app()
+    if partitioning:
+        partition_todoitems(app, partitioning)
+    client = app.test_client()
+    with app.app_context():
+        if todolists_amount:
+            todolist_ids = create_todolists(todolists_amount)
+            for todolist_id in todolist_ids:
+                seed_todoitems(todolist_id, items_per_list)
+        else:
+            todolist_ids = [get_default_todolist_id()]
+            seed_todoitems(todolist_ids[0], items_per_list)
+        # One cursor and one item ID per list, taken from the middle of it
+        middle_todoitems = {x: TODOItem._get_sorted_query(x).offset(items_per_list // 2).first() for x in todolist_ids}
+        middle_cursors = {k: encode_cursor(v) for k, v in middle_todoitems.items()}
+        middle_ids = {k: v.id for k, v in middle_todoitems.items()}
+        db.session.remove()
+
+    rng = random.Random(todolists_amount)
+
+    def get(url, **query_string):
+        todolist_id = rng.choice(todolist_ids)
+        response = client.get(url.format(todolist_id=todolist_id, todoitem_id=middle_ids[todolist_id]),
+                              query_string={k: v(todolist_id) if callable(v) else v for k, v in query_string.items()})
+        assert response.status_code == 200, response.status_code
+
+    items_url = '/api/todolists/{todolist_id}/items'
+    try:
+        return {
+            'first page': summarize(measure(lambda: get(items_url, limit=PAGE_SIZE), REPEAT)),
+            'middle page': summarize(measure(
+                lambda: get(items_url, limit=PAGE_SIZE, after=middle_cursors.get), REPEAT)),
+            'open items': summarize(measure(lambda: get(items_url, limit=PAGE_SIZE, completed='false'), REPEAT)),
+            'single item': summarize(measure(lambda: get(items_url + '/{todoitem_id}'), REPEAT)),
+        }
+    finally:
+        drop_benchmark_db(app)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Benchmark of per-list reads with many TODO lists')
+    parser.add_argument('--lists', type=int, default=DEFAULT_LISTS, help='TODO lists to seed')
+    parser.add_argument('--items', type=int, default=DEFAULT_ITEMS, help='Items seeded in each TODO list')
+    parser.add_argument('--partitioning', default=DEFAULT_PARTITIONING, help='e.g. "hash:16" or "list"')
+    args = parser.parse_args(argv)
+
+    layouts = {
+        'master list ({} items)'.format(args.lists * args.items): (None, args.lists * args.items, None),
+        '{} lists of {} items'.format(args.lists, args.items): (args.lists, args.items, None),
+    }
+    app = create_benchmark_app()
+    with app.app_context():
+        if db.engine.dialect.name == 'postgresql':
+            layouts['{} lists, {} partitioning'.format(args.lists, args.partitioning)] = (
+                args.lists, args.items, args.partitioning)
+    drop_benchmark_db(app)
+
+    print('{:<40}  {:<12}  {:>10}  {:>10}  {:>10}'.format('layout', 'request', 'mean (ms)', 'p50 (ms)', 'p99 (ms)'))
+    row = '{:<40}  {:<12}  {mean_ms:>10.2f}  {p50_ms:>10.2f}  {p99_ms:>10.2f}'
+    for label, (todolists_amount, items_per_list, partitioning) in layouts.items():
+        for request_label, stats in run(todolists_amount, items_per_list, partitioning).items():
+            print(row.format(label, request_label, **stats))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
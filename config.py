@@ -2,12 +2,20 @@
 
 
 import os
+import tempfile
 from enum import Enum
 
 from flask_cors import CORS
-from sqlalchemy.exc import ProgrammingError
+from sqlalchemy import create_engine
 
+from app.instrumentation import InstrumentedQueuePool
 from app.models import TODOList
+from app.replicas import configure_replicas, get_replica_set
+
+try:
+    from werkzeug.middleware.proxy_fix import ProxyFix
+except ImportError:  # Werkzeug < 0.15
+    from werkzeug.contrib.fixers import ProxyFix
 
 
 class Env(Enum):
@@ -30,8 +38,86 @@ class BaseConfig(object):
     SQLALCHEMY_DATABASE_URI = 'postgresql://localhost/orca'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     CORS_ORIGINS = ['http://localhost:3000']
+    # DB connection pool of each worker (see `configure_db`): every worker may open up to size + overflow connections
+    DB_POOL_SIZE = 5
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30  # Seconds to wait for a connection before giving up
+    DB_POOL_RECYCLE = -1  # Seconds after which connections are replaced, -1 to keep them forever
+    DB_POOL_PRE_PING = False
+    # Read replicas of the DB, for the reads of read-only API requests (see `app.replicas`). Each one gets its own pool
+    DB_REPLICA_URIS = []
+    DB_REPLICA_HEALTH_CHECK_INTERVAL = 5  # Seconds between health checks of each replica
+    DB_REPLICA_MAX_LAG = 10  # Seconds a replica may fall behind before it's skipped (Postgres only), None for no limit
+    DB_REPLICA_READ_YOUR_WRITES = 5  # Seconds clients read from the primary after they write anything
+    # Seconds to wait for a replica to answer a new connection (Postgres only, at least 2), since the health checks of
+    # unreachable ones run within requests
+    DB_REPLICA_CONNECT_TIMEOUT = 2
 
     DEFAULT_TODO_LIST_NAME = '__master__'
+    TODOLIST_CACHE_TTL = 300
+    TODOITEMS_PAGE_SIZE = 100
+    TODOITEMS_MAX_PAGE_SIZE = 1000
+    TODOITEMS_STREAM_BATCH_SIZE = 1000
+    TODOITEMS_MAX_BATCH_SIZE = 50000
+    # Seconds during which retries of a POST with the same `Idempotency-Key` header get its first response back
+    IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+    # Days after their last change that completed items are moved to the archive (see `python manage.py
+    # archive_todoitems`), where they're only read with `?include_archived=1`
+    ARCHIVE_AFTER_DAYS = 30
+    # Serializes GET responses with `app.serializers.RowSerializer` instead of flask_restful's marshalling
+    FAST_SERIALIZER = True
+
+    # Encodes JSON response bodies: a function that returns str or bytes (or its import path). Use
+    # 'app.encoding.dumps_orjson' for a faster one (needs orjson)
+    JSON_ENCODER = 'app.encoding.dumps_compact'
+    # Content encodings JSON responses are compressed with, preferred ones first ("br" needs brotli). Empty disables it
+    COMPRESSION_ENCODINGS = ('br', 'gzip')
+    COMPRESSION_MIN_BYTES = 1024  # Smaller bodies aren't worth the CPU
+    COMPRESSION_GZIP_LEVEL = 6  # 1 (fastest) to 9 (smallest)
+    COMPRESSION_BROTLI_QUALITY = 4  # 0 (fastest) to 11 (smallest)
+
+    # Response cache for GET /api/todoitems: a `app.cache.CacheBackend` subclass (or its import path), None disables it
+    RESPONSE_CACHE_BACKEND = None
+    RESPONSE_CACHE_OPTIONS = {'max_entries': 10000, 'max_bytes': 64 * 1024 * 1024, 'ttl': 30}
+
+    # Change feed of TODO items (GET /api/todoitems/events): a `app.events.EventTransport` subclass (or its import path)
+    # that carries events between workers, None disables it
+    EVENTS_TRANSPORT = 'app.events.LocalTransport'
+    EVENTS_TRANSPORT_OPTIONS = {}
+    EVENTS_MAX_QUEUED = 100  # Messages queued per subscriber, before it has to catch up from the DB instead
+    EVENTS_HEARTBEAT = 15  # Seconds between keep-alive comments on idle event streams
+    EVENTS_STREAM_DURATION = 300  # Seconds before event streams are closed, so clients reconnect (and resume)
+    EVENTS_POLL_TIMEOUT = 25  # Seconds long-polling requests wait for changes
+    # Clients each worker of the sync app keeps waiting for events (each one holds a thread), before answering the rest
+    # with HTTP 503. Keep it below `GUNICORN_THREADS` (see `gunicorn.conf.py`), so other requests always get a thread
+    EVENTS_MAX_SUBSCRIBERS = int(os.getenv('EVENTS_MAX_SUBSCRIBERS', 8))
+    # Same for each worker of the async app (see `asgi.py`), where waiting clients only hold a bit of memory
+    ASYNC_EVENTS_MAX_SUBSCRIBERS = int(os.getenv('ASYNC_EVENTS_MAX_SUBSCRIBERS', 10000))
+
+    # Per-client token buckets of API requests: requests per second and burst of each budget, where GET and HEAD
+    # requests spend the "read" one and the rest spend the "write" one. None disables them
+    RATE_LIMITS = {'read': (50, 200), 'write': (10, 50)}
+    # A `app.limits.RateLimitBackend` subclass (or its import path) that stores the buckets
+    RATE_LIMIT_BACKEND = 'app.limits.LocalRateLimitBackend'
+    RATE_LIMIT_BACKEND_OPTIONS = {}
+    RATE_LIMIT_CLIENT_HEADER = None  # Header that identifies clients (e.g. "X-Client-ID"), their IP address otherwise
+    # Proxies in front of the app that append the address of their client to `X-Forwarded-For`. Clients can send
+    # anything in it, so their IP address is only taken from it when there are any (see `configure_app`)
+    PROXY_FIX_X_FOR = 0
+    # API requests of each budget that every worker runs at once, before shedding the rest. None disables it
+    MAX_IN_FLIGHT = {'read': 10, 'write': 5}
+    SHED_RETRY_AFTER = 1  # Seconds clients are told to wait after a request is shed
+
+    # Internal endpoints (GET /internal/*, see `app.internal`), and the bearer token they require (None for no token)
+    INTERNAL_API_ENABLED = True
+    INTERNAL_API_TOKEN = os.getenv('INTERNAL_API_TOKEN')
+
+    # Per-request instrumentation: `Server-Timing` headers and GET /internal/metrics (see `app.instrumentation`)
+    INSTRUMENTATION_ENABLED = os.getenv('INSTRUMENTATION_ENABLED') == '1'
+    # Share of instrumented requests run under cProfile (0 to disable it). Profiles of the slow ones are dumped to a dir
+    PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_SLOW_REQUEST_MS = 500
+    PROFILE_DIR = os.path.join(tempfile.gettempdir(), 'orca-profiles')
 
 
 class DevelopmentConfig(BaseConfig):
@@ -46,7 +132,10 @@ class TestingConfig(BaseConfig):
     Testing-only configurations.
     """
     ENV = Env.TESTING
-    SQLALCHEMY_DATABASE_URI = 'postgresql://localhost/orca_test'
+    # e.g. "sqlite:////tmp/orca_test.db" to run benchmarks without Postgres
+    SQLALCHEMY_DATABASE_URI = os.getenv('TEST_DATABASE_URL', 'postgresql://localhost/orca_test')
+    # Tests and benchmarks send requests as fast as they can, all from the same client
+    RATE_LIMITS = None
 
 
 class ProductionConfig(BaseConfig):
@@ -57,13 +146,27 @@ class ProductionConfig(BaseConfig):
     DEBUG = False
     TESTING = False
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
+    # Small pools with a short timeout, so scaling workers doesn't exhaust the connection limit of the DB
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 2))
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    DB_REPLICA_URIS = [x for x in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if x]
+    # Reads and writes at once can't take more connections than the pool has
+    MAX_IN_FLIGHT = {'read': 5, 'write': 2}
+    # Events reach the subscribers of every worker
+    EVENTS_TRANSPORT = os.getenv('EVENTS_TRANSPORT', 'app.events.PostgresTransport')
     CORS_ORIGINS = BaseConfig.CORS_ORIGINS + ['https://todo-jcpmmx-reactcli.herokuapp.com']
+    PROXY_FIX_X_FOR = int(os.getenv('PROXY_FIX_X_FOR', 1))  # Heroku's router
+    # Internal endpoints show pool, replica and client data, so they're off unless enabled (with a token) on purpose
+    INTERNAL_API_ENABLED = os.getenv('INTERNAL_API_ENABLED') == '1' and bool(os.getenv('INTERNAL_API_TOKEN'))
 
 
-def configure_app(app, target_env):
+def get_config(target_env):
     """
-    Sets all configurations in the given Flask app using a valid target environment (given either as a str or as a valid
-    Env value).
+    Returns the config class of a valid target environment (given either as a str or as a valid Env value), or the
+    development one if it's not valid.
     """
     _CONFIG_ENV_MAPPING = {
         Env.DEVELOPMENT: DevelopmentConfig,
@@ -75,31 +178,79 @@ def configure_app(app, target_env):
             target_env = Env(target_env)
         except ValueError:
             target_env = Env.DEVELOPMENT
+    return _CONFIG_ENV_MAPPING.get(target_env, DevelopmentConfig)
 
-    config_obj = _CONFIG_ENV_MAPPING[target_env]
-    app.config.from_object(config_obj)
-    CORS(app, resources=r'/api/*', origins=app.config['CORS_ORIGINS'])
+
+def configure_app(app, target_env):
+    """
+    Sets all configurations in the given Flask app using a valid target environment (given either as a str or as a valid
+    Env value).
+    """
+    app.config.from_object(get_config(target_env))
+    # With credentials, so frontends of other origins keep the `last_write` cookie of read replicas
+    CORS(app, resources=r'/api/*', origins=app.config['CORS_ORIGINS'], supports_credentials=True)
+    if app.config['PROXY_FIX_X_FOR']:
+        # So `request.remote_addr` is the address the closest trusted proxy saw (passed positionally, since the
+        # argument was renamed from `num_proxies` to `x_for`)
+        app.wsgi_app = ProxyFix(app.wsgi_app, app.config['PROXY_FIX_X_FOR'])
 
 
 def configure_db(app, db):
     """
-    Links together the given Flask app and the SQLAlchemy instance.
-    It also loads some initial data.
+    Links together the given Flask app and the SQLAlchemy instance, and its read replicas (if any).
+    No DB connection is opened until the first query, so creating the app (e.g. when a worker boots) doesn't hit the DB.
     """
+    engine_options = get_engine_options(app.config)
+    engine_options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
     db.init_app(app)
-    with app.app_context():
-        load_initial_db_data(app, db)
+    if app.config['DB_REPLICA_URIS']:
+        configure_replicas(app, [create_engine(x, **get_replica_engine_options(app.config, x, engine_options))
+                                 for x in app.config['DB_REPLICA_URIS']])
+
+
+def dispose_db_connections(app, db):
+    """
+    Drops the pooled DB connections of the given app, so a forked process (e.g. a worker of a preloaded gunicorn app)
+    opens its own ones instead of sharing the sockets of its parent.
+    """
+    db.get_engine(app).dispose()
+    replica_set = get_replica_set(app)
+    if replica_set is not None:
+        replica_set.dispose()
+
+
+def get_engine_options(config):
+    """
+    Returns the SQLAlchemy engine options for the `DB_POOL_*` configurations of the given app config.
+    """
+    if (config['SQLALCHEMY_DATABASE_URI'] or 'sqlite').startswith('sqlite'):
+        return {}  # SQLite doesn't use a queue pool
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+
+
+def get_replica_engine_options(config, uri, engine_options):
+    """
+    Returns the SQLAlchemy engine options for the read replica of the given URI: the given ones of the primary DB, with
+    the `DB_REPLICA_CONNECT_TIMEOUT` configuration of the given app config on Postgres.
+    """
+    if not uri.startswith('postgresql'):
+        return engine_options
+    connect_args = dict(engine_options.get('connect_args', {}), connect_timeout=config['DB_REPLICA_CONNECT_TIMEOUT'])
+    return dict(engine_options, connect_args=connect_args)
 
 
 def load_initial_db_data(app, db):
     """
-    Loads all required initial data to the given DB.
+    Loads all required initial data to the given DB (see `python manage.py seed_db`). The DB must be migrated already.
     """
-    # Checking if we have the default TODO list
-    try:
-        default_todolist_data = {'name': app.config['DEFAULT_TODO_LIST_NAME']}
-        if not TODOList.query.filter_by(**default_todolist_data).first():
-            default_todolist = TODOList(**default_todolist_data)
-            default_todolist.save()
-    except ProgrammingError:
-        pass  # DB is empty, no tables yet
\ No newline at end of file
+    with app.app_context():
+        # Creating the default TODO list, unless we already have it
+        TODOList.get_default_todolist()
\ No newline at end of file
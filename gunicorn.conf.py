@@ -0,0 +1,28 @@
+# coding=utf-8
+"""
+Gunicorn settings, e.g. `gunicorn -c gunicorn.conf.py run:app` (see the Procfile).
+
+The app is preloaded by the master process, so workers are forked with everything already imported and booting one only
+takes a fork. Creating the app doesn't open DB connections, and any connection the master opened anyway is dropped by
+each worker right after the fork, so no DB socket is ever shared between processes. Set `GUNICORN_PRELOAD=0` to load
+the app in every worker instead (e.g. to pick up code changes on a graceful reload).
+"""
+
+
+import os
+
+preload_app = os.getenv('GUNICORN_PRELOAD', '1') == '1'
+# Threads let workers keep event streams open (see `GET /api/todoitems/events`) while they serve other requests. Idle
+# streams hold no DB connection, so there can be more threads than pooled connections, but each one holds a thread:
+# keep `EVENTS_MAX_SUBSCRIBERS` below `threads`, or serve the change feed from the async app instead (see `asgi.py`)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+
+def post_fork(server, worker):
+    if not preload_app:
+        return  # The app doesn't exist yet: each worker creates it (and its DB engine) after the fork
+    from app.models import db
+    from config import dispose_db_connections
+    from run import app
+    dispose_db_connections(app, db)
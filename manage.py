@@ -2,11 +2,15 @@
 
 
 import os
+import sys
+from datetime import timedelta
 
-from flask_script import Manager
+from flask_script import Command, Manager
 from flask_migrate import Migrate, MigrateCommand
 
 from app import create_app, db, models
+from app.events import publish_todoitem_events
+from config import load_initial_db_data
 
 app = create_app(os.getenv('FLASK_ENV'))
 
@@ -14,5 +18,70 @@ migrate = Migrate(app, db)
 manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
+
+class SeedDB(Command):
+    """
+    Loads the initial data (i.e. the default TODO list) into an already migrated DB
+    """
+
+    def run(self):
+        load_initial_db_data(app, db)
+
+
+manager.add_command('seed_db', SeedDB())
+
+
+@manager.option('-l', '--todolist-id', dest='todolist_id', type=int, help='ID of a TODO list (all by default)')
+def repair_counts(todolist_id=None):
+    """
+    Recounts the items of TODO lists, and fixes the counts that drifted
+    """
+    todolist_ids = [todolist_id] if todolist_id else [x.id for x in models.TODOList.get_all()]
+    for todolist_id in todolist_ids:
+        wrong_counts = models.TODOList.repair_counts(todolist_id)
+        if wrong_counts:
+            print('Fixed the counts of TODO list {} (they were {} items, {} completed)'.format(
+                todolist_id, *wrong_counts))
+
+
+@manager.option('todolist_id', type=int, help='ID of the TODO list')
+def partition_todolist(todolist_id):
+    """
+    Moves the items of a TODO list into a partition of their own (only when todoitems is partitioned by list)
+    """
+    try:
+        models.TODOItem.create_partition(todolist_id)
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000, help='Keys deleted per transaction')
+@manager.option('-m', '--max-batches', dest='max_batches', type=int, help='Batches to run at most (all by default)')
+def purge_idempotency_keys(batch_size=1000, max_batches=None):
+    """
+    Deletes expired idempotency keys, in batches
+    """
+    print('Deleted {} expired idempotency keys'.format(
+        models.IdempotencyKey.purge_expired(batch_size=batch_size, max_batches=max_batches)))
+
+
+@manager.option('-d', '--days', dest='days', type=float, help='Days after which completed items are archived')
+@manager.option('-b', '--batch-size', dest='batch_size', type=int, default=1000, help='Items moved per transaction')
+@manager.option('-m', '--max-batches', dest='max_batches', type=int, help='Batches to run at most (all by default)')
+def archive_todoitems(days=None, batch_size=1000, max_batches=None):
+    """
+    Moves old completed items to the archive, in batches (an interrupted run resumes where it left off)
+    """
+    older_than = timedelta(days=app.config['ARCHIVE_AFTER_DAYS'] if days is None else days)
+
+    def on_batch(todolist_id, version, todoitem_ids):
+        # Clients following the change feed drop them, just like clients that sync
+        publish_todoitem_events(todolist_id, version, [{'type': 'deleted', 'id': x} for x in todoitem_ids])
+        print('Archived {} items of TODO list {}'.format(len(todoitem_ids), todolist_id))
+
+    print('Archived {} completed items'.format(models.TODOItem.archive_completed(
+        older_than, batch_size=batch_size, max_batches=max_batches, on_batch=on_batch)))
+
+
 if __name__ == '__main__':
     manager.run()
@@ -0,0 +1,27 @@
+"""Add full-text search index on todoitems names
+
+Revision ID: 3b9e6f2c8d15
+Revises: e2b8f4a61c93
+Create Date: 2026-10-17 22:31:40.527310
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e6f2c8d15'
+down_revision = 'e2b8f4a61c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Expression index (not a model column), so it's only created on Postgres. See `TODOItem.get_search_criteria`
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute(
+            "CREATE INDEX ix_todoitems_name_search ON todoitems USING gin (to_tsvector('simple', coalesce(name, '')))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_todoitems_name_search', table_name='todoitems')
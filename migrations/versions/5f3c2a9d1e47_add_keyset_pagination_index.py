@@ -0,0 +1,25 @@
+"""Add composite index for keyset pagination of TODO items
+
+Revision ID: 5f3c2a9d1e47
+Revises: 24bb27f77567
+Create Date: 2026-10-17 09:12:41.203118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f3c2a9d1e47'
+down_revision = '24bb27f77567'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_todoitems_todolist_id_created_id', 'todoitems',
+                    ['todolist_id', sa.text('created DESC'), sa.text('id DESC')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_todoitems_todolist_id_created_id', table_name='todoitems')
@@ -0,0 +1,80 @@
+"""Add optional partitioning of todoitems by TODO list
+
+Revision ID: 6c1f9e3b7a52
+Revises: 9d2c4e7a1f08
+Create Date: 2026-10-17 23:48:26.905114
+
+Nothing changes unless asked for with an `-x` argument (Postgres only), e.g.:
+    python manage.py db upgrade -x partitioning=hash:16  # 16 partitions, by hash of the TODO list ID
+    python manage.py db upgrade -x partitioning=list     # One partition per existing TODO list, plus a default one
+
+Either way, every query filtered by TODO list only reads its partition. The table is rebuilt (and its rows copied), so
+plan for downtime on large tables. To partition a DB that's already past this revision, downgrade to the previous one
+and upgrade again with the argument. The downgrade turns a partitioned table back into a plain one.
+
+"""
+from alembic import context, op
+
+
+# revision identifiers, used by Alembic.
+revision = '6c1f9e3b7a52'
+down_revision = '9d2c4e7a1f08'
+branch_labels = None
+depends_on = None
+
+DEFAULT_HASH_PARTITIONS = 16
+
+
+def upgrade():
+    partitioning = context.get_x_argument(as_dictionary=True).get('partitioning')
+    if not partitioning:
+        return
+    if op.get_bind().dialect.name != 'postgresql':
+        raise RuntimeError('Partitioning todoitems is only supported on Postgres')
+    method, _, modulus = partitioning.partition(':')
+    if method == 'hash':
+        modulus = int(modulus or DEFAULT_HASH_PARTITIONS)
+        partitions = {'todoitems_p{}'.format(x): 'FOR VALUES WITH (MODULUS {}, REMAINDER {})'.format(modulus, x)
+                      for x in range(modulus)}
+    elif method == 'list':
+        todolist_ids = [x for x, in op.get_bind().execute('SELECT id FROM todolists ORDER BY id')]
+        partitions = {'todoitems_l{}'.format(x): 'FOR VALUES IN ({})'.format(x) for x in todolist_ids}
+        partitions['todoitems_default'] = 'DEFAULT'
+    else:
+        raise ValueError('Unknown partitioning "{}" (use "hash:<partitions>" or "list")'.format(partitioning))
+
+    # The partition key must be part of the primary key
+    _rebuild_todoitems('PARTITION BY {} (todolist_id)'.format(method.upper()), 'id, todolist_id', partitions)
+
+
+def downgrade():
+    is_partitioned = op.get_bind().dialect.name == 'postgresql' and op.get_bind().execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'todoitems'::regclass").scalar()
+    if is_partitioned:
+        _rebuild_todoitems('', 'id', {})
+
+
+def _rebuild_todoitems(partition_clause, primary_key, partitions):
+    """
+    Replaces the todoitems table with a new one (partitioned or not), keeping its rows, ID sequence, foreign key and
+    indexes.
+    """
+    # Definitions of partitioned indexes read "ON ONLY todoitems", which wouldn't create them on the partitions
+    index_definitions = [x.replace(' ON ONLY ', ' ON ') for x, in op.get_bind().execute(
+        "SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema() AND tablename = 'todoitems' "
+        "AND indexname <> 'todoitems_pkey'")]
+    op.execute('CREATE TABLE todoitems_new (LIKE todoitems INCLUDING DEFAULTS) {}'.format(partition_clause))
+    for partition_name, bounds in partitions.items():
+        op.execute('CREATE TABLE {} PARTITION OF todoitems_new {}'.format(partition_name, bounds))
+    op.execute('INSERT INTO todoitems_new SELECT * FROM todoitems')
+    # The sequence would be dropped along with the old table otherwise
+    op.execute('ALTER SEQUENCE todoitems_id_seq OWNED BY NONE')
+    op.execute('DROP TABLE todoitems')
+    op.execute('ALTER TABLE todoitems_new RENAME TO todoitems')
+    op.execute('ALTER SEQUENCE todoitems_id_seq OWNED BY todoitems.id')
+    op.execute('ALTER TABLE todoitems ADD CONSTRAINT todoitems_pkey PRIMARY KEY ({})'.format(primary_key))
+    op.execute('ALTER TABLE todoitems ADD CONSTRAINT todoitems_todolist_id_fkey '
+               'FOREIGN KEY (todolist_id) REFERENCES todolists (id)')
+    # Indexes of a partitioned table are created on each one of its partitions too
+    for index_definition in index_definitions:
+        op.execute(index_definition)
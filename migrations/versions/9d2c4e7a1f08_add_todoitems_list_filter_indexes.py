@@ -0,0 +1,40 @@
+"""Add indexes for filtered and sorted lists of TODO items
+
+Revision ID: 9d2c4e7a1f08
+Revises: 3b9e6f2c8d15
+Create Date: 2026-10-17 23:05:12.418903
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d2c4e7a1f08'
+down_revision = '3b9e6f2c8d15'
+branch_labels = None
+depends_on = None
+
+PARTIAL_INDEXES = {
+    'ix_todoitems_open_todolist_id_created_id': ('created', 'completed IS false'),
+    'ix_todoitems_open_todolist_id_modified_id': ('modified', 'completed IS false'),
+    'ix_todoitems_completed_todolist_id_created_id': ('created', 'completed IS true'),
+    'ix_todoitems_completed_todolist_id_modified_id': ('modified', 'completed IS true'),
+}
+
+
+def upgrade():
+    # Items without a `completed` value would be left out of both partial indexes (and of both filters)
+    op.execute('UPDATE todoitems SET completed = false WHERE completed IS NULL')
+    op.create_index('ix_todoitems_todolist_id_modified_id', 'todoitems',
+                    ['todolist_id', sa.text('modified DESC'), sa.text('id DESC')], unique=False)
+    for index_name, (sort_column, where) in PARTIAL_INDEXES.items():
+        op.create_index(index_name, 'todoitems', ['todolist_id', sa.text('{} DESC'.format(sort_column)),
+                                                  sa.text('id DESC')],
+                        unique=False, postgresql_where=sa.text(where), sqlite_where=sa.text(where))
+
+
+def downgrade():
+    for index_name in PARTIAL_INDEXES:
+        op.drop_index(index_name, table_name='todoitems')
+    op.drop_index('ix_todoitems_todolist_id_modified_id', table_name='todoitems')
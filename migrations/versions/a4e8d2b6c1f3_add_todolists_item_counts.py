@@ -0,0 +1,32 @@
+"""Add item counts to TODO lists
+
+Revision ID: a4e8d2b6c1f3
+Revises: 6c1f9e3b7a52
+Create Date: 2026-10-18 00:21:07.613254
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8d2b6c1f3'
+down_revision = '6c1f9e3b7a52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('todolists', sa.Column('item_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('todolists', sa.Column('completed_count', sa.Integer(), server_default='0', nullable=False))
+    # From now on, every write keeps them up to date (see `TODOList.bump_version`)
+    op.execute(
+        'UPDATE todolists SET '
+        'item_count = (SELECT count(*) FROM todoitems WHERE todoitems.todolist_id = todolists.id), '
+        'completed_count = (SELECT count(*) FROM todoitems '
+        'WHERE todoitems.todolist_id = todolists.id AND todoitems.completed IS true)')
+
+
+def downgrade():
+    op.drop_column('todolists', 'completed_count')
+    op.drop_column('todolists', 'item_count')
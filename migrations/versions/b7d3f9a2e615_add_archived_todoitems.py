@@ -0,0 +1,57 @@
+"""Add archived todoitems
+
+Revision ID: b7d3f9a2e615
+Revises: f5d83a1c9e27
+Create Date: 2026-10-18 02:15:37.408261
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d3f9a2e615'
+down_revision = 'f5d83a1c9e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_todoitems',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=True),
+    sa.Column('todolist_id', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Boolean(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=True),
+    sa.Column('modified', sa.DateTime(), nullable=True),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('archived', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['todolist_id'], ['todolists.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # Same list queries as todoitems (see `TODOItem.get_list_criteria`). Archived items are all completed, so there's no
+    # need for the partial indexes
+    op.create_index('ix_archived_todoitems_todolist_id_created_id', 'archived_todoitems',
+                    ['todolist_id', sa.text('created DESC'), sa.text('id DESC')], unique=False)
+    op.create_index('ix_archived_todoitems_todolist_id_modified_id', 'archived_todoitems',
+                    ['todolist_id', sa.text('modified DESC'), sa.text('id DESC')], unique=False)
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE INDEX ix_archived_todoitems_name_search ON archived_todoitems "
+                   "USING gin (to_tsvector('simple', coalesce(name, '')))")
+    # Progress of `python manage.py archive_todoitems`, so interrupted runs resume
+    op.create_table('archive_checkpoints',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('cutoff', sa.DateTime(), nullable=False),
+    sa.Column('todolist_id', sa.Integer(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('archive_checkpoints')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_archived_todoitems_name_search', table_name='archived_todoitems')
+    op.drop_index('ix_archived_todoitems_todolist_id_modified_id', table_name='archived_todoitems')
+    op.drop_index('ix_archived_todoitems_todolist_id_created_id', table_name='archived_todoitems')
+    op.drop_table('archived_todoitems')
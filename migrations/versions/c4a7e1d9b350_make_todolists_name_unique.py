@@ -0,0 +1,28 @@
+"""Make TODO list names unique
+
+Revision ID: c4a7e1d9b350
+Revises: b7d3f9a2e615
+Create Date: 2026-10-18 09:12:44.160372
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a7e1d9b350'
+down_revision = 'b7d3f9a2e615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Lists created with the same name by concurrent requests keep their items, under their ID-suffixed name
+    op.execute("UPDATE todolists SET name = name || ' (' || id || ')' "
+               "WHERE id NOT IN (SELECT min(id) FROM todolists GROUP BY name)")
+    op.drop_index('ix_todolists_name', table_name='todolists')
+    op.create_index(op.f('ix_todolists_name'), 'todolists', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_todolists_name'), table_name='todolists')
+    op.create_index('ix_todolists_name', 'todolists', ['name'], unique=False)
@@ -0,0 +1,41 @@
+"""Add item versions and tombstones for delta sync
+
+Revision ID: e2b8f4a61c93
+Revises: c7e59b13a0d4
+Create Date: 2026-10-17 11:27:03.918255
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b8f4a61c93'
+down_revision = 'c7e59b13a0d4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('todoitem_tombstones',
+    sa.Column('todoitem_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('todolist_id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('deleted', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['todolist_id'], ['todolists.id'], ),
+    sa.PrimaryKeyConstraint('todoitem_id')
+    )
+    op.create_index('ix_todoitem_tombstones_todolist_id_version', 'todoitem_tombstones', ['todolist_id', 'version'],
+                    unique=False)
+    op.add_column('todoitems', sa.Column('version', sa.BigInteger(), server_default='0', nullable=False))
+    # Stamping existing items with a new version of their TODO list, so a sync from scratch (version 0) includes them
+    op.execute('UPDATE todolists SET version = version + 1')
+    op.execute('UPDATE todoitems SET version = (SELECT version FROM todolists WHERE todolists.id = todolist_id)')
+    op.create_index('ix_todoitems_todolist_id_version', 'todoitems', ['todolist_id', 'version'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_todoitems_todolist_id_version', table_name='todoitems')
+    op.drop_column('todoitems', 'version')
+    op.drop_index('ix_todoitem_tombstones_todolist_id_version', table_name='todoitem_tombstones')
+    op.drop_table('todoitem_tombstones')
@@ -0,0 +1,52 @@
+"""Stop reusing todoitem IDs on SQLite
+
+Revision ID: e81b5c3f7d26
+Revises: c4a7e1d9b350
+Create Date: 2026-10-19 10:04:52.618307
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e81b5c3f7d26'
+down_revision = 'c4a7e1d9b350'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Postgres sequences never hand out an ID twice, but SQLite reuses the highest one once it's deleted, which then
+    # clashes with its tombstone (or its archived copy)
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _rebuild_todoitems(autoincrement=True)
+    # IDs of items deleted or archived before this migration aren't handed out again either
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'todoitems'")
+    op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'todoitems', coalesce(max(id), 0) FROM ("
+               "SELECT max(id) AS id FROM todoitems UNION ALL SELECT max(todoitem_id) FROM todoitem_tombstones "
+               "UNION ALL SELECT max(id) FROM archived_todoitems)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    _rebuild_todoitems(autoincrement=False)
+
+
+def _rebuild_todoitems(autoincrement):
+    # SQLite can only change that by copying the table. Indexes are recreated as they were, since reflecting them
+    # loses their sort orders and WHERE clauses
+    indexes = _get_indexes()
+    with op.batch_alter_table('todoitems', recreate='always', table_kwargs={'sqlite_autoincrement': autoincrement}):
+        pass
+    for index_name, _ in _get_indexes():
+        op.execute('DROP INDEX "{}"'.format(index_name))
+    for _, index_sql in indexes:
+        op.execute(index_sql)
+
+
+def _get_indexes():
+    return op.get_bind().execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'todoitems' AND sql IS NOT NULL",
+    ).fetchall()
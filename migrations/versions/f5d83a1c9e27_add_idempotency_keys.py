@@ -0,0 +1,37 @@
+"""Add idempotency keys
+
+Revision ID: f5d83a1c9e27
+Revises: a4e8d2b6c1f3
+Create Date: 2026-10-18 00:42:02.894126
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5d83a1c9e27'
+down_revision = 'a4e8d2b6c1f3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('idempotency_keys',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('key', sa.String(length=255), nullable=False),
+    sa.Column('path', sa.String(length=255), nullable=False),
+    sa.Column('request_hash', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.Integer(), nullable=True),
+    sa.Column('response', sa.Text(), nullable=True),
+    sa.Column('expires', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('key', 'path', name='uq_idempotency_keys_key_path')
+    )
+    # Expired keys are purged in batches (see `python manage.py purge_idempotency_keys`)
+    op.create_index('ix_idempotency_keys_expires', 'idempotency_keys', ['expires'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_keys_expires', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
@@ -4,11 +4,46 @@
 import json
 import os
 import random
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import zlib
+from datetime import datetime, timedelta
+from http.client import HTTPConnection
+from unittest import mock
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import Pool
 
 from app import create_app
-from app.models import db
-from config import Env, load_initial_db_data
+from app.cache import LRUCache
+from app.encoding import brotli
+from app.events import EventBroker, PostgresTransport
+from app.instrumentation import InstrumentedQueuePool, QueryCounter
+from app.limits import LocalRateLimitBackend, get_concurrency_limiters
+from app.models import ArchiveCheckpoint, IdempotencyKey, TODOItem, TODOList, db
+from app.replicas import get_replica_set
+from config import Env, TestingConfig, dispose_db_connections, load_initial_db_data
+
+try:
+    from starlette.testclient import TestClient as ASGITestClient
+
+    from app.async_api import create_async_app
+except ImportError:  # The async serving mode is optional (see requirements-async.txt)
+    create_async_app = None
+
+try:
+    from gunicorn.workers import gthread
+except ImportError:  # gunicorn only runs on Unix (and older versions of it don't run on newer Pythons)
+    gthread = None
 
 
 class TODOItemsEndpointTestCase(unittest.TestCase):
@@ -78,6 +113,1113 @@ class TODOItemsEndpointTestCase(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.get_json()['id'], last_id)
 
+    def test_pagination(self):
+        # Creating some TODO items first
+        todoitems_amount = 5
+        for idx in range(1, todoitems_amount+1):
+            request_data = {'name': 'Page through TODO item #{}'.format(idx)}
+            response = self.client.post(self.todoitems_endpoint, json=request_data)
+            self.assertEqual(response.status_code, 201)
+        all_ids = [x['id'] for x in self.client.get(self.todoitems_endpoint).get_json()]
+
+        # Walking through all pages using the cursor returned by each one of them
+        paged_ids = []
+        response = self.client.get(self.todoitems_endpoint, query_string={'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.get_json()), 2)
+            paged_ids.extend(x['id'] for x in response.get_json())
+            next_cursor = response.headers.get('X-Next-Cursor')
+            if not next_cursor:
+                break
+            response = self.client.get(self.todoitems_endpoint, query_string={'limit': 2, 'after': next_cursor})
+        self.assertEqual(paged_ids, all_ids)
+
+        # Testing bad pagination params
+        response = self.client.get(self.todoitems_endpoint, query_string={'limit': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(self.todoitems_endpoint, query_string={'after': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('after', response.get_json()['message'])
+
+    def test_streaming(self):
+        # Creating some TODO items first
+        for idx in range(1, 4):
+            request_data = {'name': 'Stream TODO item #{}'.format(idx)}
+            response = self.client.post(self.todoitems_endpoint, json=request_data)
+            self.assertEqual(response.status_code, 201)
+        all_todoitems = self.client.get(self.todoitems_endpoint).get_json()
+
+        # Streaming them as a single JSON array
+        response = self.client.get(self.todoitems_endpoint, query_string={'stream': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        self.assertEqual(json.loads(response.get_data(as_text=True)), all_todoitems)
+        # Streaming them as newline-delimited JSON
+        response = self.client.get(self.todoitems_endpoint, headers={'Accept': 'application/x-ndjson'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual([json.loads(x) for x in lines], all_todoitems)
+
+    def test_batch(self):
+        batch_endpoint = '/api/todoitems/batch'
+        # Creating some TODO items first
+        existing_ids = []
+        for idx in range(1, 4):
+            request_data = {'name': 'Batch TODO item #{}'.format(idx)}
+            existing_ids.append(self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id'])
+
+        # Testing happy path, mixed with some bad items
+        request_data = {
+            'create': [{'name': 'Import me!'}, {'name': 'XX'}, {'name': 'Import me too!', 'completed': True}],
+            'update': [{'id': existing_ids[0], 'completed': True}, {'id': 999999, 'name': 'Not there'}],
+            'delete': [existing_ids[1], existing_ids[1], 999998],
+        }
+        response = self.client.post(batch_endpoint, json=request_data)
+        response_json = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([x['status'] for x in response_json['create']], [201, 400, 201])
+        self.assertEqual(response_json['create'][0]['item']['name'], 'Import me!')
+        self.assertFalse(response_json['create'][0]['item']['completed'])
+        self.assertTrue(response_json['create'][2]['item']['completed'])
+        self.assertIn('at least 3 chars', response_json['create'][1]['message']['name'])
+        self.assertEqual([x['status'] for x in response_json['update']], [200, 404])
+        self.assertTrue(response_json['update'][0]['item']['completed'])
+        self.assertEqual([x['status'] for x in response_json['delete']], [204, 400, 404])
+
+        # Testing that all valid changes were applied
+        todoitems = {x['id']: x for x in self.client.get(self.todoitems_endpoint).get_json()}
+        self.assertEqual(len(todoitems), 4)
+        self.assertTrue(todoitems[existing_ids[0]]['completed'])
+        self.assertNotIn(existing_ids[1], todoitems)
+        self.assertIn(response_json['create'][2]['item']['id'], todoitems)
+
+        # Testing malformed batches
+        self.assertEqual(self.client.post(batch_endpoint).status_code, 400)
+        self.assertEqual(self.client.post(batch_endpoint, json={'create': 'Not a list'}).status_code, 400)
+        self.assertEqual(self.client.get(batch_endpoint).status_code, 405)
+
+    def test_search(self):
+        for name in ('Buy tomatoes', 'Plant tomatoes', 'Buy tomato_sauce', 'Call mom'):
+            self.client.post(self.todoitems_endpoint, json={'name': name, 'completed': name.startswith('Plant')})
+
+        def search(**query_string):
+            response = self.client.get(self.todoitems_endpoint, query_string=query_string)
+            self.assertEqual(response.status_code, 200)
+            return [x['name'] for x in response.get_json()]
+
+        # Every term matches the start of a word, whatever the case
+        self.assertEqual(set(search(q='TOM')), {'Buy tomatoes', 'Plant tomatoes', 'Buy tomato_sauce'})
+        self.assertEqual(set(search(q='buy tomato')), {'Buy tomatoes', 'Buy tomato_sauce'})
+        self.assertEqual(search(q='omato'), [])
+        self.assertEqual(len(search(q='tom', limit=2)), 2)
+        response = self.client.get(self.todoitems_endpoint, query_string={'q': '?!'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('q', response.get_json()['message'])
+        # Results are filtered like lists, but they're always sorted by relevance
+        self.assertEqual(search(q='tom', completed=1), ['Plant tomatoes'])
+        self.assertEqual(set(search(q='tom', completed=0)), {'Buy tomatoes', 'Buy tomato_sauce'})
+        self.assertEqual(search(q='tom', created_after='2999-01-01T00:00:00Z'), [])
+        self.assertEqual(len(search(q='tom', modified_before='2999-01-01T00:00:00Z')), 3)
+        for query_string in ({'q': 'tom', 'sort': 'created'}, {'q': 'tom', 'sort': '-created', 'completed': 1}):
+            response = self.client.get(self.todoitems_endpoint, query_string=query_string)
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(response.get_json()['message'], {'sort': 'Search results are sorted by relevance'})
+
+        # On Postgres, search terms are matched by the full-text index
+        with self.app.app_context():
+            if db.engine.dialect.name == 'postgresql':
+                criterion, order_by = TODOItem.get_search_criteria(['tom'], 'postgresql')
+                query = TODOItem.query.filter(criterion).order_by(*order_by)
+                db.session.execute('SET enable_seqscan = off')
+                plan = db.session.execute('EXPLAIN ' + str(query.statement.compile(
+                    dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))).fetchall()
+                self.assertIn('ix_todoitems_name_search', '\n'.join(x for x, in plan))
+                db.session.rollback()
+
+    def test_filters_and_sort(self):
+        todoitem_ids = [self.client.post(self.todoitems_endpoint, json={'name': 'Item #{}'.format(x)}).get_json()['id']
+                        for x in range(4)]
+        # Modifying them in a different order than they were created
+        for todoitem_id in (todoitem_ids[2], todoitem_ids[0]):
+            todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id)
+            self.client.put(todoitem_url, json={'completed': True})
+
+        def get_ids(**query_string):
+            response = self.client.get(self.todoitems_endpoint, query_string=query_string)
+            self.assertEqual(response.status_code, 200, response.get_json())
+            return [x['id'] for x in response.get_json()], response.headers.get('X-Next-Cursor')
+
+        self.assertEqual(get_ids(completed='true')[0], [todoitem_ids[2], todoitem_ids[0]])
+        self.assertEqual(get_ids(completed='false')[0], [todoitem_ids[3], todoitem_ids[1]])
+        self.assertEqual(get_ids(sort='created')[0], todoitem_ids)
+        self.assertEqual(get_ids(sort='-modified')[0][:2], [todoitem_ids[0], todoitem_ids[2]])
+        self.assertEqual(get_ids(sort='modified', completed='true')[0], [todoitem_ids[2], todoitem_ids[0]])
+
+        # Ranges of the sort column
+        response = self.client.get(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[1]))
+        created = response.get_json()['created']
+        self.assertEqual(get_ids(created_after=created)[0], todoitem_ids[:1:-1])
+        self.assertEqual(get_ids(sort='created', created_before=created)[0], todoitem_ids[:1])
+
+        # Pages of a sorted list, whose cursors only work with that same sort
+        ids, cursor = get_ids(sort='-modified', limit=3)
+        next_ids, next_cursor = get_ids(sort='-modified', limit=3, after=cursor)
+        self.assertEqual(ids + next_ids, get_ids(sort='-modified')[0])
+        self.assertIsNone(next_cursor)
+        response = self.client.get(self.todoitems_endpoint, query_string={'limit': 3, 'after': cursor})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('after', response.get_json()['message'])
+
+        # Filters and sorts without an index behind them are rejected
+        for query_string in ({'sort': 'name'}, {'sort': 'created', 'modified_after': created},
+                             {'created_after': 'yesterday'}):
+            response = self.client.get(self.todoitems_endpoint, query_string=query_string)
+            self.assertEqual(response.status_code, 400, query_string)
+
+        # On Postgres, every supported query is answered by its index
+        with self.app.app_context():
+            if db.engine.dialect.name == 'postgresql':
+                todolist_id = TODOList.get_default_todolist().id
+                # The table is tiny, so the planner has to be told to avoid what would only pay off here
+                for setting in ('enable_seqscan', 'enable_bitmapscan', 'enable_sort'):
+                    db.session.execute('SET {} = off'.format(setting))
+                for (completed, sort_column_name), index_name in TODOItem.LIST_INDEXES.items():
+                    for sort in (sort_column_name, '-' + sort_column_name):
+                        criteria, order_by = TODOItem.get_list_criteria(todolist_id, sort=sort, completed=completed)
+                        query = TODOItem.query.filter(*criteria).order_by(*order_by).limit(10)
+                        plan = '\n'.join(x for x, in db.session.execute('EXPLAIN ' + str(query.statement.compile(
+                            dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))))
+                        self.assertIn('Index Scan', plan)
+                        self.assertIn(index_name, plan)
+                        self.assertNotIn('Sort', plan)
+                db.session.rollback()
+
+    def test_todolists(self):
+        todolists_endpoint = '/api/todolists'
+        todolist_items_endpoint = '/api/todolists/{todolist_id}/items'
+        # Creating a couple of TODO lists, with an item each
+        todolist_ids = []
+        for name in ('Groceries', 'Chores'):
+            response = self.client.post(todolists_endpoint, json={'name': name})
+            self.assertEqual(response.status_code, 201)
+            todolist_ids.append(response.get_json()['id'])
+            response = self.client.post(todolist_items_endpoint.format(todolist_id=todolist_ids[-1]),
+                                        json={'name': '{} item'.format(name)})
+            self.assertEqual(response.status_code, 201)
+        response = self.client.post(self.todoitems_endpoint, json={'name': 'Default item'})
+        default_todolist_item_id = response.get_json()['id']
+        self.assertEqual([x['name'] for x in self.client.get(todolists_endpoint).get_json()],
+                         [self.app.config['DEFAULT_TODO_LIST_NAME'], 'Groceries', 'Chores'])
+
+        # Every TODO list only holds its own items
+        for todolist_id, name in zip(todolist_ids, ('Groceries item', 'Chores item')):
+            response = self.client.get(todolist_items_endpoint.format(todolist_id=todolist_id))
+            self.assertEqual([x['name'] for x in response.get_json()], [name])
+        self.assertEqual([x['name'] for x in self.client.get(self.todoitems_endpoint).get_json()], ['Default item'])
+        todoitem_url = todolist_items_endpoint.format(todolist_id=todolist_ids[0]) + '/{}'.format(
+            default_todolist_item_id)
+        self.assertEqual(self.client.put(todoitem_url, json={'completed': True}).status_code, 404)
+        self.assertEqual(self.client.delete(todoitem_url).status_code, 404)
+        self.assertEqual(self.client.get(todolist_items_endpoint.format(todolist_id=999999)).status_code, 404)
+
+        # Renaming and deleting TODO lists (but not the default one)
+        todolist_url = '{}/{}'.format(todolists_endpoint, todolist_ids[0])
+        self.assertEqual(self.client.put(todolist_url, json={'name': 'Chores'}).status_code, 400)
+        self.assertEqual(self.client.put(todolist_url, json={'name': 'Food'}).get_json()['name'], 'Food')
+        self.assertEqual(self.client.delete(todolist_url).status_code, 204)
+        self.assertEqual(self.client.get(todolist_url).status_code, 404)
+        self.assertEqual(self.client.get(todolist_items_endpoint.format(todolist_id=todolist_ids[0])).status_code, 404)
+        with self.app.app_context():
+            default_todolist_id = TODOList.get_default_todolist().id
+            self.assertEqual(TODOItem.query.filter_by(todolist_id=todolist_ids[0]).count(), 0)
+        default_todolist_url = '{}/{}'.format(todolists_endpoint, default_todolist_id)
+        self.assertEqual(self.client.delete(default_todolist_url).status_code, 400)
+
+        # Names are unique even when requests race (i.e. when they miss each other's lists)
+        with mock.patch.object(TODOList, 'get_by_name', return_value=None):
+            self.assertEqual(self.client.post(todolists_endpoint, json={'name': 'Chores'}).status_code, 400)
+            with self.app.app_context():
+                self.assertEqual(TODOList.get_default_todolist().id, default_todolist_id)
+        self.assertEqual(len(self.client.get(todolists_endpoint).get_json()), 2)
+
+    def test_todolist_changed_elsewhere(self):
+        todolist_ids = [
+            self.client.post('/api/todolists', json={'name': x}).get_json()['id'] for x in ('Doomed', 'Old')]
+        todolist_items_endpoint = '/api/todolists/{}/items'.format(todolist_ids[0])
+        todolist_url = '/api/todolists/{}'.format(todolist_ids[1])
+        self.assertEqual(self.client.get(todolist_items_endpoint).status_code, 200)  # Now they're cached
+        self.assertEqual(self.client.get(todolist_url).get_json()['name'], 'Old')
+        # Another worker deletes one and renames the other, and this one's cache doesn't know
+        table = TODOList.__table__
+        with self.app.app_context():
+            db.session.execute(table.delete().where(table.c.id == todolist_ids[0]))
+            db.session.execute(table.update().values(name='New').where(table.c.id == todolist_ids[1]))
+            db.session.commit()
+        self.assertEqual(self.client.post(todolist_items_endpoint, json={'name': 'Lost item'}).status_code, 404)
+        self.assertEqual(self.client.get(todolist_items_endpoint).status_code, 404)
+        self.assertEqual(self.client.get(todolist_items_endpoint + '/stats').status_code, 404)
+        self.assertEqual(self.client.get(todolist_url).get_json()['name'], 'New')
+
+    def test_stats(self):
+        stats_endpoint = '/api/todoitems/stats'
+        self.assertEqual(self.client.get(stats_endpoint).get_json(), {'total': 0, 'completed': 0, 'open': 0})
+        todoitem_ids = []
+        for idx in range(4):
+            request_data = {'name': 'Count me #{}'.format(idx), 'completed': idx == 0}
+            todoitem_ids.append(self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id'])
+        self.client.put(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[1]), json={'completed': True})
+        self.client.put(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[1]), json={'completed': True})
+        self.client.put(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[0]), json={'name': 'Renamed'})
+        self.client.delete(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[2]))
+        self.client.post('/api/todoitems/batch', json={
+            'create': [{'name': 'Batch count', 'completed': True}],
+            'update': [{'id': todoitem_ids[0], 'completed': False}, {'id': todoitem_ids[3], 'completed': True}],
+            'delete': [todoitem_ids[1], 999999],
+        })
+        response = self.client.get(stats_endpoint)
+        self.assertEqual(response.get_json(), {'total': 3, 'completed': 2, 'open': 1})
+        response = self.client.get(stats_endpoint, headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(response.status_code, 304)
+        # Every TODO list has its own counts
+        todolist_id = self.client.post('/api/todolists', json={'name': 'Empty list'}).get_json()['id']
+        response = self.client.get('/api/todolists/{}/items/stats'.format(todolist_id))
+        self.assertEqual(response.get_json(), {'total': 0, 'completed': 0, 'open': 0})
+
+        with self.app.app_context():
+            default_todolist_id = TODOList.get_default_todolist().id
+            # Counts are already right, but they can be repaired if they ever drift
+            self.assertIsNone(TODOList.repair_counts(default_todolist_id))
+            db.session.execute(TODOList.__table__.update().values(item_count=42))
+            db.session.commit()
+            self.assertEqual(TODOList.repair_counts(default_todolist_id), (42, 2))
+            self.assertIsNone(TODOList.repair_counts(default_todolist_id))
+
+            # Concurrent writers don't make them drift either
+            if db.engine.dialect.name == 'postgresql':
+                def toggle(thread_idx):
+                    client = self.app.test_client()
+                    rng = random.Random(thread_idx)
+                    for _ in range(10):
+                        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=rng.choice(todoitem_ids[3:]))
+                        client.put(todoitem_url, json={'completed': rng.random() < 0.5})
+                        client.post(self.todoitems_endpoint, json={'name': 'Concurrent item', 'completed': True})
+
+                threads = [threading.Thread(target=toggle, args=(x,)) for x in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertIsNone(TODOList.repair_counts(default_todolist_id))
+
+    def test_idempotency_keys(self):
+        stats_endpoint = '/api/todoitems/stats'
+        request_data = {'name': 'Retry me!'}
+        headers = {'Idempotency-Key': 'abc'}
+        response = self.client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        # Retries get the same response back, without creating the item again
+        retry_response = self.client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+        self.assertEqual(retry_response.status_code, 201)
+        self.assertEqual(retry_response.get_json(), response.get_json())
+        self.assertEqual(retry_response.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 1)
+        # But keys can't be reused for different requests
+        response = self.client.post(self.todoitems_endpoint, json={'name': 'Not me'}, headers=headers)
+        self.assertEqual(response.status_code, 422)
+        # Keys are scoped by path, and work on batches too
+        batch_data = {'create': [{'name': 'Retry me too!'}], 'delete': [999999]}
+        response = self.client.post('/api/todoitems/batch', json=batch_data, headers=headers)
+        self.assertEqual(response.status_code, 200)
+        retry_response = self.client.post('/api/todoitems/batch', json=batch_data, headers=headers)
+        self.assertEqual(retry_response.get_json(), response.get_json())
+        self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 2)
+        # Requests without a key are never deduplicated
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.todoitems_endpoint, json=request_data).status_code, 201)
+        self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 4)
+
+        with self.app.app_context():
+            # Expired keys are ignored, and purged in batches
+            db.session.execute(IdempotencyKey.__table__.update().values(expires=datetime(2000, 1, 1)))
+            db.session.commit()
+            self.assertEqual(IdempotencyKey.purge_expired(batch_size=1, max_batches=1), 1)
+            self.assertEqual(IdempotencyKey.purge_expired(batch_size=1), 1)
+            self.assertEqual(IdempotencyKey.query.count(), 0)
+        response = self.client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 5)
+
+        # Failed writes can be retried, whether they fail before their commit (e.g. while publishing events) or after it
+        headers = {'Idempotency-Key': 'failed'}
+        with mock.patch('app.api.publish_todoitem_events', side_effect=RuntimeError('Event transport is down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+        self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 5)
+        with mock.patch('app.models.invalidate_todoitems', side_effect=RuntimeError('Cache is down')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+        response = self.client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response.headers)
+        self.assertEqual(self.client.post(self.todoitems_endpoint, json=request_data, headers=headers).get_json(),
+                         response.get_json())
+        self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 7)
+
+        # Concurrent retries create a single item
+        with self.app.app_context():
+            if db.engine.dialect.name == 'postgresql':
+                responses = []
+
+                def post():
+                    responses.append(self.app.test_client().post(
+                        self.todoitems_endpoint, json=request_data, headers={'Idempotency-Key': 'xyz'}))
+
+                threads = [threading.Thread(target=post) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(self.client.get(stats_endpoint).get_json()['total'], 8)
+                self.assertEqual(len({x.get_json()['id'] for x in responses if x.status_code == 201}), 1)
+                self.assertTrue(all(x.status_code in (201, 409) for x in responses))
+
+    def test_startup(self):
+        # Creating the app doesn't touch the DB
+        connections = []
+
+        def on_connect(*args):
+            connections.append(args)
+
+        event.listen(Pool, 'connect', on_connect)
+        try:
+            create_app(Env.TESTING)
+        finally:
+            event.remove(Pool, 'connect', on_connect)
+        self.assertEqual(connections, [])
+        # And the default TODO list is created on first use if the DB wasn't seeded
+        with self.app.app_context():
+            TODOList.get_default_todolist().delete()
+        self.assertEqual(self.client.get(self.todoitems_endpoint).status_code, 200)
+        with self.app.app_context():
+            self.assertEqual([x.name for x in TODOList.get_all()], [self.app.config['DEFAULT_TODO_LIST_NAME']])
+
+    def test_events(self):
+        events_endpoint = '/api/todoitems/events'
+        self.app.config.update(EVENTS_HEARTBEAT=0.1, EVENTS_STREAM_DURATION=1, EVENTS_POLL_TIMEOUT=0.1)
+
+        def parse_events(chunk):
+            events = []
+            for raw_event in chunk.decode().split('\n\n'):
+                fields = dict(x.split(': ', 1) for x in raw_event.splitlines() if not x.startswith(':'))
+                if fields:
+                    events.append((fields['event'], json.loads(fields['data']), fields.get('id')))
+            return events
+
+        # Writes are streamed as they commit
+        response = self.client.get(events_endpoint, headers={'Accept': 'text/event-stream'}, buffered=False)
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        chunks = response.iter_encoded()
+        self.assertEqual(parse_events(next(chunks)), [])
+        todoitem_id = self.client.post(self.todoitems_endpoint, json={'name': 'Stream me'}).get_json()['id']
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id)
+        self.client.put(todoitem_url, json={'completed': True})
+        self.client.put(todoitem_url, json={'completed': True})  # Nothing changes, so there's no event
+        self.client.post('/api/todoitems/batch', json={'create': [{'name': 'Stream us'}], 'delete': [todoitem_id]})
+        events = parse_events(next(chunks)) + parse_events(next(chunks)) + parse_events(next(chunks))
+        self.assertEqual([(x[0], x[1].get('name')) for x in events], [
+            ('created', 'Stream me'), ('updated', 'Stream me'), ('created', 'Stream us'), ('deleted', None)])
+        self.assertTrue(events[1][1]['completed'])
+        self.assertEqual(events[3][1], {'id': todoitem_id})
+        # Only the last event of each write has an ID, which is also a sync cursor
+        self.assertEqual([x[2] is not None for x in events], [True, True, False, True])
+        last_event_id = events[-1][2]
+        # Idle streams only get keep-alive comments, until they end
+        self.assertTrue(all(x.startswith(b':') for x in chunks))
+        response.close()
+
+        # Resuming clients catch up from the DB first
+        self.client.post(self.todoitems_endpoint, json={'name': 'Missed me'})
+        response = self.client.get(
+            events_endpoint, headers={'Accept': 'text/event-stream', 'Last-Event-ID': last_event_id}, buffered=False)
+        [(event_type, data, event_id)] = parse_events(next(response.iter_encoded()))
+        self.assertEqual(event_type, 'sync')
+        self.assertEqual([x['name'] for x in data['items']], ['Missed me'])
+        self.assertEqual(data['cursor'], event_id)
+        response.close()
+        # So do the ones that fall behind, without piling up events in memory
+        self.app.config['EVENTS_MAX_QUEUED'] = 1
+        self.app.extensions.pop('event_broker')
+        response = self.client.get(events_endpoint, headers={'Accept': 'text/event-stream'}, buffered=False)
+        chunks = response.iter_encoded()
+        next(chunks)
+        for idx in range(3):
+            self.client.post(self.todoitems_endpoint, json={'name': 'Overflow #{}'.format(idx)})
+        [(event_type, data, _)] = parse_events(next(chunks))
+        self.assertEqual(event_type, 'sync')
+        self.assertEqual([x['name'] for x in data['items']], ['Overflow #0', 'Overflow #1', 'Overflow #2'])
+        response.close()
+
+        # Long polling returns the changes after the cursor, as soon as there are any
+        cursor = self.client.get(events_endpoint).get_json()['cursor']  # Nothing changed before the timeout
+        timer = threading.Timer(0.05, lambda: self.app.test_client().post(
+            self.todoitems_endpoint, json={'name': 'Poll me'}))
+        timer.start()
+        self.app.config['EVENTS_POLL_TIMEOUT'] = 5
+        response_json = self.client.get(events_endpoint, query_string={'since': cursor}).get_json()
+        timer.join()
+        self.assertEqual([x['name'] for x in response_json['items']], ['Poll me'])
+        self.assertNotEqual(response_json['cursor'], cursor)
+        self.assertEqual(self.client.get(events_endpoint, query_string={'since': 'nope'}).status_code, 400)
+        self.assertEqual(self.client.get('/internal/events').get_json()['subscribers'], 0)
+
+        # Waiting clients hold a thread each, so past `EVENTS_MAX_SUBSCRIBERS` they're turned away
+        self.app.config['EVENTS_MAX_SUBSCRIBERS'] = 1
+        self.app.extensions.pop('event_broker')
+        response = self.client.get(events_endpoint, headers={'Accept': 'text/event-stream'}, buffered=False)
+        next(response.iter_encoded())
+        rejected_response = self.client.get(events_endpoint, query_string={'since': cursor})
+        self.assertEqual(rejected_response.status_code, 503)
+        self.assertEqual(rejected_response.headers['Retry-After'], '1')
+        response.close()
+        self.assertEqual(self.client.get(events_endpoint, query_string={'since': '0'}).status_code, 200)
+        stats = self.client.get('/internal/events').get_json()
+        self.assertEqual((stats['subscribers'], stats['max_subscribers'], stats['rejected']), (0, 1, 1))
+
+        # Events can also reach other workers through Postgres
+        with self.app.app_context():
+            if db.engine.dialect.name == 'postgresql':
+                broker = EventBroker(PostgresTransport(poll_interval=0.1))
+                subscription = broker.subscribe(42)
+                self.assertEqual(subscription.get(timeout=5)['events'], None)  # Told to catch up once listening
+                # Published within the transaction of the write, so only delivered if it commits
+                broker.publish(42, 6, [{'type': 'deleted', 'id': 2}])
+                db.session.rollback()
+                broker.publish(42, 7, [{'type': 'deleted', 'id': 1}])
+                self.assertIsNone(subscription.get(timeout=0.2))
+                db.session.commit()
+                self.assertEqual(subscription.get(timeout=5), {
+                    'todolist_id': 42, 'version': 7, 'events': [{'type': 'deleted', 'id': 1}]})
+                subscription.close()
+
+    @unittest.skipIf(gthread is None, 'gunicorn does not run here')
+    def test_threaded_worker(self):
+        # A real worker (see gunicorn.conf.py) with 2 threads, where event streams can only take one of them
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn.app.wsgiapp', '-c', 'gunicorn.conf.py', '-b', '127.0.0.1:{}'.format(port),
+             '--graceful-timeout', '1', 'run:app'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env=dict(os.environ, FLASK_ENV=Env.TESTING.value, GUNICORN_THREADS='2', EVENTS_MAX_SUBSCRIBERS='1'))
+        try:
+            deadline = time.monotonic() + 10
+            while True:
+                try:
+                    socket.create_connection(('127.0.0.1', port)).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise
+                    time.sleep(0.1)
+            stream = HTTPConnection('127.0.0.1', port, timeout=5)
+            stream.request('GET', '/api/todoitems/events', headers={'Accept': 'text/event-stream'})
+            self.assertEqual(stream.getresponse().status, 200)
+            # Other clients waiting for events are turned away, and every other request still gets served
+            connection = HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', '/api/todoitems/events')
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual((response.status, response.getheader('Retry-After')), (503, '1'))
+            connection.request('GET', self.todoitems_endpoint)
+            response = connection.getresponse()
+            response.read()
+            self.assertEqual(response.status, 200)
+            stream.close()
+            connection.close()
+        finally:
+            server.terminate()
+            server.wait(10)
+
+    def test_limits(self):
+        self.app.config['RATE_LIMITS'] = {'read': (1000, 3), 'write': (0.5, 2)}
+        self.app.config['RATE_LIMIT_CLIENT_HEADER'] = 'X-Client-ID'
+        request_data = {'name': 'Limit me!'}
+        for _ in range(2):
+            self.assertEqual(self.client.post(self.todoitems_endpoint, json=request_data).status_code, 201)
+        # Out of write budget, for a couple of seconds
+        response = self.client.post(self.todoitems_endpoint, json=request_data)
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        self.assertIn('message', response.get_json())
+        # Reads have their own budget, and so do other clients
+        self.assertEqual(self.client.get(self.todoitems_endpoint).status_code, 200)
+        response = self.client.post(self.todoitems_endpoint, json=request_data, headers={'X-Client-ID': 'other'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(self.client.get(self.todoitems_endpoint).get_json()), 3)
+        # Clients can't get a budget of their own by sending `X-Forwarded-For`, unless a trusted proxy appends to it
+        response = self.client.post(self.todoitems_endpoint, json=request_data, headers={'X-Forwarded-For': '10.0.0.1'})
+        self.assertEqual(response.status_code, 429)
+        with mock.patch.multiple(TestingConfig, RATE_LIMITS=self.app.config['RATE_LIMITS'], PROXY_FIX_X_FOR=1):
+            client = create_app(Env.TESTING).test_client()
+        for forwarded_for, status_code in (('10.0.0.1', 201), ('6.6.6.6, 10.0.0.1', 201), ('10.0.0.1', 429),
+                                           ('10.0.0.2', 201)):
+            headers = {'X-Forwarded-For': forwarded_for}
+            response = client.post(self.todoitems_endpoint, json=request_data, headers=headers)
+            self.assertEqual(response.status_code, status_code, forwarded_for)
+
+        # Past `max_keys`, buckets that are full again are forgotten first, then the ones closest to full
+        backend = LocalRateLimitBackend(max_keys=10)
+        self.assertEqual(backend.consume('fast', 100, 1), 0)
+        for idx in range(10):
+            self.assertEqual(backend.consume('slow #{}'.format(idx), 1 / (idx + 1), 1), 0)
+            time.sleep(0.02 if idx == 8 else 0)
+        self.assertEqual((backend.get_stats()['keys'], backend.get_stats()['prunes']), (9, 1))
+        self.assertEqual(backend.consume('slow #0', 1, 1), 0)  # Forgotten, so it's full
+        self.assertGreater(backend.consume('slow #1', 1 / 2, 1), 0)
+
+        # Shedding requests past the ones running at once
+        self.app.config['MAX_IN_FLIGHT'] = {'read': 1}
+        self.app.extensions.pop('concurrency_limiters')
+        self.app.config['RATE_LIMITS'] = None
+        self.app.extensions.pop('rate_limiter')
+        with self.app.app_context():
+            read_limiter = get_concurrency_limiters()['read']
+        self.assertEqual(self.client.get(self.todoitems_endpoint).status_code, 200)
+        self.assertTrue(read_limiter.acquire())  # Another request is running
+        response = self.client.get(self.todoitems_endpoint)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], '1')
+        self.assertEqual(self.client.post(self.todoitems_endpoint, json=request_data).status_code, 201)
+        self.assertEqual(self.client.get('/internal/limits').get_json()['in_flight'], {
+            'read': {'in_flight': 1, 'max_in_flight': 1, 'shed': 1}})
+        read_limiter.release()
+        self.assertEqual(self.client.get(self.todoitems_endpoint).status_code, 200)
+
+    def test_todolist_cache(self):
+        request_data = {'name': 'Count my queries!'}
+        todoitem_id = self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id']
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id)
+
+        # Once the default TODO list is cached, polling TODO items takes a single query
+        with self.app.app_context():
+            for url in (self.todoitems_endpoint, todoitem_url):
+                etag = self.client.get(url).headers['ETag']
+                with QueryCounter(db.engine) as query_counter:
+                    self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+                self.assertEqual(query_counter.count, 1, query_counter.statements)
+                # And reading them takes one more (besides the one that checks the version of the TODO list)
+                with QueryCounter(db.engine) as query_counter:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+                self.assertEqual(query_counter.count, 2, query_counter.statements)
+
+        # Saving a TODO list invalidates its cached copy
+        with self.app.app_context():
+            default_todolist = TODOList.get_default_todolist()
+            default_todolist.name = '__renamed__'
+            default_todolist.save()
+            self.assertIsNone(TODOList.get_by_name(self.app.config['DEFAULT_TODO_LIST_NAME']))
+            self.assertEqual(TODOList.get_by_name('__renamed__').id, default_todolist.id)
+
+    def test_conditional_get(self):
+        request_data = {'name': 'Poll me!'}
+        todoitem_id = self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id']
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id)
+
+        for idx, url in enumerate((self.todoitems_endpoint, todoitem_url)):
+            response = self.client.get(url)
+            etag = response.headers['ETag']
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(etag.startswith('"'))  # Strong ETag
+            # Nothing changed since the last response
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertFalse(response.get_data())
+            # Any change to the TODO list changes the ETag
+            self.client.put(todoitem_url, json={'completed': not idx})
+            response = self.client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_compression(self):
+        for idx in range(30):
+            self.client.post(self.todoitems_endpoint, json={'name': 'Compress TODO item #{}'.format(idx)})
+        response = self.client.get(self.todoitems_endpoint)
+        body, etag = response.get_data(), response.headers['ETag']
+        # Compact JSON, even in debug mode
+        self.assertTrue(self.app.debug)
+        self.assertNotIn(b', ', body)
+        self.assertNotIn(b'\n ', body)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+
+        # Only if the client accepts it
+        headers = {'Accept-Encoding': 'gzip, deflate'}
+        response = self.client.get(self.todoitems_endpoint, headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS), body)
+        self.assertLess(int(response.headers['Content-Length']), len(body))
+        gzip_etag = response.headers['ETag']
+        self.assertEqual(gzip_etag, etag[:-1] + '-gzip"')
+        # Either ETag is still valid, and 304s send back the one the client has
+        for if_none_match in (etag, gzip_etag):
+            response = self.client.get(
+                self.todoitems_endpoint, headers=dict(headers, **{'If-None-Match': if_none_match}))
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], if_none_match)
+        # Streamed responses are compressed chunk by chunk
+        response = self.client.get(self.todoitems_endpoint, query_string={'stream': 1}, headers=headers)
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(json.loads(zlib.decompress(response.get_data(), 16 + zlib.MAX_WBITS)), json.loads(body))
+        # Small bodies aren't worth it
+        response = self.client.get(self.todoitems_endpoint, query_string={'limit': 1}, headers=headers)
+        self.assertNotIn('Content-Encoding', response.headers)
+
+        # Brotli is preferred, when available
+        response = self.client.get(self.todoitems_endpoint, headers={'Accept-Encoding': 'gzip, br'})
+        self.assertEqual(response.headers['Content-Encoding'], 'br' if brotli else 'gzip')
+        if brotli:
+            self.assertEqual(brotli.decompress(response.get_data()), body)
+        # Swapping the JSON encoder
+        self.app.config['JSON_ENCODER'] = lambda data: json.dumps(data, sort_keys=True)
+        self.app.extensions.pop('json_encoder')
+        self.assertEqual(self.client.get(self.todoitems_endpoint).get_json(), json.loads(body))
+        self.assertIn(b'", "', self.client.get(self.todoitems_endpoint).get_data())
+
+    def test_delta_sync(self):
+        # Syncing from scratch
+        todoitem_ids = []
+        for idx in range(1, 4):
+            request_data = {'name': 'Sync TODO item #{}'.format(idx)}
+            todoitem_ids.append(self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id'])
+        response = self.client.get(self.todoitems_endpoint, query_string={'since': '0'})
+        response_json = response.get_json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(x['id'] for x in response_json['items']), todoitem_ids)
+        self.assertEqual(response_json['deleted'], [])
+        cursor = response_json['cursor']
+
+        # Nothing changed since then
+        response_json = self.client.get(self.todoitems_endpoint, query_string={'since': cursor}).get_json()
+        self.assertEqual((response_json['items'], response_json['deleted']), ([], []))
+        self.assertEqual(response_json['cursor'], cursor)
+
+        # Changing some TODO items, so only those are synced
+        self.client.put(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[0]), json={'completed': True})
+        self.client.delete(self.todoitems_detail_endpoint.format(todoitem_id=todoitem_ids[1]))
+        new_todoitem_id = self.client.post(self.todoitems_endpoint, json={'name': 'Sync me too!'}).get_json()['id']
+        self.client.post('/api/todoitems/batch', json={'delete': [todoitem_ids[2]]})
+        response_json = self.client.get(self.todoitems_endpoint, query_string={'since': cursor}).get_json()
+        self.assertEqual([x['id'] for x in response_json['items']], [todoitem_ids[0], new_todoitem_id])
+        self.assertTrue(response_json['items'][0]['completed'])
+        self.assertEqual(response_json['deleted'], todoitem_ids[1:])
+        self.assertNotEqual(response_json['cursor'], cursor)
+
+        # Testing bad cursors
+        response = self.client.get(self.todoitems_endpoint, query_string={'since': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_archive(self):
+        todoitem_ids = []
+        for idx in range(5):
+            request_data = {'name': 'Archive me #{}'.format(idx), 'completed': idx % 2 == 1}
+            todoitem_ids.append(self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id'])
+        todolist_id = self.client.post('/api/todolists', json={'name': 'Archived list'}).get_json()['id']
+        todolist_items_endpoint = '/api/todolists/{}/items'.format(todolist_id)
+        self.client.post(todolist_items_endpoint, json={'name': 'Archive me too', 'completed': True})
+        cursor = self.client.get(self.todoitems_endpoint, query_string={'since': '0'}).get_json()['cursor']
+
+        # A cutoff in the future archives every completed item. Interrupted runs resume from their checkpoint
+        batches = []
+        with self.app.app_context():
+            older_than = timedelta(days=-1)
+            self.assertEqual(TODOItem.archive_completed(older_than, batch_size=1, max_batches=1), 1)
+            self.assertIsNotNone(ArchiveCheckpoint.query.get('todoitems'))
+            archived = TODOItem.archive_completed(
+                older_than, batch_size=1, on_batch=lambda *args: batches.append((args[0], args[2])))
+            self.assertEqual(archived, 2)
+            self.assertIsNone(ArchiveCheckpoint.query.get('todoitems'))
+            self.assertEqual(TODOItem.archive_completed(older_than), 0)
+            default_todolist_id = TODOList.get_default_todolist().id
+            self.assertIsNone(TODOList.repair_counts(default_todolist_id))
+        self.assertEqual(batches, [(default_todolist_id, [todoitem_ids[3]]), (todolist_id, [todoitem_ids[-1] + 1])])
+
+        # Archived items are only read when asked for
+        open_ids, archived_ids = todoitem_ids[::2], todoitem_ids[1::2]
+
+        def get_ids(**query_string):
+            return [x['id'] for x in self.client.get(self.todoitems_endpoint, query_string=query_string).get_json()]
+
+        self.assertEqual(get_ids(), open_ids[::-1])
+        self.assertEqual(get_ids(include_archived=1), todoitem_ids[::-1])
+        self.assertEqual(get_ids(include_archived=1, completed=1, sort='created'), archived_ids)
+        self.assertEqual(get_ids(include_archived=1, completed=0), open_ids[::-1])
+        self.assertEqual(get_ids(include_archived=1, q='archive me'), todoitem_ids[::-1])
+        self.assertEqual(get_ids(include_archived=1, stream=1), todoitem_ids[::-1])
+        response = self.client.get(self.todoitems_endpoint, query_string={'include_archived': 1, 'limit': 3})
+        next_page = self.client.get(self.todoitems_endpoint, query_string={
+            'include_archived': 1, 'limit': 3, 'after': response.headers['X-Next-Cursor']})
+        self.assertEqual([x['id'] for x in response.get_json() + next_page.get_json()], todoitem_ids[::-1])
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=archived_ids[0])
+        self.assertNotEqual(self.client.get(todoitem_url).get_json()['id'], archived_ids[0])
+        response = self.client.get(todoitem_url, query_string={'include_archived': 1})
+        self.assertEqual((response.get_json()['id'], response.get_json()['completed']), (archived_ids[0], True))
+        self.assertEqual(self.client.put(todoitem_url, json={'name': 'Archived'}).status_code, 404)
+        self.assertEqual(self.client.get(self.todoitems_endpoint, query_string={'include_archived': 'x'}).status_code,
+                         400)
+
+        # To clients, archiving is deleting: it shows up in their next sync, and in the counts
+        response_json = self.client.get(self.todoitems_endpoint, query_string={'since': cursor}).get_json()
+        self.assertEqual((response_json['items'], response_json['deleted']), ([], archived_ids))
+        stats_endpoint = '/api/todoitems/stats'
+        self.assertEqual(self.client.get(stats_endpoint).get_json(), {'total': 3, 'completed': 0, 'open': 3})
+        response = self.client.get(stats_endpoint, query_string={'include_archived': 1})
+        self.assertEqual(response.get_json(), {'total': 5, 'completed': 2, 'open': 3})
+        self.assertEqual(self.client.delete('/api/todolists/{}'.format(todolist_id)).status_code, 204)
+
+    def test_create_partition(self):
+        # Only TODO lists that exist get a partition
+        with self.app.app_context():
+            with self.assertRaisesRegex(ValueError, 'The TODO list 999999 does not exist'):
+                TODOItem.create_partition(999999)
+            if TODOItem.get_partitioning() != 'list':
+                with self.assertRaisesRegex(ValueError, 'not partitioned by list'):
+                    TODOItem.create_partition(TODOList.get_default_todolist().id)
+
+    def test_response_cache(self):
+        self.app.config['RESPONSE_CACHE_BACKEND'] = LRUCache
+        todoitem_id = self.client.post(self.todoitems_endpoint, json={'name': 'Cache me!'}).get_json()['id']
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id)
+
+        # Cache hits skip the DB entirely, and return the very same response
+        with self.app.app_context():
+            for url in (self.todoitems_endpoint, todoitem_url):
+                response = self.client.get(url)
+                with QueryCounter(db.engine) as query_counter:
+                    cached_response = self.client.get(url)
+                    conditional_response = self.client.get(url, headers={'If-None-Match': response.headers['ETag']})
+                self.assertEqual(conditional_response.status_code, 304)
+                self.assertEqual(query_counter.count, 0, query_counter.statements)
+                self.assertEqual(cached_response.get_data(), response.get_data())
+                self.assertEqual(cached_response.headers['ETag'], response.headers['ETag'])
+                self.assertEqual(cached_response.mimetype, 'application/json')
+
+        # Writes invalidate all affected responses
+        self.client.put(todoitem_url, json={'completed': True})
+        self.assertTrue(self.client.get(self.todoitems_endpoint).get_json()[0]['completed'])
+        self.assertTrue(self.client.get(todoitem_url).get_json()['completed'])
+        self.client.post('/api/todoitems/batch', json={'delete': [todoitem_id]})
+        self.assertEqual(self.client.get(self.todoitems_endpoint).get_json(), [])
+        self.assertFalse(self.client.get(todoitem_url).get_json()['id'])
+
+        stats = self.client.get('/internal/cache').get_json()
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['misses'], 6)
+
+    def test_lru_cache(self):
+        lru_cache = LRUCache(max_entries=2, max_bytes=10, ttl=60)
+        lru_cache.set('a', b'1')
+        lru_cache.set('b', b'2')
+        lru_cache.get('a')
+        lru_cache.set('c', b'3')  # Evicts "b", the least recently used one
+        self.assertIsNone(lru_cache.get('b'))
+        self.assertEqual((lru_cache.get('a'), lru_cache.get('c')), (b'1', b'3'))
+        lru_cache.set('d', b'1234567890')  # Evicts everything else, since it's too big
+        self.assertEqual(lru_cache.get_stats()['entries'], 1)
+        self.assertEqual(lru_cache.get_stats()['evictions'], 3)
+        lru_cache.set('e', b'4', ttl=-1)  # Expired right away
+        self.assertIsNone(lru_cache.get('e'))
+        self.assertEqual(lru_cache.get_stats()['expirations'], 1)
+
+    def test_fast_serializer(self):
+        for idx in range(1, 4):
+            request_data = {'name': 'Serialize TODO item #{}'.format(idx), 'completed': idx % 2 == 0}
+            todoitem_id = self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id']
+
+        # Both serializers produce the very same bytes
+        requests = [
+            (self.todoitems_endpoint, {}),
+            (self.todoitems_endpoint, {'limit': 2}),
+            (self.todoitems_endpoint, {'since': '0'}),
+            (self.todoitems_endpoint, {'stream': 1}),
+            (self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id), {}),
+            (self.todoitems_detail_endpoint.format(todoitem_id=999999), {}),
+        ]
+        for url, query_string in requests:
+            responses = []
+            for fast_serializer in (True, False):
+                self.app.config['FAST_SERIALIZER'] = fast_serializer
+                response = self.client.get(url, query_string=query_string)
+                responses.append((response.get_data(), response.headers.get('X-Next-Cursor')))
+            self.assertEqual(responses[0], responses[1], (url, query_string))
+
+    def test_column_reads(self):
+        for idx in range(1, 3):
+            self.client.post(self.todoitems_endpoint, json={'name': 'Read TODO item #{}'.format(idx)})
+
+        with self.app.app_context():
+            todolist_id = TODOList.get_default_todolist().id
+            columns = (TODOItem.id, TODOItem.name, TODOItem.completed)
+            db.session.expunge_all()
+            # Column-only reads return named tuples, and nothing ends up in the session
+            rows = TODOItem.get_all(todolist_id, columns=columns)
+            self.assertEqual([x.name for x in rows], ['Read TODO item #2', 'Read TODO item #1'])
+            self.assertEqual(rows[0]._fields, ('id', 'name', 'completed'))
+            self.assertEqual(TODOItem.get_by_id(rows[1].id, columns=columns), rows[1])
+            self.assertEqual(list(TODOItem.iter_all(todolist_id, batch_size=1, columns=columns)), rows)
+            self.assertEqual(len(db.session.identity_map), 0)
+            # And reading ORM instances doesn't join their TODO list anymore
+            with QueryCounter(db.engine) as query_counter:
+                TODOItem.get_all(todolist_id)
+            self.assertNotIn('JOIN', query_counter.statements[0])
+
+    def test_pool_stats(self):
+        self.client.get(self.todoitems_endpoint)
+        response = self.client.get('/internal/pool')
+        if self.app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+            self.assertEqual(response.status_code, 404)  # SQLite doesn't use a queue pool
+        else:
+            self.assertEqual(response.status_code, 200)
+            stats = response.get_json()
+            self.assertEqual(stats['pool_size'], self.app.config['DB_POOL_SIZE'])
+            self.assertGreaterEqual(stats['checkouts'], 1)
+            self.assertEqual(stats['checked_out'], 0)
+
+        # Checkouts that time out waiting for a connection are counted too
+        pool = InstrumentedQueuePool(lambda: sqlite3.connect(':memory:'), pool_size=1, max_overflow=0, timeout=0.01)
+        connection = pool.connect()
+        with self.assertRaises(PoolTimeoutError):
+            pool.connect()
+        stats = pool.get_stats()
+        self.assertEqual((stats['checkouts'], stats['timeouts'], stats['checked_out']), (2, 1, 1))
+        self.assertGreaterEqual(stats['wait_ms_max'], 10)
+        connection.close()
+
+    def test_internal_api(self):
+        self.assertEqual(self.client.get('/internal/limits').status_code, 200)
+        # Disabled, the endpoints don't even exist
+        with mock.patch.object(TestingConfig, 'INTERNAL_API_ENABLED', False):
+            client = create_app(Env.TESTING).test_client()
+        for endpoint in ('cache', 'events', 'limits', 'pool', 'replicas', 'metrics'):
+            self.assertEqual(client.get('/internal/' + endpoint).status_code, 404, endpoint)
+        # With a token, they require it
+        with mock.patch.object(TestingConfig, 'INTERNAL_API_TOKEN', 's3cr3t'):
+            client = create_app(Env.TESTING).test_client()
+        self.assertEqual(client.get('/internal/limits').status_code, 401)
+        self.assertEqual(client.get('/internal/limits', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+        self.assertEqual(client.get('/internal/limits', headers={'Authorization': 'Bearer s3cr3t'}).status_code, 200)
+
+    def test_instrumentation(self):
+        # It's off by default
+        response = self.client.get(self.todoitems_endpoint)
+        self.assertNotIn('Server-Timing', response.headers)
+        self.assertEqual(self.client.get('/internal/metrics').status_code, 404)
+
+        with tempfile.TemporaryDirectory() as profile_dir:
+            instrumentation_config = {
+                'INSTRUMENTATION_ENABLED': True, 'PROFILE_SAMPLE_RATE': 1, 'PROFILE_SLOW_REQUEST_MS': 0,
+                'PROFILE_DIR': profile_dir,
+            }
+            with mock.patch.multiple(TestingConfig, **instrumentation_config):
+                client = create_app(Env.TESTING).test_client()
+            self.assertEqual(client.post(self.todoitems_endpoint, json={'name': 'Measure me!'}).status_code, 201)
+            response = client.get(self.todoitems_endpoint)
+            server_timing = response.headers['Server-Timing']
+            self.assertRegex(
+                server_timing, r'app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ statements", serialize;dur=[\d.]+')
+            # Every request was profiled, and all of them were "slow"
+            self.assertEqual(len(os.listdir(profile_dir)), 2)
+
+        metrics = client.get('/internal/metrics').get_json()
+        stats = metrics['GET /api/todoitems']
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(sum(stats['latency_ms']['buckets'].values()), 1)
+        self.assertGreaterEqual(stats['statements_mean'], 2)
+        self.assertEqual(stats['response_bytes_mean'], len(response.get_data()))
+        self.assertEqual(metrics['POST /api/todoitems']['count'], 1)
+
+    def test_read_replicas(self):
+        # Two SQLite files stand in for the primary DB and its replica, which only gets what's copied to it
+        with tempfile.TemporaryDirectory() as db_dir:
+            primary_path, replica_path = os.path.join(db_dir, 'primary.db'), os.path.join(db_dir, 'replica.db')
+            replica_uris = ['sqlite:///' + os.path.join(db_dir, 'missing', 'replica.db'), 'sqlite:///' + replica_path]
+            with mock.patch.multiple(
+                    TestingConfig, SQLALCHEMY_DATABASE_URI='sqlite:///' + primary_path, DB_REPLICA_URIS=replica_uris):
+                app = create_app(Env.TESTING)
+            with app.app_context():
+                db.create_all()
+                load_initial_db_data(app, db)
+            writer, reader = app.test_client(), app.test_client()
+            self.assertEqual(writer.post(self.todoitems_endpoint, json={'name': 'Replicate me!'}).status_code, 201)
+            shutil.copyfile(primary_path, replica_path)
+            response = writer.post(self.todoitems_endpoint, json={'name': 'Not replicated yet'})
+            self.assertEqual(response.get_json()['name'], 'Not replicated yet')
+
+            # Reads go to the healthy replica, unless the client just wrote something
+            self.assertEqual([x['name'] for x in reader.get(self.todoitems_endpoint).get_json()], ['Replicate me!'])
+            self.assertEqual(len(writer.get(self.todoitems_endpoint).get_json()), 2)
+            todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=response.get_json()['id'])
+            self.assertEqual(reader.put(todoitem_url, json={'completed': True}).get_json()['completed'], True)
+            self.assertEqual(reader.get(todoitem_url).get_json()['completed'], True)
+            # Once that's over, they go back to the replica
+            app.config['DB_REPLICA_READ_YOUR_WRITES'] = 0
+            self.assertEqual(len(writer.get(self.todoitems_endpoint).get_json()), 1)
+            stats = reader.get('/internal/replicas').get_json()
+            self.assertEqual([(x['healthy'], x['reads']) for x in stats['replicas']], [(False, 0), (True, 2)])
+            self.assertEqual(stats['fallbacks'], 0)
+            # Frontends of other origins may send the cookie back
+            response = writer.get(self.todoitems_endpoint, headers={'Origin': TestingConfig.CORS_ORIGINS[0]})
+            self.assertEqual(response.headers['Access-Control-Allow-Credentials'], 'true')
+
+            with app.app_context():
+                db.session.remove()
+                dispose_db_connections(app, db)
+
+        # A Postgres replica that never answers is given up on after `DB_REPLICA_CONNECT_TIMEOUT` seconds
+        if not self.app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+            return
+        with socket.socket() as listener:
+            listener.bind(('127.0.0.1', 0))
+            listener.listen(1)
+            replica_uri = 'postgresql://todo@127.0.0.1:{}/todo'.format(listener.getsockname()[1])
+            with mock.patch.multiple(TestingConfig, DB_REPLICA_URIS=[replica_uri], DB_REPLICA_CONNECT_TIMEOUT=2):
+                app = create_app(Env.TESTING)
+            started = time.monotonic()
+            response = app.test_client().get(self.todoitems_endpoint)
+            self.assertEqual(response.status_code, 200)
+            self.assertLess(time.monotonic() - started, 10)
+            self.assertEqual(get_replica_set(app).get_stats()['fallbacks'], 1)
+            with app.app_context():
+                dispose_db_connections(app, db)
+
+    @unittest.skipIf(create_async_app is None, 'The async serving mode is not installed')
+    def test_async_api(self):
+        if not self.app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+            self.skipTest('The async serving mode only supports Postgres')
+        for idx in range(1, 4):
+            request_data = {'name': 'Async TODO item #{}'.format(idx), 'completed': idx % 2 == 0}
+            todoitem_id = self.client.post(self.todoitems_endpoint, json=request_data).get_json()['id']
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id)
+        # Moving the completed one to the archive
+        with self.app.app_context():
+            self.assertEqual(TODOItem.archive_completed(timedelta(days=-1)), 1)
+        archived_todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=todoitem_id - 1)
+        todolist_id = self.client.post('/api/todolists', json={'name': 'Async TODO list'}).get_json()['id']
+        self.client.post('/api/todolists/{}/items'.format(todolist_id), json={'name': 'Async TODO list item'})
+
+        async_app = create_async_app(Env.TESTING)
+        async_api = async_app.state.todoitems_api
+        with ASGITestClient(async_app) as async_client:
+            # Both apps answer the same requests with the same responses, byte for byte
+            requests = [
+                (self.todoitems_endpoint, {}),
+                (self.todoitems_endpoint, {'limit': 2}),
+                (self.todoitems_endpoint, {'since': '0'}),
+                (self.todoitems_endpoint, {'limit': 0}),
+                (todoitem_url, {}),
+                (self.todoitems_endpoint, {'include_archived': 1}),
+                (self.todoitems_endpoint, {'include_archived': 1, 'limit': 2}),
+                (self.todoitems_endpoint, {'include_archived': 1, 'completed': 1, 'sort': 'modified'}),
+                (self.todoitems_endpoint, {'include_archived': 1, 'q': 'async item'}),
+                (self.todoitems_endpoint, {'include_archived': 1, 'q': 'async item', 'completed': 1}),
+                (self.todoitems_endpoint, {'q': 'async item', 'sort': 'modified'}),
+                (self.todoitems_endpoint, {'include_archived': 1, 'stream': 1}),
+                (self.todoitems_endpoint, {'include_archived': 'maybe'}),
+                (archived_todoitem_url, {}),
+                (archived_todoitem_url, {'include_archived': 1}),
+                ('/api/todoitems/stats', {'include_archived': 1}),
+                ('/api/todolists/{}/items'.format(todolist_id), {}),
+                ('/api/todolists/{}/items'.format(todolist_id + 1), {}),
+            ]
+            for url, query_string in requests:
+                response = self.client.get(url, query_string=query_string)
+                async_response = async_client.get(url, params=query_string)
+                self.assertEqual(async_response.status_code, response.status_code, (url, query_string))
+                self.assertEqual(async_response.content, response.get_data(), (url, query_string))
+                for header in ('ETag', 'X-Next-Cursor'):
+                    self.assertEqual(async_response.headers.get(header), response.headers.get(header))
+            self.assertEqual(async_client.post(self.todoitems_endpoint, json={'name': 'XX'}).json(),
+                             self.client.post(self.todoitems_endpoint, json={'name': 'XX'}).get_json())
+
+            # And both of them see the writes of the other one
+            etag = self.client.get(self.todoitems_endpoint).headers['ETag']
+            response = async_client.put(todoitem_url, json={'completed': True, 'name': 'Async TODO item updated'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(todoitem_url).get_json(), response.json())
+            response = self.client.get(self.todoitems_endpoint, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(async_client.delete(todoitem_url).status_code, 204)
+            changes = self.client.get(self.todoitems_endpoint, query_string={'since': '0'}).get_json()
+            self.assertEqual(changes['deleted'], [todoitem_id - 1, todoitem_id])  # Archived ones show up as deleted
+            self.assertEqual(async_client.delete(todoitem_url).status_code, 404)
+
+            # Items deleted by someone else right before they're updated aren't written (nor is their TODO list)
+            todoitem_url = self.todoitems_detail_endpoint.format(
+                todoitem_id=async_client.post(self.todoitems_endpoint, json={'name': 'Deleted meanwhile'}).json()['id'])
+            get_todoitem_row, etags = async_api._get_todoitem_row, []
+
+            async def get_deleted_todoitem_row(*args):
+                todoitem = await get_todoitem_row(*args)
+                self.client.delete(todoitem_url)
+                etags.append(self.client.get(self.todoitems_endpoint).headers['ETag'])
+                return todoitem
+
+            with mock.patch.object(async_api, '_get_todoitem_row', get_deleted_todoitem_row):
+                response = async_client.put(todoitem_url, json={'name': 'Updated meanwhile'})
+            self.assertEqual((response.status_code, response.json()['message']),
+                             (404, 'The requested TODO item does not exist'))
+            self.assertEqual(self.client.get(self.todoitems_endpoint).headers['ETag'], etags[0])
+            # And so are TODO lists deleted right after they're looked up
+            async_api.default_todolist_id = todolist_id + 1
+            for response in (async_client.post(self.todoitems_endpoint, json={'name': 'Nowhere to go'}),
+                             async_client.get('/api/todoitems/stats')):
+                self.assertEqual((response.status_code, response.json()['message']),
+                                 (404, 'The requested TODO list does not exist'))
+
+        # The change feed is served from the event loop too, and events go both ways through Postgres
+        events_endpoint = '/api/todoitems/events'
+        events_config = {
+            'EVENTS_TRANSPORT': 'app.events.PostgresTransport', 'EVENTS_HEARTBEAT': 0.1, 'EVENTS_STREAM_DURATION': 1,
+            'EVENTS_POLL_TIMEOUT': 5,
+        }
+        with mock.patch.multiple(TestingConfig, **events_config):
+            client, async_app = create_app(Env.TESTING).test_client(), create_async_app(Env.TESTING)
+            with ASGITestClient(async_app) as async_client:
+                # Long-polling clients of the async app get the writes of the sync one
+                cursor = async_client.get(self.todoitems_endpoint, params={'since': '0'}).json()['cursor']
+                timer = threading.Timer(
+                    0.2, lambda: client.post(self.todoitems_endpoint, json={'name': 'Sync event'}))
+                timer.start()
+                response = async_client.get(events_endpoint, params={'since': cursor})
+                timer.join()
+                self.assertEqual([x['name'] for x in response.json()['items']], ['Sync event'])
+
+                # And the other way around
+                response = client.get(events_endpoint, headers={'Accept': 'text/event-stream'}, buffered=False)
+                chunks = (x for x in response.iter_encoded() if not x.startswith(b':'))
+                async_client.post(self.todoitems_endpoint, json={'name': 'Async event'})
+                self.assertIn(b'"name": "Async event"', next(chunks))
+                response.close()
+
+                # Resuming streams catch up from the DB first
+                response = async_client.get(
+                    events_endpoint, headers={'Accept': 'text/event-stream', 'Last-Event-ID': cursor})
+                self.assertTrue(response.headers['Content-Type'].startswith('text/event-stream'))
+                sync_event = response.text.split('\n\n')[0].splitlines()
+                self.assertEqual(sync_event[0], 'event: sync')
+                items = json.loads(sync_event[2][len('data: '):])['items']
+                self.assertEqual([x['name'] for x in items], ['Sync event', 'Async event'])
+
+                # Waiting clients only hold a bit of memory there, but they're capped too
+                async_app.state.todoitems_api.event_broker.max_subscribers = 0
+                response = async_client.get(events_endpoint)
+                self.assertEqual(response.status_code, 503)
+                self.assertEqual(response.headers['Retry-After'], '1')
+
     def test_update(self):
         # Creating a new TODO item
         name = 'Learn Flask!'
@@ -109,6 +1251,77 @@ class TODOItemsEndpointTestCase(unittest.TestCase):
         response = self.client.put(self.todoitems_detail_endpoint.format(todoitem_id='000'))
         self.assertEqual(response.status_code, 404)
 
+    def test_write_statements(self):
+        response_json = self.client.post(self.todoitems_endpoint, json={'name': 'Write TODO item'}).get_json()
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=response_json['id'])
+        with self.app.app_context():
+            engine = db.engine
+
+        def write(method, url, expected_status, **kwargs):
+            # Returns the statements that wrote something, and checks that they were committed at once
+            commits = []
+            on_commit = commits.append
+            event.listen(engine, 'commit', on_commit)
+            try:
+                with QueryCounter(engine) as query_counter:
+                    response = method(url, **kwargs)
+            finally:
+                event.remove(engine, 'commit', on_commit)
+            self.assertEqual(response.status_code, expected_status)
+            writes = [x for x in query_counter.statements if not x.lstrip().startswith('SELECT')]
+            self.assertEqual(len(commits), 1 if writes else 0)
+            return writes
+
+        def get_set_columns(update):
+            self.assertTrue(update.startswith('UPDATE todoitems SET '), update)
+            return re.findall(r'(\w+)=', update.split(' WHERE ')[0])
+
+        # Creating: the TODO list version (and counts) plus the item
+        writes = write(self.client.post, self.todoitems_endpoint, 201, json={'name': 'Another write TODO item'})
+        self.assertEqual([x.split()[0] for x in writes], ['UPDATE', 'INSERT'])
+        # Updating: only changed columns are written, and the item is saved just once
+        writes = write(self.client.put, todoitem_url, 200, json={'name': 'Renamed write TODO item'})
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(get_set_columns(writes[-1]), ['name', 'modified', 'version'])
+        # Completing it also updates the counts of the TODO list
+        writes = write(self.client.put, todoitem_url, 200, json={'completed': True})
+        self.assertEqual(len(writes), 3)
+        self.assertEqual(get_set_columns(writes[-1]), ['completed', 'modified', 'version'])
+        # Nothing changes, so nothing is written (the item is just read)
+        with QueryCounter(engine) as query_counter:
+            response = self.client.put(todoitem_url, json={'name': 'Renamed write TODO item', 'completed': True})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['name'], 'Renamed write TODO item')
+        self.assertEqual(query_counter.count, 1)
+        # Deleting: the TODO list version and counts, the tombstone and the item
+        writes = write(self.client.delete, todoitem_url, 204)
+        self.assertEqual([x.split()[0] for x in writes], ['UPDATE', 'UPDATE', 'INSERT', 'DELETE'])
+
+        # Batches update their items with a statement per set of changed columns, and on Postgres, a round trip too
+        todoitem_ids = []
+        for idx in range(4):
+            response = self.client.post(self.todoitems_endpoint, json={'name': 'Batch write #{}'.format(idx)})
+            todoitem_ids.append(response.get_json()['id'])
+        updates = [{'id': x, 'completed': True} for x in todoitem_ids[:3]]
+        updates.append({'id': todoitem_ids[3], 'name': 'Renamed'})
+        executemanys = []
+
+        def on_execute(conn, cursor, statement, parameters, context, executemany):
+            executemanys.append(executemany)
+
+        event.listen(engine, 'before_cursor_execute', on_execute)
+        try:
+            writes = write(self.client.post, '/api/todoitems/batch', 200, json={'update': updates})
+        finally:
+            event.remove(engine, 'before_cursor_execute', on_execute)
+        self.assertEqual(sorted(get_set_columns(x) for x in writes if x.startswith('UPDATE todoitems')),
+                         [['completed', 'modified', 'version'], ['name', 'modified', 'version']])
+        if engine.dialect.name == 'postgresql':
+            self.assertFalse(any(executemanys))
+        todoitems = {x['id']: x for x in self.client.get(self.todoitems_endpoint).get_json()}
+        self.assertEqual([todoitems[x]['completed'] for x in todoitem_ids], [True, True, True, False])
+        self.assertEqual(todoitems[todoitem_ids[3]]['name'], 'Renamed')
+
     def test_delete(self):
         # Creating a new TODO item
         request_data = {'name': 'Join team Orca!'}
@@ -128,6 +1341,12 @@ class TODOItemsEndpointTestCase(unittest.TestCase):
         # Non-existing TODO items cannot be deleted
         response = self.client.delete(self.todoitems_detail_endpoint.format(todoitem_id='000'))
         self.assertEqual(response.status_code, 404)
+        # The IDs of deleted items aren't handed out again (SQLite would reuse the highest one), so new items can be
+        # deleted too
+        response = self.client.post(self.todoitems_endpoint, json=request_data)
+        self.assertGreater(response.get_json()['id'], response_json['id'])
+        todoitem_url = self.todoitems_detail_endpoint.format(todoitem_id=response.get_json()['id'])
+        self.assertEqual(self.client.delete(todoitem_url).status_code, 204)
 
 
 if __name__ == '__main__':